@@ -0,0 +1,534 @@
+#Packing the board into a single 64-bit integer to make moves a handful of table lookups
+
+import random
+import numpy as np
+from GameEmulator.profiling import timed
+
+ROW_MASK = 0xFFFF
+COL_MASK = 0x000F000F000F000F
+
+
+def _unpack_col(row):
+    """
+    Spread the four nibbles of a 16-bit row over the four rows of a board.
+
+    Nibble i of the row ends up at bit offset 16 * i, so the result is a single
+    column (column 0) of a packed board.
+
+    Args:
+        row (int): A packed 16-bit row.
+
+    Returns:
+        int: The row laid out as column 0 of a packed board.
+    """
+
+    return (row | (row << 12) | (row << 24) | (row << 36)) & COL_MASK
+
+
+def _reverse_row(row):
+    """
+    Reverse the order of the four nibbles of a 16-bit row.
+
+    Args:
+        row (int): A packed 16-bit row.
+
+    Returns:
+        int: The row with its tiles in reverse order.
+    """
+
+    return ((row >> 12) | ((row >> 4) & 0x00F0) | ((row << 4) & 0x0F00) | (row << 12)) & ROW_MASK
+
+
+def _slide_row_left(row):
+    """
+    Slide and merge a single packed row to the left.
+
+    Args:
+        row (int): A packed 16-bit row of tile exponents.
+
+    Returns:
+        tuple: The resulting packed row and the score gained by the merges.
+    """
+
+    tiles = [(row >> (4 * i)) & 0xF for i in range(4)]
+    tiles = [t for t in tiles if t != 0]
+    merged = []
+    score = 0
+    i = 0
+    while i < len(tiles):
+        # Exponents saturate at 15 (32768) since they have to fit in a nibble
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1] and tiles[i] != 0xF:
+            merged.append(tiles[i] + 1)
+            score += 1 << (tiles[i] + 1)
+            i += 2
+        else:
+            merged.append(tiles[i])
+            i += 1
+    result = 0
+    for i, t in enumerate(merged):
+        result |= t << (4 * i)
+    return result, score
+
+
+def _build_tables():
+    """
+    Precompute the result of every move for every one of the 65,536 possible rows.
+
+    Returns:
+        tuple: The left/right row tables, the up/down column tables, the score
+        table and the moved-flag table.
+    """
+
+    row_left = [0] * 65536
+    row_right = [0] * 65536
+    col_up = [0] * 65536
+    col_down = [0] * 65536
+    row_score = [0] * 65536
+    row_moved = [0] * 65536
+
+    for row in range(65536):
+        left, score = _slide_row_left(row)
+        right = _reverse_row(_slide_row_left(_reverse_row(row))[0])
+        row_left[row] = left
+        row_right[row] = right
+        col_up[row] = _unpack_col(left)
+        col_down[row] = _unpack_col(right)
+        # A run of equal tiles merges into the same pairs from either side,
+        # so the score gain is the same for both directions
+        row_score[row] = score
+        row_moved[row] = (left != row) | ((right != row) << 1)
+
+    return row_left, row_right, col_up, col_down, row_score, row_moved
+
+
+# Lookup tables indexed by a packed 16-bit row. The column tables hold the moved
+# row already spread out as column 0 of a board so it only has to be shifted into place.
+# Bit 0 of ROW_MOVED is set when moving the row left changes it, bit 1 when moving it right does.
+ROW_LEFT, ROW_RIGHT, COL_UP, COL_DOWN, ROW_SCORE, ROW_MOVED = _build_tables()
+
+
+def transpose(board):
+    """
+    Transpose a packed board, turning its columns into rows.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        int: The transposed packed board.
+    """
+
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def mirror(board):
+    """
+    Mirror a packed board left to right.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        int: The packed board with the order of the tiles in every row reversed.
+    """
+
+    board = ((board & 0x0F0F0F0F0F0F0F0F) << 4) | ((board >> 4) & 0x0F0F0F0F0F0F0F0F)
+    return ((board & 0x00FF00FF00FF00FF) << 8) | ((board >> 8) & 0x00FF00FF00FF00FF)
+
+
+def flip(board):
+    """
+    Flip a packed board upside down.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        int: The packed board with the order of its rows reversed.
+    """
+
+    board = ((board & 0x0000FFFF0000FFFF) << 16) | ((board >> 16) & 0x0000FFFF0000FFFF)
+    return ((board & 0x00000000FFFFFFFF) << 32) | (board >> 32)
+
+
+def symmetries(board):
+    """
+    List the 8 rotations and reflections of a packed board.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        list: The 8 transformed packed boards, starting with the board itself.
+    """
+
+    boards = [board, mirror(board), flip(board), mirror(flip(board))]
+    return boards + [transpose(b) for b in boards]
+
+
+def canonical(board):
+    """
+    Return the smallest of the 8 rotations and reflections of a packed board.
+
+    Boards that are equal up to a rotation or reflection share the same canonical board.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        int: The canonical packed board.
+    """
+
+    return min(symmetries(board))
+
+
+def move_left(board):
+    """
+    Move a packed board to the left.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        tuple: The new packed board and the score gained by the move.
+    """
+
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = (board >> 48) & ROW_MASK
+    new_board = ROW_LEFT[r0] | (ROW_LEFT[r1] << 16) | (ROW_LEFT[r2] << 32) | (ROW_LEFT[r3] << 48)
+    return new_board, ROW_SCORE[r0] + ROW_SCORE[r1] + ROW_SCORE[r2] + ROW_SCORE[r3]
+
+
+def move_right(board):
+    """
+    Move a packed board to the right.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        tuple: The new packed board and the score gained by the move.
+    """
+
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = (board >> 48) & ROW_MASK
+    new_board = ROW_RIGHT[r0] | (ROW_RIGHT[r1] << 16) | (ROW_RIGHT[r2] << 32) | (ROW_RIGHT[r3] << 48)
+    return new_board, ROW_SCORE[r0] + ROW_SCORE[r1] + ROW_SCORE[r2] + ROW_SCORE[r3]
+
+
+def move_up(board):
+    """
+    Move a packed board up.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        tuple: The new packed board and the score gained by the move.
+    """
+
+    t = transpose(board)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = (t >> 48) & ROW_MASK
+    new_board = COL_UP[c0] | (COL_UP[c1] << 4) | (COL_UP[c2] << 8) | (COL_UP[c3] << 12)
+    return new_board, ROW_SCORE[c0] + ROW_SCORE[c1] + ROW_SCORE[c2] + ROW_SCORE[c3]
+
+
+def move_down(board):
+    """
+    Move a packed board down.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        tuple: The new packed board and the score gained by the move.
+    """
+
+    t = transpose(board)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = (t >> 48) & ROW_MASK
+    new_board = COL_DOWN[c0] | (COL_DOWN[c1] << 4) | (COL_DOWN[c2] << 8) | (COL_DOWN[c3] << 12)
+    return new_board, ROW_SCORE[c0] + ROW_SCORE[c1] + ROW_SCORE[c2] + ROW_SCORE[c3]
+
+
+# Indexed by the same direction codes as QGame: 0: left, 1: up, 2: right, 3: down
+MOVES = (move_left, move_up, move_right, move_down)
+
+
+def move(board, direction):
+    """
+    Move a packed board in a given direction.
+
+    Args:
+        board (int): A packed board.
+        direction (int): The direction in which to move the board.
+                         0: left, 1: up, 2: right, 3: down
+
+    Returns:
+        tuple: The new packed board, the score gained and whether any tile moved.
+    """
+
+    new_board, score = MOVES[direction](board)
+    return new_board, score, new_board != board
+
+
+def afterstates(board):
+    """
+    Move a packed board in all four directions at once.
+
+    The rows are extracted and the board transposed only once for the four moves,
+    and left/right (up/down) share their score, so this is cheaper than four calls to move.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        tuple: The four new packed boards and the four score gains, both indexed by direction
+        (0: left, 1: up, 2: right, 3: down), and the legal-move bitmask with bit d set
+        when direction d changes the board.
+    """
+
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = (board >> 48) & ROW_MASK
+    t = transpose(board)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = (t >> 48) & ROW_MASK
+
+    boards = (ROW_LEFT[r0] | (ROW_LEFT[r1] << 16) | (ROW_LEFT[r2] << 32) | (ROW_LEFT[r3] << 48),
+              COL_UP[c0] | (COL_UP[c1] << 4) | (COL_UP[c2] << 8) | (COL_UP[c3] << 12),
+              ROW_RIGHT[r0] | (ROW_RIGHT[r1] << 16) | (ROW_RIGHT[r2] << 32) | (ROW_RIGHT[r3] << 48),
+              COL_DOWN[c0] | (COL_DOWN[c1] << 4) | (COL_DOWN[c2] << 8) | (COL_DOWN[c3] << 12))
+    row_score = ROW_SCORE[r0] + ROW_SCORE[r1] + ROW_SCORE[r2] + ROW_SCORE[r3]
+    col_score = ROW_SCORE[c0] + ROW_SCORE[c1] + ROW_SCORE[c2] + ROW_SCORE[c3]
+
+    # Bit 0 of ROW_MOVED is the left (up) move, bit 1 the right (down) move
+    rows_moved = ROW_MOVED[r0] | ROW_MOVED[r1] | ROW_MOVED[r2] | ROW_MOVED[r3]
+    cols_moved = ROW_MOVED[c0] | ROW_MOVED[c1] | ROW_MOVED[c2] | ROW_MOVED[c3]
+    legal = (rows_moved & 1) | ((cols_moved & 1) << 1) | ((rows_moved & 2) << 1) | ((cols_moved & 2) << 2)
+    return boards, (row_score, col_score, row_score, col_score), legal
+
+
+def can_move(board):
+    """
+    Check if there is at least one move that changes the board.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        bool: True if there are valid moves left, False otherwise.
+    """
+
+    t = transpose(board)
+    for shift in (0, 16, 32, 48):
+        if ROW_MOVED[(board >> shift) & ROW_MASK] or ROW_MOVED[(t >> shift) & ROW_MASK]:
+            return True
+    return False
+
+
+def empty_cells(board):
+    """
+    List the empty cells of a packed board.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        list: The nibble indices (4 * row + col) of the empty cells.
+    """
+
+    return [i for i in range(16) if not (board >> (4 * i)) & 0xF]
+
+
+def add_random_tile(board, rng=random):
+    """
+    Place a '2' (90%) or a '4' (10%) on a random empty cell.
+
+    Args:
+        board (int): A packed board.
+        rng (random.Random): The random number generator to draw from.
+
+    Returns:
+        int: The packed board with the new tile, unchanged if the board is full.
+    """
+
+    cells = empty_cells(board)
+    if not cells:
+        return board
+    cell = cells[int(rng.random() * len(cells))]
+    exponent = 1 if rng.random() < 0.9 else 2
+    return board | (exponent << (4 * cell))
+
+
+def max_exponent(board):
+    """
+    Return the largest tile exponent on a packed board.
+    """
+
+    return max((board >> (4 * i)) & 0xF for i in range(16))
+
+
+def from_array(board):
+    """
+    Pack a 4x4 array of tile values into a 64-bit integer of tile exponents.
+
+    Args:
+        board (numpy.ndarray): A 4x4 board of tile values (0, 2, 4, ...).
+
+    Returns:
+        int: The packed board.
+    """
+
+    packed = 0
+    for i, value in enumerate(np.asarray(board).ravel().tolist()):
+        if value:
+            packed |= (int(value).bit_length() - 1) << (4 * i)
+    return packed
+
+
+def to_array(board):
+    """
+    Unpack a 64-bit packed board into a 4x4 array of tile values.
+
+    Args:
+        board (int): A packed board.
+
+    Returns:
+        numpy.ndarray: A 4x4 board of tile values (0, 2, 4, ...).
+    """
+
+    exponents = np.array([(board >> (4 * i)) & 0xF for i in range(16)], dtype=int)
+    return np.where(exponents > 0, 1 << exponents, 0).reshape(4, 4)
+
+
+class Game2048():
+    """
+    Class to represent the 2048 game on a packed 64-bit board.
+
+    Mirrors the interface of QGame.Game2048 so it can be swapped in directly.
+
+    Attributes:
+        state (int): The packed board, one 4-bit tile exponent per cell.
+        game_over (bool): A flag indicating whether the game is over.
+        score (int): The current score of the game.
+    """
+
+    def __init__(self, seed=None):
+        """
+        Initialize the game.
+
+        Args:
+            seed (int, optional): Seed for the game's own random number generator.
+        """
+        self.cell_count = 4
+        self.seed(seed)
+        self.reset()
+
+    def seed(self, seed=None):
+        """
+        Reseed the game's own random number generator.
+
+        Args:
+            seed (int, optional): The seed, None seeds from the operating system.
+        """
+
+        self.rng = random.Random(seed)
+
+    def reset(self):
+        """
+        Reset the game.
+
+        Clears the board, draws a new piece on it, resets the game_over flag to False,
+        and sets the score to 0.
+        """
+
+        self.state = 0
+        self.draw_new_pieces()
+        self.game_over = False
+        self.score = 0
+
+    @property
+    def board(self):
+        """
+        The board as a 4x4 numpy array of tile values.
+        """
+        return to_array(self.state)
+
+    @board.setter
+    def board(self, board):
+        self.state = from_array(board)
+
+    def draw_new_pieces(self):
+        """
+        Draw a new '2' (90%) or '4' (10%) on a random empty cell.
+        """
+
+        self.state = add_random_tile(self.state, self.rng)
+
+    def move(self, direction):
+        """
+        Move the board in a given direction without changing the game.
+
+        Args:
+            direction (int): The direction in which to move the board.
+                             0: left, 1: up, 2: right, 3: down
+
+        Returns:
+            numpy.ndarray: The board after moving in the specified direction.
+        """
+
+        return to_array(MOVES[direction](self.state)[0])
+
+    def check_valid(self):
+        """
+        Check if there are valid moves left.
+
+        Returns:
+            bool: True if there are valid moves left, False otherwise.
+        """
+
+        return can_move(self.state)
+
+    @timed("BitGame.take_turn")
+    def take_turn(self, direction):
+        """
+        Take a turn by moving the board in a direction.
+
+        Updates the board and score if the move is valid and draws a new piece.
+        If the move does not change the board, no new piece is drawn.
+
+        Args:
+            direction (int): The direction in which to move the board.
+                             0: left, 1: up, 2: right, 3: down
+
+        Returns:
+            bool: True if the move changed the board, False otherwise.
+        """
+
+        new_state, score = MOVES[direction](self.state)
+        if new_state == self.state:
+            return False
+        self.state = new_state
+        self.score += score
+        self.draw_new_pieces()
+        return True
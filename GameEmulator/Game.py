@@ -1,25 +1,39 @@
 #Creating a visual render of the 2048 game
 
-import random  
+import time
 import pygame  
+from GameEmulator.core import GameCore, DEFAULT_BACKEND
+from GameEmulator.profiling import timed
 
 class Game2048:
     """
     A class representing a game of 2048.
     """
-    def __init__(self):
+    def __init__(self, headless=False, render_every=1, render_fps=None, backend=DEFAULT_BACKEND, seed=None):
         """
         Initializing the Game using Pygame
-        """
-        pygame.init()  
 
+        headless: never open a display, automated actions run the game logic only at full speed
+        render_every: render only every Nth automated action (spectator mode when above 1)
+        render_fps: render automated actions at most this many times per wall-clock second (spectator mode)
+        backend: GameCore backend playing the moves and tile spawns ('python', 'numpy' or 'packed')
+        seed: seed of the tile spawns, None draws from the global random module
+        """
+        self.core = GameCore(backend, seed)  # Game rules, board_values is loaded into it for every move
         self.WIDTH = 400  # Width of the game window
         self.HEIGHT = 500  # Height of the game window
-        self.screen = pygame.display.set_mode([self.WIDTH, self.HEIGHT])  # Creating game window
-        pygame.display.set_caption('2048')  # Setting window title
-        self.timer = pygame.time.Clock()  # Timer for controlling FPS
         self.fps = 60  # Frames per second
-        self.font = pygame.font.Font('freesansbold.ttf', 24)  # Font for text rendering
+        self.headless = headless  # Flag to run without a display
+        self.render_every = render_every  # Number of automated actions per rendered frame
+        self.render_fps = render_fps  # Wall-clock frame rate of the spectator mode, None to count actions
+        self.steps = 0  # Count of automated actions
+        self.last_render = 0.0  # Wall-clock time of the last rendered frame
+        if not headless:
+            pygame.init()  
+            self.screen = pygame.display.set_mode([self.WIDTH, self.HEIGHT])  # Creating game window
+            pygame.display.set_caption('2048')  # Setting window title
+            self.timer = pygame.time.Clock()  # Timer for controlling FPS
+            self.font = pygame.font.Font('freesansbold.ttf', 24)  # Font for text rendering
         self.action_space = ['UP', 'DOWN', 'LEFT', 'RIGHT']  # Possible actions in the game
         self.observation_space = (4, 4)  # Size of the game board
 
@@ -49,6 +63,17 @@ class Game2048:
         self.init_count = 0  # Count of initial tiles
         self.direction = ''  # Direction of movement
         self.score = 0  # Game score
+
+        # Rendering caches, so a frame only blits surfaces that were rendered once
+        self.tile_surfaces = {}  # Pre-rendered tile (colour, border and text) per tile value
+        self.score_surface = None  # Rendered score text
+        self.score_drawn = None  # Score shown by score_surface
+        self.drawn_values = None  # Board values shown on screen, None when nothing is drawn yet
+        self.dirty_rects = []  # Screen areas changed since the display was last updated
+        self.full_redraw = True  # Flag to redraw the whole screen on the next frame
+        if not headless:
+            self.game_over_texts = (self.font.render('Game Over!', True, 'white'),
+                                    self.font.render('Press Enter to Restart', True, 'white'))
     
     
     def draw_over(self):
@@ -56,10 +81,10 @@ class Game2048:
         Method to draw game over screen
         """
         pygame.draw.rect(self.screen, 'black', [50, 50, 300, 100], 0, 10)  # Drawing a rectangle for game over text
-        game_over_text1 = self.font.render('Game Over!', True, 'white')  # Rendering game over text
-        game_over_text2 = self.font.render('Press Enter to Restart', True, 'white')  # Rendering restart instruction
+        game_over_text1, game_over_text2 = self.game_over_texts  # Game over text and restart instruction
         self.screen.blit(game_over_text1, (130, 65))  # Displaying game over text
         self.screen.blit(game_over_text2, (70, 105))  # Displaying restart instruction
+        self.dirty_rects.append(pygame.Rect(50, 50, 300, 100))
     
     
     def draw_board(self):
@@ -67,8 +92,62 @@ class Game2048:
         Method to draw game board
         """
         pygame.draw.rect(self.screen, self.colors['bg'], [0, 0, 400, 400], 0, 10)  # Drawing game board background
-        score_text = self.font.render(f'Score: {self.score}', True, 'black')  # Rendering score text
-        self.screen.blit(score_text, (10, 410))  # Displaying score text
+        self.score_drawn = None  # Force the score to be drawn again on the new background
+        self.draw_score()
+
+    def draw_score(self):
+        """
+        Method to draw the score, rendering its text again only when the score changed
+        """
+        if self.score_drawn == self.score:
+            return
+        if self.score_surface is not None:
+            # Clear the previous score text
+            old_rect = self.score_surface.get_rect(topleft=(10, 410))
+            self.screen.fill('gray', old_rect)
+            self.dirty_rects.append(old_rect)
+        self.score_surface = self.font.render(f'Score: {self.score}', True, 'black')  # Rendering score text
+        self.score_drawn = self.score
+        self.dirty_rects.append(self.screen.blit(self.score_surface, (10, 410)))  # Displaying score text
+
+    def draw_frame(self):
+        """
+        Draws the board, redrawing the whole screen only when needed and otherwise
+        just the score and the tiles that changed since the last frame.
+        """
+        if self.full_redraw:
+            self.screen.fill('gray')  # Fill the screen with gray color
+            self.drawn_values = None
+            self.dirty_rects = [self.screen.get_rect()]
+            self.draw_board()
+            self.full_redraw = False
+        self.draw_score()
+        self.draw_pieces()
+
+    def should_render(self):
+        """
+        Decides whether the current automated action is rendered.
+        Never in headless mode, otherwise every render_every actions or
+        at most render_fps times per second.
+        """
+        if self.headless:
+            return False
+        self.steps += 1
+        if self.render_fps is not None:
+            now = time.perf_counter()
+            if now - self.last_render < 1.0 / self.render_fps:
+                return False
+            self.last_render = now
+            return True
+        return self.steps % self.render_every == 0
+
+    def update_display(self):
+        """
+        Pushes the changed areas of the screen to the display.
+        """
+        if self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+            self.dirty_rects = []
     
     
     def state_action(self, action):
@@ -81,85 +160,18 @@ class Game2048:
         self.direction = ''  # Reset direction
         self.spawn_new = True  # Set flag to spawn new tile
 
+    @timed("Game.take_turn")
     def take_turn(self):
         """
         Executes a turn based on the current direction of movement.
         """
-        # Initialize a matrix to track merged tiles
-        merged = [[False for _ in range(4)] for _ in range(4)]
-        # Create a copy of the board to avoid modifying the original
-        new_board = [row[:] for row in self.board_values]
-
-        # Movement and merging logic for each direction
-        if self.direction == 'UP':
-            # Iterate over each cell in the grid
-            for i in range(1, 4):
-                for j in range(4):
-                    # If the current cell is not empty
-                    if new_board[i][j] != 0:
-                        row = i
-                        # Move the tile upwards as far as possible
-                        while row > 0 and new_board[row - 1][j] == 0:
-                            new_board[row - 1][j] = new_board[row][j]
-                            new_board[row][j] = 0
-                            row -= 1
-                        # Merge tiles if possible and update score
-                        if row > 0 and new_board[row - 1][j] == new_board[row][j] and not merged[row - 1][j]:
-                            new_board[row - 1][j] *= 2
-                            self.score += new_board[row - 1][j]
-                            new_board[row][j] = 0
-                            merged[row - 1][j] = True
-
-        elif self.direction == 'DOWN':
-            for i in range(2, -1, -1):
-                for j in range(4):
-                    if new_board[i][j] != 0:
-                        row = i
-                        while row < 3 and new_board[row + 1][j] == 0:
-                            new_board[row + 1][j] = new_board[row][j]
-                            new_board[row][j] = 0
-                            row += 1
-                        if row < 3 and new_board[row + 1][j] == new_board[row][j] and not merged[row + 1][j]:
-                            new_board[row + 1][j] *= 2
-                            self.score += new_board[row + 1][j]
-                            new_board[row][j] = 0
-                            merged[row + 1][j] = True
-
-
-        elif self.direction == 'LEFT':
-            for j in range(1, 4):
-                for i in range(4):
-                    if new_board[i][j] != 0:
-                        col = j
-                        while col > 0 and new_board[i][col - 1] == 0:
-                            new_board[i][col - 1] = new_board[i][col]
-                            new_board[i][col] = 0
-                            col -= 1
-                        if col > 0 and new_board[i][col - 1] == new_board[i][col] and not merged[i][col - 1]:
-                            new_board[i][col - 1] *= 2
-                            self.score += new_board[i][col - 1]
-                            new_board[i][col] = 0
-                            merged[i][col - 1] = True
-
-
-        elif self.direction == 'RIGHT':
-            for j in range(2, -1, -1):
-                for i in range(4):
-                    if new_board[i][j] != 0:
-                        col = j
-                        while col < 3 and new_board[i][col + 1] == 0:
-                            new_board[i][col + 1] = new_board[i][col]
-                            new_board[i][col] = 0
-                            col += 1
-                        if col < 3 and new_board[i][col + 1] == new_board[i][col] and not merged[i][col + 1]:
-                            new_board[i][col + 1] *= 2
-                            self.score += new_board[i][col + 1]
-                            new_board[i][col] = 0
-                            merged[i][col + 1] = True
-
-
-        # Update the board_values
-        self.board_values = new_board
+        if self.direction:
+            # Play the move on the game core and read the board back
+            self.core.board = self.board_values
+            gain, _ = self.core.apply(self.direction)
+            values = self.core.values()
+            self.board_values = [values[0:4], values[4:8], values[8:12], values[12:16]]
+            self.score += gain
 
     
     def environment_state(self):
@@ -176,54 +188,62 @@ class Game2048:
         return self.score  # Return the current score
 
 
+    def get_tile_surface(self, value):
+        """
+        Returns the tile for a value with its colour, border and value text,
+        rendering it the first time the value is seen.
+        """
+        surface = self.tile_surfaces.get(value)
+        if surface is not None:
+            return surface
+
+        if value > 8:
+            value_color = self.colors['light text']
+        else:
+            value_color = self.colors['dark text']
+        if value <= 2048:
+            color = self.colors[value]  # Get the color for the current value
+        else:
+            color = self.colors['other']
+
+        surface = pygame.Surface((75, 75))
+        surface.fill(self.colors['bg'])  # Board background shows in the rounded corners
+        pygame.draw.rect(surface, color, [0, 0, 75, 75], 0, 5)
+        if value > 0:
+            # Render value text on the tile
+            value_len = len(str(value))
+            font = pygame.font.Font('freesansbold.ttf', 48 - (5 * value_len))
+            value_text = font.render(str(value), True, value_color)
+            text_rect = value_text.get_rect(center=(37, 37))
+            surface.blit(value_text, text_rect)
+            pygame.draw.rect(surface, 'black', [0, 0, 75, 75], 2, 5)
+
+        self.tile_surfaces[value] = surface
+        return surface
+
     def draw_pieces(self):
         """
-        Draws each tile on the board with appropriate value and color.
-        Renders value text on each tile.
+        Draws each tile whose value changed since the last frame from its cached surface.
         """
         # Iterate over each cell in the game board
         for i in range(4):
             for j in range(4):
                 value = self.board_values[i][j]  # Get the value of the current cell
-                if value > 8:
-                    value_color = self.colors['light text']
-                else:
-                    value_color = self.colors['dark text']
-                if value <= 2048:
-                    color = self.colors[value]  # Get the color for the current value
-                else:
-                    color = self.colors['other']
-                # Draw a rectangle representing the tile with appropriate color
-                pygame.draw.rect(self.screen, color, [j * 95 + 20, i * 95 + 20, 75, 75], 0, 5)
-                if value > 0:
-                    # Render value text on the tile
-                    value_len = len(str(value))
-                    font = pygame.font.Font('freesansbold.ttf', 48 - (5 * value_len))
-                    value_text = font.render(str(value), True, value_color)
-                    text_rect = value_text.get_rect(center=(j * 95 + 57, i * 95 + 57))
-                    self.screen.blit(value_text, text_rect)
-                    pygame.draw.rect(self.screen, 'black', [j * 95 + 20, i * 95 + 20, 75, 75], 2, 5)
+                if self.drawn_values is not None and self.drawn_values[i][j] == value:
+                    continue
+                self.dirty_rects.append(self.screen.blit(self.get_tile_surface(value), (j * 95 + 20, i * 95 + 20)))
+        self.drawn_values = [row[:] for row in self.board_values]
 
+    @timed("Game.new_pieces")
     def new_pieces(self):
         """
         Spawns new tiles on empty cells of the board.
         Returns True if the board is full, else False.
         """
-        count = 0  # Counter for new tiles spawned
-        full = False  # Flag to indicate if the board is full
-        # Iterate over each cell in the board and spawn a new tile if the cell is empty
-        while any(0 in row for row in self.board_values) and count < 1:
-            row = random.randint(0, 3)  # Randomly select a row
-            col = random.randint(0, 3)  # Randomly select a column
-            if self.board_values[row][col] == 0:  # Check if the selected cell is empty
-                count += 1
-                # Randomly choose whether to spawn a tile with value 2 or 4
-                if random.randint(1, 10) == 10:
-                    self.board_values[row][col] = 4
-                else:
-                    self.board_values[row][col] = 2
-        if count < 1:  # Check if no new tiles could be spawned
-            full = True  # Set the flag to indicate that the board is full
+        self.core.board = self.board_values
+        full = not self.core.spawn()  # Flag to indicate if the board is full
+        values = self.core.values()
+        self.board_values = [values[0:4], values[4:8], values[8:12], values[12:16]]
         return full
 
     def reset_game(self):
@@ -236,6 +256,7 @@ class Game2048:
         self.score = 0  # Reset game score
         self.direction = ''  # Reset direction
         self.game_over = False  # Reset game over flag
+        self.full_redraw = True  # Redraw the whole screen to clear the game over screen
 
     def run_game(self):
         """
@@ -245,14 +266,14 @@ class Game2048:
         Checks for game over condition and restarts the game if needed.
         Quits pygame when the game window is closed.
         """
+        if self.headless:
+            raise RuntimeError("run_game needs a display, create the game with headless=False")
         run = True  # Flag to control the game loop
         while run:
             self.timer.tick(self.fps)  # Limit frame rate
-            self.screen.fill('gray')  # Fill the screen with gray color
-            
-            # Draw game elements
-            self.draw_board()
-            self.draw_pieces()
+
+            # Draw game elements that changed
+            self.draw_frame()
 
             # Spawn new tile if required
             if self.spawn_new or self.init_count < 2:
@@ -282,7 +303,7 @@ class Game2048:
                     if self.game_over and event.key == pygame.K_RETURN:
                         self.reset_game()
 
-            pygame.display.flip()  # Update the display
+            self.update_display()  # Update the changed areas of the display
         pygame.quit()  # Quit pygame when the game loop exits
 
 
@@ -292,15 +313,16 @@ class Game2048:
         Draws game elements on the screen.
         Checks for game over condition and restarts the game if needed.
         Returns the score and board values after each move.
+        Skips all drawing in headless mode and on the frames skipped by the spectator mode.
         """
-        # Limit frame rate
-        self.timer.tick(self.fps)
-        # Fill the screen with gray color
-        self.screen.fill('gray')
-        
-        # Draw game elements
-        self.draw_board()
-        self.draw_pieces()
+        render = self.should_render()
+        if render:
+            # Limit frame rate, unless only some frames are shown
+            if self.render_every == 1 and self.render_fps is None:
+                self.timer.tick(self.fps)
+
+            # Draw game elements that changed
+            self.draw_frame()
 
         # Spawn new tile if required
         if self.spawn_new or self.init_count < 2:
@@ -309,14 +331,16 @@ class Game2048:
             self.init_count += 1
 
         # Draw game over screen if game is over
-        if self.game_over:
+        if render and self.game_over:
             self.draw_over()
 
         # Apply the provided action
         self.state_action(action)
 
-        # Update the display
-        pygame.display.flip()
+        if render:
+            # Update the changed areas of the display and keep the window responsive
+            self.update_display()
+            pygame.event.pump()
 
         # Check if the game is over
         if self.game_over:
@@ -1,31 +1,37 @@
-import random
 import numpy as np
+from GameEmulator.core import GameCore, DEFAULT_BACKEND
+from GameEmulator.profiling import timed
 
 class Game2048:
-    def __init__(self):
+    # The rules are played by a GameCore, this class keeps the interface of moving boards passed in by the agent
+    def __init__(self, backend=DEFAULT_BACKEND, seed=None):
         
         self.possible_moves = 4
         self.number_of_tiles = 16
+        self.core = GameCore(backend, seed)
 
-    def reset_game(self):
-        self.board = np.zeros((self.number_of_tiles), dtype="int")
-        initial_twos = random.sample(range(self.number_of_tiles), 2)
+    def seed(self, seed=None):
+        # Reseeds the tile spawns, None draws from the global random module
+        self.core.seed(seed)
 
-        self.board[initial_twos] = 2
-        self.board = self.board.reshape((4, 4))
+    def reset_game(self):
+        self.board = self.core.reset()
 
     def get_environment(self):
         return self.board
     
+    @timed("MCGame.add_new_tile")
     def add_new_tile(self, board):
-        empty_cells = np.argwhere(board == 0)
-        row, col = random.choice(empty_cells)
-        board[row, col] = 2 if random.random() < 0.9 else 4  # 90% chance of 2, 10% chance of 4
+        self.core.board = board
+        self.core.spawn()
+        board[:] = self.core.board  # The tile is placed on the board passed in
         return board
 
     def check_for_win(self, board):
         return 2048 in board
 
+    # The two steps of the original right move, kept for callers that compose moves themselves.
+    # The moves below go through the core instead.
     def push_board_right(self, board):
         new = np.zeros((4, 4), dtype="int")
         done = False
@@ -51,50 +57,39 @@ class Game2048:
                     done = True
         return board, done, score
 
+    @timed("MCGame.shift")
+    def shift(self, board, direction):
+        # Moves a board in a direction (0: left, 1: up, 2: right, 3: down) and returns the new board,
+        # whether any tile moved and the score of the merges
+        self.core.board = board
+        score, move_made = self.core.apply(direction)
+        return self.core.board, move_made, score
+
     def move_up(self, board):
-        rotated_board = np.rot90(board, -1)
-        pushed_board, has_pushed = self.push_board_right(rotated_board)
-        merged_board, has_merged, score = self.merge_elements(pushed_board)
-        second_pushed_board, _ = self.push_board_right(merged_board)
-        rotated_back_board = np.rot90(second_pushed_board)
-        move_made = has_pushed or has_merged
-        board = rotated_back_board
-        return board, move_made, score
+        return self.shift(board, 1)
 
     def move_down(self, board):
-        board = np.rot90(board)
-        board, has_pushed = self.push_board_right(board)
-        board, has_merged, score = self.merge_elements(board)
-        board, _ = self.push_board_right(board)
-        board = np.rot90(board, -1)
-        move_made = has_pushed or has_merged
-        return board, move_made, score
+        return self.shift(board, 3)
 
     def move_left(self, board):
-        board = np.rot90(board, 2)
-        board, has_pushed = self.push_board_right(board)
-        board, has_merged, score = self.merge_elements(board)
-        board, _ = self.push_board_right(board)
-        board = np.rot90(board, -2)
-        move_made = has_pushed or has_merged
-        return board, move_made, score
+        return self.shift(board, 0)
 
     def move_right(self, board):
-        board, has_pushed = self.push_board_right(board)
-        board, has_merged, score = self.merge_elements(board)
-        board, _ = self.push_board_right(board)
-        board = board
-        move_made = has_pushed or has_merged
-        return board ,move_made, score
+        return self.shift(board, 2)
+
+    def afterstates(self, board):
+        # Moves a board in all four directions at once and returns the (4, 4, 4) moved boards and the score
+        # of the merges indexed by direction, and the bitmask of the directions that change the board
+        self.core.board = board
+        return self.core.afterstate_boards()
 
+    @timed("MCGame.random_move")
     def random_move(self, board):
-        move_made = False
-        possible_moves = [self.move_right, self.move_up, self.move_down, self.move_left]
-        while not move_made and len(possible_moves) > 0:
-            move_index = random.randint(0, len(possible_moves) - 1)
-            move = possible_moves[move_index]
-            move_made, score = move(board)
-            if move_made:
-                return board, True, score
-            possible_moves.pop(move_index)
-        return board, False, 0
\ No newline at end of file
+        # Makes a random move among the ones that change the board
+        self.core.board = board
+        states, gains, legal = self.core.afterstates()
+        if not legal:
+            return board, False, 0
+        direction = self.core.generator().choice([d for d in range(4) if legal >> d & 1])
+        self.core.state = states[direction]
+        return self.core.board, True, gains[direction]
@@ -1,28 +1,62 @@
-import random
 import numpy as np
-from numpy import zeros, rot90, array
+from GameEmulator.core import GameCore, DEFAULT_BACKEND, TILE_EXPONENTS
+from GameEmulator.profiling import timed
 
 class Game2048():
     """
     Class to represent the 2048 game.
 
+    The rules are played by a GameCore, this class keeps the interface the Q-learning code uses.
+
     Attributes:
         cell_count (int): The number of cells in each row and column of the game board.
         board (numpy.ndarray): A 2D array representing the game board.
         game_over (bool): A flag indicating whether the game is over.
         score (int): The current score of the game.
+        core (GameCore): The game core holding the board.
     """
 
-    def __init__(self):
+    def __init__(self, backend=DEFAULT_BACKEND, seed=None):
         """
         Initialize the game.
 
         Initializes the game board with empty cells, sets the game_over flag to False,
         and initializes the score to 0.
+
+        Args:
+            backend (str): The name of the GameCore backend ('python', 'numpy' or 'packed').
+            seed (int, optional): Seed for the game's own random number generator.
         """
         self.cell_count = 4
+        self.core = GameCore(backend, seed)
         self.reset()
 
+    @property
+    def board(self):
+        return self.core.board
+
+    @board.setter
+    def board(self, board):
+        self.core.board = board
+
+    @property
+    def score(self):
+        return self.core.score
+
+    @score.setter
+    def score(self, score):
+        self.core.score = score
+
+    def seed(self, seed=None):
+        """
+        Reseed the tile spawns, see GameCore.seed.
+
+        Args:
+            seed (int, optional): The seed, None draws from the global random module.
+        """
+
+        self.core.seed(seed)
+
     def reset(self):
         """
         Reset the game.
@@ -31,10 +65,8 @@ class Game2048():
         resets the game_over flag to False, and sets the score to 0.
         """
 
-        self.board = zeros((self.cell_count, self.cell_count), dtype=int)
-        self.draw_new_pieces()
+        self.core.reset(tiles=1)
         self.game_over = False
-        self.score = 0
 
     def draw_new_pieces(self):
         """
@@ -44,17 +76,15 @@ class Game2048():
         The probability of placing a '2' is 90%, and the probability of placing a '4' is 10%.
         """
 
-        empty_cells = np.argwhere(self.board == 0)
-        if empty_cells.size != 0:
-            row, col = random.choice(empty_cells)
-            self.board[row, col] = 2 if random.random() < 0.9 else 4
+        self.core.spawn()
 
     def move_left(self, col):
         """
         Move numbers to the left in a column.
 
         Combines adjacent numbers in the given column that are equal, moving them leftward,
-        and updates the score accordingly.
+        and updates the score accordingly. The column is moved as the first row of an otherwise
+        empty board by the game's core.
 
         Args:
             col (numpy.ndarray): The column of numbers to be moved.
@@ -63,34 +93,15 @@ class Game2048():
             numpy.ndarray: The updated column after moving the numbers to the left.
         """
 
-        new_col = zeros((self.cell_count), dtype=col.dtype)
-        j = 0
-        previous = None
-        for i in range(col.size):
-            if col[i] != 0:  # number different from zero
-                if previous is None:
-                    previous = col[i]
-                else:
-                    if previous == col[i]:
-                        new_col[j] = 2 * col[i]
-                        self.score += new_col[j]
-                        j += 1
-                        previous = None
-                    else:
-                        new_col[j] = previous
-                        j += 1
-                        previous = col[i]
-        if previous is not None:
-            new_col[j] = previous
-        return new_col
+        backend = self.core.backend
+        state = backend.from_exponents([TILE_EXPONENTS[int(value)] for value in col] + [0] * 12)
+        state, gain, _ = backend.move(state, 0)
+        self.score += gain
+        return np.array(self.core.values(state)[:self.cell_count], dtype=col.dtype)
 
     def move(self, direction):
         """
-        Move the board in a given direction.
-
-        Moves the entire board (all rows and columns) in the specified direction by
-        rotating the board, performing leftward movement on each column, and rotating
-        the board back to its original orientation.
+        Move the board in a given direction without changing the game.
 
         Args:
             direction (int): The direction in which to move the board.
@@ -100,10 +111,20 @@ class Game2048():
             numpy.ndarray: The updated game board after moving in the specified direction.
         """
 
-        rotated_board = rot90(self.board, direction)
-        cols = [rotated_board[i, :] for i in range(self.cell_count)]
-        new_board = array([self.move_left(col) for col in cols])
-        return rot90(new_board, -direction)
+        state, _, _ = self.core.afterstate(direction)
+        return np.array(self.core.values(state)).reshape(4, 4)
+
+    def afterstates(self):
+        """
+        Move the board in all four directions in one call without changing the game.
+
+        Returns:
+            tuple: A (4, 4, 4) array of the moved boards and the score gained by each move,
+                   both indexed by direction (0: left, 1: up, 2: right, 3: down), and the
+                   legal-move bitmask with bit d set when direction d changes the board.
+        """
+
+        return self.core.afterstate_boards()
 
     def check_valid(self):
         """
@@ -115,17 +136,10 @@ class Game2048():
         Returns:
             bool: True if there are valid moves left, False otherwise.
         """
-        
-        for i in range(self.cell_count):
-            for j in range(self.cell_count):
-                if self.board[i][j] == 0:
-                    return True
-                if i != 0 and self.board[i - 1][j] == self.board[i][j]:
-                    return True
-                if j != 0 and self.board[i][j - 1] == self.board[i][j]:
-                    return True
-        return False
 
+        return self.core.can_move()
+
+    @timed("QGame.take_turn")
     def take_turn(self, direction):
         """
         Take a turn by moving the board in a direction.
@@ -137,9 +151,10 @@ class Game2048():
         Args:
             direction (int): The direction in which to move the board.
                              0: left, 1: up, 2: right, 3: down
+
+        Returns:
+            bool: True if the board moved.
         """
-        
-        new_board = self.move(direction)
-        if not (new_board == self.board).all():
-            self.board = new_board
-            self.draw_new_pieces()
\ No newline at end of file
+
+        _, moved, _ = self.core.step(direction)
+        return moved
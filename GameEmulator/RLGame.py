@@ -1,91 +1,52 @@
 #Using Numpy array instead of pygame to optimize the code for Reinforcement Learning Algorithms
 
-import random
-import numpy as np
+from GameEmulator.core import GameCore, DEFAULT_BACKEND
+from GameEmulator.profiling import timed
 
 class Game2048:
-    def __init__(self):
-        self.board = np.zeros((4, 4), dtype=int)
-        self.score = 0
+    # The rules are played by a GameCore, this class keeps the string-action interface of the RL agents
+    def __init__(self, backend=DEFAULT_BACKEND, seed=None):
+        self.core = GameCore(backend, seed)
         self.game_over = False
+        self.direction = ''
+
+    @property
+    def board(self):
+        return self.core.board
+
+    @board.setter
+    def board(self, board):
+        self.core.board = board
+
+    @property
+    def score(self):
+        return self.core.score
+
+    @score.setter
+    def score(self, score):
+        self.core.score = score
 
     def state_action(self, action):
         # Set direction based on action
         self.direction = action
 
+    @timed("RLGame.take_turn")
     def take_turn(self):
-        merged = np.zeros((4, 4), dtype=bool)
-
-        if self.direction == 'UP':
-            for j in range(4):
-                for i in range(1, 4):
-                    if self.board[i][j] != 0:
-                        row = i
-                        while row > 0 and self.board[row - 1][j] == 0:
-                            self.board[row - 1][j] = self.board[row][j]
-                            self.board[row][j] = 0
-                            row -= 1
-                        if row > 0 and self.board[row - 1][j] == self.board[row][j] and not merged[row - 1][j]:
-                            self.board[row - 1][j] *= 2
-                            self.score += self.board[row - 1][j]
-                            self.board[row][j] = 0
-                            merged[row - 1][j] = True
-
-        elif self.direction == 'DOWN':
-            for j in range(4):
-                for i in range(2, -1, -1):
-                    if self.board[i][j] != 0:
-                        row = i
-                        while row < 3 and self.board[row + 1][j] == 0:
-                            self.board[row + 1][j] = self.board[row][j]
-                            self.board[row][j] = 0
-                            row += 1
-                        if row < 3 and self.board[row + 1][j] == self.board[row][j] and not merged[row + 1][j]:
-                            self.board[row + 1][j] *= 2
-                            self.score += self.board[row + 1][j]
-                            self.board[row][j] = 0
-                            merged[row + 1][j] = True
-
-        elif self.direction == 'LEFT':
-            for i in range(4):
-                for j in range(1, 4):
-                    if self.board[i][j] != 0:
-                        col = j
-                        while col > 0 and self.board[i][col - 1] == 0:
-                            self.board[i][col - 1] = self.board[i][col]
-                            self.board[i][col] = 0
-                            col -= 1
-                        if col > 0 and self.board[i][col - 1] == self.board[i][col] and not merged[i][col - 1]:
-                            self.board[i][col - 1] *= 2
-                            self.score += self.board[i][col - 1]
-                            self.board[i][col] = 0
-                            merged[i][col - 1] = True
-
-        elif self.direction == 'RIGHT':
-            for i in range(4):
-                for j in range(2, -1, -1):
-                    if self.board[i][j] != 0:
-                        col = j
-                        while col < 3 and self.board[i][col + 1] == 0:
-                            self.board[i][col + 1] = self.board[i][col]
-                            self.board[i][col] = 0
-                            col += 1
-                        if col < 3 and self.board[i][col + 1] == self.board[i][col] and not merged[i][col + 1]:
-                            self.board[i][col + 1] *= 2
-                            self.score += self.board[i][col + 1]
-                            self.board[i][col] = 0
-                            merged[i][col + 1] = True
+        moved = False
+        if self.direction:
+            _, moved = self.core.apply(self.direction)
 
         self.direction = ''  # Reset direction
+        return moved  # True if the board changed
 
-    def new_pieces(self):
-        empty_cells = np.argwhere(self.board == 0)
-        if len(empty_cells) == 0:
-            return True  # Board is full
+    def afterstates(self):
+        # The boards after each move (0: left, 1: up, 2: right, 3: down), their score gains and
+        # the bitmask of the moves that change the board, the game itself is not changed
+        return self.core.afterstate_boards()
 
-        row, col = random.choice(empty_cells)
-        self.board[row, col] = 2 if random.random() < 0.9 else 4  # 90% chance of 2, 10% chance of 4
-        return False  # Board is not full
+    @timed("RLGame.new_pieces")
+    def new_pieces(self):
+        return not self.core.spawn()  # True if the board is full
 
     def environment_state(self):
         return self.board.copy()
@@ -96,9 +57,12 @@ class Game2048:
     def check_for_win(self, board):
         return 2048 in board
 
+    def seed(self, seed=None):
+        # Reseeds the tile spawns, None draws from the global random module
+        self.core.seed(seed)
+
     def reset_game(self):
-        self.board = np.zeros((4, 4), dtype=int)
-        self.score = 0
+        self.core.reset(tiles=0)
         self.game_over = False
 
     def run_game(self):
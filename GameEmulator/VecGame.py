@@ -0,0 +1,291 @@
+#Stepping many 2048 boards at once with NumPy array operations
+
+import numpy as np
+from GameEmulator import BitGame
+from GameEmulator.profiling import timed
+
+# NumPy copies of the BitGame row tables so whole batches of rows can be looked up at once
+ROW_LEFT = np.array(BitGame.ROW_LEFT, dtype=np.uint16)
+ROW_SCORE = np.array(BitGame.ROW_SCORE, dtype=np.int64)
+ROW_MOVED = np.array(BitGame.ROW_MOVED, dtype=np.uint8)
+NIBBLE_SHIFTS = np.array([0, 4, 8, 12], dtype=np.uint16)
+
+
+def pack_rows(exponents):
+    """
+    Pack the rows of a batch of exponent boards into 16-bit table indices.
+
+    Args:
+        exponents (numpy.ndarray): An (N, 4, 4) array of tile exponents.
+
+    Returns:
+        numpy.ndarray: An (N, 4) array of packed rows.
+    """
+
+    return (exponents.astype(np.uint16) << NIBBLE_SHIFTS).sum(axis=2, dtype=np.uint16)
+
+
+def unpack_rows(rows):
+    """
+    Unpack a batch of 16-bit rows back into tile exponents.
+
+    Args:
+        rows (numpy.ndarray): An (N, 4) array of packed rows.
+
+    Returns:
+        numpy.ndarray: An (N, 4, 4) array of tile exponents.
+    """
+
+    return ((rows[..., None] >> NIBBLE_SHIFTS) & 0xF).astype(np.uint8)
+
+
+def move_boards(exponents, actions):
+    """
+    Move every board of a batch in its own direction.
+
+    Args:
+        exponents (numpy.ndarray): An (N, 4, 4) array of tile exponents.
+        actions (numpy.ndarray): The direction for each board.
+                                 0: left, 1: up, 2: right, 3: down
+
+    Returns:
+        tuple: The (N, 4, 4) moved exponent boards and the score gained by each move.
+    """
+
+    new_exponents = np.empty_like(exponents)
+    gains = np.zeros(len(exponents), dtype=np.int64)
+    for direction in range(4):
+        mask = actions == direction
+        if not mask.any():
+            continue
+        # Rotate so the move becomes a left move, as QGame does
+        rotated = np.rot90(exponents[mask], direction, axes=(1, 2))
+        rows = pack_rows(rotated)
+        moved = unpack_rows(ROW_LEFT[rows])
+        new_exponents[mask] = np.rot90(moved, -direction, axes=(1, 2))
+        gains[mask] = ROW_SCORE[rows].sum(axis=1)
+    return new_exponents, gains
+
+
+def afterstates(exponents):
+    """
+    Move every board of a batch in all four directions at once.
+
+    Args:
+        exponents (numpy.ndarray): An (N, 4, 4) array of tile exponents.
+
+    Returns:
+        tuple: The (N, 4, 4, 4) moved exponent boards indexed by board and direction
+        (0: left, 1: up, 2: right, 3: down), the (N, 4) score gained by each move and
+        the (N, 4) boolean mask of the moves that change the board.
+    """
+
+    n = len(exponents)
+    # The four rotations of every board are moved left together, one table lookup for all of them
+    rotated = np.stack([np.rot90(exponents, direction, axes=(1, 2)) for direction in range(4)], axis=1)
+    rows = pack_rows(rotated.reshape(4 * n, 4, 4)).reshape(n, 4, 4)
+    moved = unpack_rows(ROW_LEFT[rows])
+    after = np.empty((n, 4, 4, 4), dtype=np.uint8)
+    for direction in range(4):
+        after[:, direction] = np.rot90(moved[:, direction], -direction, axes=(1, 2))
+    gains = ROW_SCORE[rows].sum(axis=2, dtype=np.int64)
+    # Every move was played as a left move, so bit 0 of ROW_MOVED tells whether it changed a row
+    legal = (ROW_MOVED[rows] & 1).any(axis=2)
+    return after, gains, legal
+
+
+def legal_moves(exponents):
+    """
+    Find the moves that change each board of a batch.
+
+    Args:
+        exponents (numpy.ndarray): An (N, 4, 4) array of tile exponents.
+
+    Returns:
+        numpy.ndarray: An (N,) uint8 array of legal-move bitmasks, bit d set when direction d
+        (0: left, 1: up, 2: right, 3: down) changes the board, as in GameCore.afterstates.
+    """
+
+    # Bit 0 of ROW_MOVED is the left (up) move of a row (column), bit 1 the right (down) move
+    rows = np.bitwise_or.reduce(ROW_MOVED[pack_rows(exponents)], axis=1)
+    cols = np.bitwise_or.reduce(ROW_MOVED[pack_rows(exponents.transpose(0, 2, 1))], axis=1)
+    return (rows & 1) | ((cols & 1) << 1) | ((rows & 2) << 1) | ((cols & 2) << 2)
+
+
+class VecGame2048():
+    """
+    Class to run a batch of independent 2048 games in lockstep.
+
+    Every board is moved with the BitGame row tables, so one step costs a few
+    NumPy operations regardless of the number of boards. Boards that end are
+    reset automatically.
+
+    Attributes:
+        num_envs (int): The number of boards played at once.
+        exponents (numpy.ndarray): An (N, 4, 4) uint8 array of tile exponents.
+        scores (numpy.ndarray): The current score of each game.
+        final_scores (numpy.ndarray): The score each game had when it last ended.
+        final_exponents (numpy.ndarray): The board each game had when it last ended.
+    """
+
+    def __init__(self, num_envs, seed=None):
+        """
+        Initialize the batch of games.
+
+        Args:
+            num_envs (int): The number of boards to play at once.
+            seed (int, optional): Seed for the batch's random number generator.
+        """
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.exponents = np.zeros((num_envs, 4, 4), dtype=np.uint8)
+        self.scores = np.zeros(num_envs, dtype=np.int64)
+        self.final_scores = np.zeros(num_envs, dtype=np.int64)
+        self.final_exponents = np.zeros((num_envs, 4, 4), dtype=np.uint8)
+        self.reset()
+
+    @property
+    def boards(self):
+        """
+        The boards as an (N, 4, 4) array of tile values.
+        """
+        return np.where(self.exponents > 0, 1 << self.exponents.astype(np.int64), 0)
+
+    def reset(self, mask=None):
+        """
+        Reset some or all of the games.
+
+        Clears the selected boards, sets their score to 0 and draws two new pieces on them,
+        as a GameCore reset does.
+
+        Args:
+            mask (numpy.ndarray, optional): Boolean mask of the games to reset, all games by default.
+        """
+
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        self.exponents[mask] = 0
+        self.scores[mask] = 0
+        self.draw_new_pieces(mask)
+        self.draw_new_pieces(mask)
+
+    def draw_new_pieces(self, mask):
+        """
+        Draw a new '2' (90%) or '4' (10%) on a random empty cell of each selected board.
+
+        Args:
+            mask (numpy.ndarray): Boolean mask of the boards to draw on.
+        """
+
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
+            return
+        flat = self.exponents[idx].reshape(idx.size, 16)
+        # The largest random key over the empty cells picks one of them uniformly
+        keys = self.rng.random((idx.size, 16)) * (flat == 0)
+        cells = keys.argmax(axis=1)
+        has_room = keys[np.arange(idx.size), cells] > 0
+        values = np.where(self.rng.random(idx.size) < 0.9, 1, 2).astype(np.uint8)
+        flat[np.arange(idx.size), cells] = np.where(has_room, values, flat[np.arange(idx.size), cells])
+        self.exponents[idx] = flat.reshape(idx.size, 4, 4)
+
+    def check_valid(self):
+        """
+        Check which games have valid moves left.
+
+        Returns:
+            numpy.ndarray: Boolean array, True where the board can still move.
+        """
+
+        rows = pack_rows(self.exponents)
+        cols = pack_rows(self.exponents.transpose(0, 2, 1))
+        return (ROW_MOVED[rows] != 0).any(axis=1) | (ROW_MOVED[cols] != 0).any(axis=1)
+
+    def move(self, actions):
+        """
+        Move every board in its own direction without changing the games.
+
+        Args:
+            actions (numpy.ndarray): The direction for each board.
+                                     0: left, 1: up, 2: right, 3: down
+
+        Returns:
+            tuple: The (N, 4, 4) moved exponent boards and the score gained by each move.
+        """
+
+        return move_boards(self.exponents, actions)
+
+    def afterstates(self):
+        """
+        Move every board in all four directions without changing the games.
+
+        Returns:
+            tuple: The (N, 4, 4, 4) moved exponent boards, the (N, 4) score gains and
+            the (N, 4) legal-move mask, see afterstates.
+        """
+
+        return afterstates(self.exponents)
+
+    def legal_moves(self):
+        """
+        Find the moves that change each board.
+
+        Returns:
+            numpy.ndarray: An (N,) uint8 array of legal-move bitmasks, see legal_moves.
+        """
+
+        return legal_moves(self.exponents)
+
+    @timed("VecGame.step")
+    def step(self, actions):
+        """
+        Take a turn on every board.
+
+        Boards that change get a new piece, boards that end are recorded in
+        final_scores and reset.
+
+        Args:
+            actions (numpy.ndarray): The direction for each board.
+                                     0: left, 1: up, 2: right, 3: down
+
+        Returns:
+            tuple: The (N, 4, 4) boards after the step, the reward (score gained) of each
+            board, a mask of the games that ended and a mask of the boards that moved.
+        """
+
+        actions = np.asarray(actions).reshape(self.num_envs)
+        new_exponents, rewards = self.move(actions)
+        moved = (new_exponents != self.exponents).any(axis=(1, 2))
+        self.exponents = new_exponents
+        self.scores += rewards
+        self.draw_new_pieces(moved)
+
+        dones = ~self.check_valid()
+        if dones.any():
+            self.final_scores[dones] = self.scores[dones]
+            self.final_exponents[dones] = self.exponents[dones]
+            self.reset(dones)
+        return self.boards, rewards, dones, moved
+
+    def state_dict(self):
+        """
+        Return the boards, scores and random number generator state, to continue the games later.
+
+        Returns:
+            dict: The state of the batch.
+        """
+
+        return {"exponents": self.exponents.copy(), "scores": self.scores.copy(),
+                "rng": self.rng.bit_generator.state}
+
+    def load_state_dict(self, state):
+        """
+        Restore games saved by state_dict.
+
+        Args:
+            state (dict): The state of the batch.
+        """
+
+        self.exponents = state["exponents"]
+        self.scores = state["scores"]
+        self.rng.bit_generator.state = state["rng"]
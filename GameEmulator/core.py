@@ -0,0 +1,548 @@
+#One game core shared by every emulator, with interchangeable board representations
+
+import copy
+import random
+import numpy as np
+from GameEmulator import BitGame
+from GameEmulator.VecGame import VecGame2048, ROW_LEFT, ROW_SCORE, ROW_MOVED, pack_rows, unpack_rows
+from GameEmulator.profiling import timed
+
+# Action codes used by the core, as in QGame and BitGame. The string actions of Game and RLGame map onto them.
+ACTIONS = ('LEFT', 'UP', 'RIGHT', 'DOWN')
+ACTION_INDEX = {name: index for index, name in enumerate(ACTIONS)}
+
+# Backend used when none is asked for, the packed one is the fastest for single games
+DEFAULT_BACKEND = 'packed'
+
+# Tile value of every exponent and the other way around
+TILE_VALUES = [0] + [1 << exponent for exponent in range(1, 32)]
+TILE_EXPONENTS = {value: exponent for exponent, value in enumerate(TILE_VALUES)}
+
+# Largest exponent a cell holds, the packed board and the row tables keep one nibble per cell
+MAX_EXPONENT = 15
+
+
+def action_index(action):
+    """
+    Convert an action to its direction code.
+
+    Args:
+        action (int or str): A direction code (0: left, 1: up, 2: right, 3: down) or 'LEFT', 'UP', 'RIGHT', 'DOWN'.
+
+    Returns:
+        int: The direction code.
+    """
+
+    if isinstance(action, str):
+        return ACTION_INDEX[action.upper()]
+    return int(action)
+
+
+class PythonBackend():
+    """
+    Board as a tuple of 16 tile exponents in row-major order, moved with plain Python.
+    Exponents saturate at 15 (32768) as in the other backends, so two 32768 tiles do not merge.
+    """
+
+    name = 'python'
+    # Cells of every line in the order tiles slide towards, for each direction
+    LINES = (
+        tuple(tuple(4 * r + c for c in range(4)) for r in range(4)),
+        tuple(tuple(4 * r + c for r in range(4)) for c in range(4)),
+        tuple(tuple(4 * r + c for c in range(3, -1, -1)) for r in range(4)),
+        tuple(tuple(4 * r + c for r in range(3, -1, -1)) for c in range(4)),
+    )
+
+    def from_exponents(self, exponents):
+        return tuple(int(e) for e in exponents)
+
+    def to_exponents(self, state):
+        return list(state)
+
+    def move(self, state, direction):
+        cells = list(state)
+        gain = 0
+        for line in self.LINES[direction]:
+            tiles = [state[cell] for cell in line if state[cell]]
+            merged = []
+            i = 0
+            while i < len(tiles):
+                if i + 1 < len(tiles) and tiles[i] == tiles[i + 1] and tiles[i] != MAX_EXPONENT:
+                    merged.append(tiles[i] + 1)
+                    gain += 1 << (tiles[i] + 1)
+                    i += 2
+                else:
+                    merged.append(tiles[i])
+                    i += 1
+            merged += [0] * (4 - len(merged))
+            for cell, tile in zip(line, merged):
+                cells[cell] = tile
+        new_state = tuple(cells)
+        return new_state, gain, new_state != state
+
+    def afterstates(self, state):
+        states, gains, legal = [], [], 0
+        for direction in range(4):
+            new_state, gain, moved = self.move(state, direction)
+            states.append(new_state)
+            gains.append(gain)
+            legal |= moved << direction
+        return states, gains, legal
+
+    def empty_cells(self, state):
+        return [cell for cell in range(16) if not state[cell]]
+
+    def place(self, state, cell, exponent):
+        return state[:cell] + (exponent,) + state[cell + 1:]
+
+    def can_move(self, state):
+        for cell in range(16):
+            if not state[cell]:
+                return True
+            if state[cell] == MAX_EXPONENT:
+                continue
+            if cell % 4 != 3 and state[cell] == state[cell + 1]:
+                return True
+            if cell < 12 and state[cell] == state[cell + 4]:
+                return True
+        return False
+
+
+class NumpyBackend():
+    """
+    Board as a 4x4 uint8 array of tile exponents, moved with the VecGame row tables on all rows at once.
+    """
+
+    name = 'numpy'
+
+    def from_exponents(self, exponents):
+        return np.array(exponents, dtype=np.uint8).reshape(4, 4)
+
+    def to_exponents(self, state):
+        return state.ravel().tolist()
+
+    def move(self, state, direction):
+        # Rotate so the move becomes a left move, as VecGame does
+        rows = pack_rows(np.rot90(state, direction)[None])
+        new_state = np.ascontiguousarray(np.rot90(unpack_rows(ROW_LEFT[rows])[0], -direction))
+        return new_state, int(ROW_SCORE[rows].sum()), not np.array_equal(new_state, state)
+
+    def afterstates(self, state):
+        # The four rotations are moved left together, one table lookup for all 16 rows
+        rows = pack_rows(np.stack([np.rot90(state, direction) for direction in range(4)]))
+        moved = unpack_rows(ROW_LEFT[rows])
+        states = [np.ascontiguousarray(np.rot90(moved[direction], -direction)) for direction in range(4)]
+        gains = ROW_SCORE[rows].sum(axis=1).tolist()
+        legal = 0
+        for direction in range(4):
+            legal |= (not np.array_equal(states[direction], state)) << direction
+        return states, gains, legal
+
+    def empty_cells(self, state):
+        return np.flatnonzero(state.ravel() == 0).tolist()
+
+    def place(self, state, cell, exponent):
+        new_state = state.copy()
+        new_state.flat[cell] = exponent
+        return new_state
+
+    def can_move(self, state):
+        rows = pack_rows(np.stack((state, state.T)))
+        return bool(ROW_MOVED[rows].any())
+
+
+class PackedBackend():
+    """
+    Board as a 64-bit integer with one 4-bit tile exponent per cell, moved with the BitGame tables.
+    """
+
+    name = 'packed'
+
+    def from_exponents(self, exponents):
+        state = 0
+        for cell, exponent in enumerate(exponents):
+            state |= int(exponent) << (4 * cell)
+        return state
+
+    def to_exponents(self, state):
+        return [(state >> (4 * cell)) & 0xF for cell in range(16)]
+
+    def move(self, state, direction):
+        return BitGame.move(state, direction)
+
+    def afterstates(self, state):
+        return BitGame.afterstates(state)
+
+    def empty_cells(self, state):
+        return BitGame.empty_cells(state)
+
+    def place(self, state, cell, exponent):
+        return state | (exponent << (4 * cell))
+
+    def can_move(self, state):
+        return BitGame.can_move(state)
+
+
+BACKENDS = {backend.name: backend for backend in (PythonBackend, NumpyBackend, PackedBackend)}
+
+
+class GameCore():
+    """
+    Class holding the rules of 2048, shared by every emulator.
+
+    The board is kept in the representation of a backend ('python', 'numpy' or 'packed'),
+    all backends play the same game: the same moves, scores and tile spawns for the same seed.
+
+    Attributes:
+        backend: The backend holding and moving the board.
+        state: The board in the backend's representation.
+        score (int): The current score of the game.
+    """
+
+    def __init__(self, backend=DEFAULT_BACKEND, seed=None):
+        """
+        Initialize an empty game.
+
+        Args:
+            backend (str): The name of the backend, one of BACKENDS.
+            seed (int, optional): Seed for the game's own random number generator,
+                                  the global random module is used without one.
+        """
+
+        self.backend = BACKENDS[backend]()
+        self.seed(seed)
+        self.state = self.backend.from_exponents([0] * 16)
+        self.score = 0
+
+    def seed(self, seed=None):
+        """
+        Reseed the tile spawns.
+
+        Args:
+            seed (int, optional): The seed, None draws from the global random module.
+        """
+
+        self.rng = random.Random(seed) if seed is not None else None
+
+    def generator(self):
+        """
+        Return the random number generator of the game, the global random module if it was not seeded.
+        """
+
+        return self.rng if self.rng is not None else random
+
+    def reset(self, tiles=2):
+        """
+        Start a new game.
+
+        Args:
+            tiles (int): The number of tiles placed on the empty board.
+
+        Returns:
+            numpy.ndarray: The new board of tile values.
+        """
+
+        self.state = self.backend.from_exponents([0] * 16)
+        self.score = 0
+        for _ in range(tiles):
+            self.spawn()
+        return self.board
+
+    @property
+    def exponents(self):
+        """
+        numpy.ndarray: The board as a 4x4 array of tile exponents.
+        """
+
+        return np.array(self.backend.to_exponents(self.state), dtype=np.int64).reshape(4, 4)
+
+    @exponents.setter
+    def exponents(self, exponents):
+        self.state = self.backend.from_exponents(np.asarray(exponents).ravel().tolist())
+
+    def values(self, state=None):
+        """
+        List the tile values of a board in row-major order.
+
+        Args:
+            state (optional): A board in the backend's representation, the game's own board by default.
+
+        Returns:
+            list: The 16 tile values (0, 2, 4, ...).
+        """
+
+        return [TILE_VALUES[exponent] for exponent in self.backend.to_exponents(self.state if state is None else state)]
+
+    @property
+    def board(self):
+        """
+        numpy.ndarray: The board as a 4x4 array of tile values (0, 2, 4, ...).
+        Can be set from a 4x4 array or a list of 4 rows.
+        """
+
+        return np.array(self.values()).reshape(4, 4)
+
+    @board.setter
+    def board(self, board):
+        if isinstance(board, np.ndarray):
+            values = board.ravel().tolist()
+        else:
+            values = [value for row in board for value in row]
+        self.state = self.backend.from_exponents([TILE_EXPONENTS[value] for value in values])
+
+    @timed("core.afterstate")
+    def afterstate(self, action):
+        """
+        Move the board without changing the game.
+
+        Args:
+            action (int or str): The direction, see action_index.
+
+        Returns:
+            tuple: The moved state in the backend's representation, the score gained and whether any tile moved.
+        """
+
+        return self.backend.move(self.state, action_index(action))
+
+    @timed("core.afterstates")
+    def afterstates(self):
+        """
+        Move the board in all four directions in one call, without changing the game.
+
+        Returns:
+            tuple: The four moved states in the backend's representation and the four score gains,
+            both indexed by direction code, and the legal-move bitmask with bit d set when
+            direction d changes the board.
+        """
+
+        return self.backend.afterstates(self.state)
+
+    def afterstate_boards(self):
+        """
+        Move the board in all four directions in one call, without changing the game.
+
+        Returns:
+            tuple: A (4, 4, 4) array of the four moved boards of tile values and the four score gains,
+            both indexed by direction code, and the legal-move bitmask, see afterstates.
+        """
+
+        states, gains, legal = self.afterstates()
+        boards = np.array([self.values(state) for state in states]).reshape(4, 4, 4)
+        return boards, gains, legal
+
+    @timed("core.move")
+    def apply(self, action):
+        """
+        Move the board and add the merges to the score, without spawning a tile.
+
+        Args:
+            action (int or str): The direction, see action_index.
+
+        Returns:
+            tuple: The score gained and whether any tile moved.
+        """
+
+        state, gain, moved = self.backend.move(self.state, action_index(action))
+        if moved:
+            self.state = state
+            self.score += gain
+        return gain, moved
+
+    @timed("core.spawn")
+    def spawn(self):
+        """
+        Place a '2' (90%) or a '4' (10%) on a random empty cell.
+
+        Returns:
+            bool: False if the board is full and no tile could be placed.
+        """
+
+        cells = self.backend.empty_cells(self.state)
+        if not cells:
+            return False
+        rng = self.generator()
+        cell = cells[int(rng.random() * len(cells))]
+        exponent = 1 if rng.random() < 0.9 else 2
+        self.state = self.backend.place(self.state, cell, exponent)
+        return True
+
+    @timed("core.step")
+    def step(self, action):
+        """
+        Take a turn: move the board and spawn a tile if anything moved.
+
+        Args:
+            action (int or str): The direction, see action_index.
+
+        Returns:
+            tuple: The score gained, whether any tile moved and whether the game is over.
+        """
+
+        gain, moved = self.apply(action)
+        if moved:
+            self.spawn()
+        return gain, moved, not self.can_move()
+
+    def legal_moves(self):
+        """
+        List the moves that change the board.
+
+        Returns:
+            list: The direction codes of the legal moves.
+        """
+
+        legal = self.backend.afterstates(self.state)[2]
+        return [direction for direction in range(4) if legal >> direction & 1]
+
+    def can_move(self):
+        """
+        Check if there are valid moves left.
+
+        Returns:
+            bool: True if at least one move changes the board.
+        """
+
+        return self.backend.can_move(self.state)
+
+    def clone(self):
+        """
+        Copy the game, including the state of its random number generator.
+
+        Returns:
+            GameCore: An independent copy of the game.
+        """
+
+        clone = copy.copy(self)
+        if self.rng is not None:
+            clone.rng = random.Random()
+            clone.rng.setstate(self.rng.getstate())
+        return clone
+
+
+class GameBatch():
+    """
+    Class to run a batch of GameCore games with the interface of VecGame2048,
+    so the batched training loop can use any single-game backend.
+
+    Attributes:
+        num_envs (int): The number of games.
+        games (list): The GameCore of every game.
+        final_scores (numpy.ndarray): The score each game had when it last ended.
+        final_exponents (numpy.ndarray): The board each game had when it last ended.
+    """
+
+    def __init__(self, num_envs, backend=DEFAULT_BACKEND, seed=None):
+        """
+        Initialize the batch of games.
+
+        Args:
+            num_envs (int): The number of games.
+            backend (str): The name of the backend, one of BACKENDS.
+            seed (int, optional): Seed from which the seed of every game is derived.
+        """
+
+        seeds = random.Random(seed) if seed is not None else None
+        self.num_envs = num_envs
+        self.games = [GameCore(backend, seeds.getrandbits(32) if seeds is not None else None)
+                      for _ in range(num_envs)]
+        self.final_scores = np.zeros(num_envs, dtype=np.int64)
+        self.final_exponents = np.zeros((num_envs, 4, 4), dtype=np.uint8)
+        for game in self.games:
+            game.reset()
+
+    @property
+    def exponents(self):
+        """
+        numpy.ndarray: An (N, 4, 4) uint8 array of tile exponents.
+        """
+
+        return np.stack([game.exponents for game in self.games]).astype(np.uint8)
+
+    @exponents.setter
+    def exponents(self, exponents):
+        for game, board in zip(self.games, exponents):
+            game.exponents = board
+
+    @property
+    def scores(self):
+        """
+        numpy.ndarray: The current score of each game.
+        """
+
+        return np.array([game.score for game in self.games], dtype=np.int64)
+
+    @scores.setter
+    def scores(self, scores):
+        for game, score in zip(self.games, scores):
+            game.score = int(score)
+
+    @property
+    def boards(self):
+        """
+        numpy.ndarray: An (N, 4, 4) array of tile values.
+        """
+
+        return np.stack([game.board for game in self.games])
+
+    @timed("GameBatch.step")
+    def step(self, actions):
+        """
+        Take a turn in every game, resetting the games that end.
+
+        Args:
+            actions (numpy.ndarray): The direction for each game.
+
+        Returns:
+            tuple: The boards after the step, the reward of each game, a mask of the games
+            that ended and a mask of the games whose board moved, as VecGame2048.step.
+        """
+
+        rewards = np.zeros(self.num_envs, dtype=np.int64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        moved = np.zeros(self.num_envs, dtype=bool)
+        for i, (game, action) in enumerate(zip(self.games, np.asarray(actions).reshape(self.num_envs))):
+            rewards[i], moved[i], dones[i] = game.step(int(action))
+            if dones[i]:
+                self.final_scores[i] = game.score
+                self.final_exponents[i] = game.exponents
+                game.reset()
+        return self.boards, rewards, dones, moved
+
+    def state_dict(self):
+        """
+        Return the boards, scores and random number generator states, to continue the games later.
+        """
+
+        return {"exponents": self.exponents, "scores": self.scores,
+                "rngs": [game.rng.getstate() if game.rng is not None else None for game in self.games]}
+
+    def load_state_dict(self, state):
+        """
+        Restore games saved by state_dict.
+        """
+
+        self.exponents = state["exponents"]
+        self.scores = state["scores"]
+        for game, rng_state in zip(self.games, state["rngs"]):
+            if rng_state is not None:
+                game.rng = random.Random()
+                game.rng.setstate(rng_state)
+
+
+def make_batch(num_envs, backend='vector', seed=None):
+    """
+    Create a batch of games played in lockstep.
+
+    Args:
+        num_envs (int): The number of games.
+        backend (str): 'vector' for VecGame2048, which steps all boards with NumPy array operations,
+                       or the name of a single-game backend for a GameBatch.
+        seed (int, optional): Seed of the games.
+
+    Returns:
+        VecGame2048 or GameBatch: The batch of games.
+    """
+
+    if backend == 'vector':
+        return VecGame2048(num_envs, seed=seed)
+    return GameBatch(num_envs, backend, seed)
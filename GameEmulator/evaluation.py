@@ -0,0 +1,149 @@
+#Playing evaluation games with any agent and collecting the max tile and score of each
+
+import csv
+import json
+import random
+import multiprocessing
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+class TileHistogram:
+    def __init__(self):
+        """
+        Histogram of the maximum tile and the final score of evaluated games, filled one game at a time.
+        """
+        self.counts = np.zeros(16, dtype=int)  # counts[i] is the number of games ending with 2**i as max tile
+        self.scores = []
+
+    def add(self, max_tile, score):
+        """
+        Add the result of one finished game.
+
+        Parameters:
+        - max_tile: The largest tile on the final board.
+        - score: The final score of the game.
+        """
+        self.counts[int(np.log2(max_tile))] += 1
+        self.scores.append(int(score))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def summary(self):
+        """
+        Summarize the games added so far.
+
+        Returns:
+        - A dictionary with the number of games, the max tile counts and score statistics.
+        """
+        scores = np.array(self.scores) if self.scores else np.zeros(1)
+        return {
+            "games": len(self.scores),
+            "max_tile_counts": {str(2 ** i): int(c) for i, c in enumerate(self.counts) if c > 0},
+            "mean_score": float(scores.mean()),
+            "median_score": float(np.median(scores)),
+            "max_score": int(scores.max()),
+            "scores": self.scores,
+        }
+
+    def save(self, path):
+        """
+        Write the histogram to a .json file, or to a .csv file with one row per max tile.
+
+        Parameters:
+        - path: The output file path.
+        """
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["max_tile", "count"])
+                for i, count in enumerate(self.counts):
+                    if i > 0:
+                        writer.writerow([2 ** i, int(count)])
+        else:
+            with open(path, "w") as f:
+                json.dump(self.summary(), f, indent=2)
+
+    def plot(self):
+        """
+        Plot the frequency of each max tile as a bar chart.
+        """
+        tick_locations = np.arange(1, 12)
+        plt.bar(tick_locations, self.counts[1:12])
+        plt.xticks(tick_locations, np.power(2, tick_locations))
+        plt.xlabel("Score of Game", fontsize=24)
+        plt.ylabel(f"Frequency per {len(self)} runs", fontsize=24)
+        plt.show()
+
+
+def _play_sample_task(task):
+    return play_sample(*task)
+
+
+def play_sample(agent, seed):
+    """
+    Play one game with freshly seeded random number generators.
+
+    The global random and np.random generators are reseeded, and so is the agent's game
+    if it has its own generator, so every game starts from its own board even when
+    worker processes receive identical copies of the agent.
+
+    Parameters:
+    - agent: The agent, providing a play_sample method returning the max tile and the score.
+    - seed: Seed for the game.
+
+    Returns:
+    - The max tile and the final score of the game.
+    """
+    random.seed(int(seed))
+    np.random.seed(int(seed))
+    game = getattr(agent, "game", None)
+    if hasattr(game, "seed"):
+        game.seed(int(seed))
+    return agent.play_sample()
+
+
+def evaluate(agent, sample_count, num_workers=1, seed=None, output=None):
+    """
+    Play independent games with an agent and collect their results as they finish.
+
+    With num_workers > 1 the games run in a pool of worker processes, each with
+    its own copy of the agent and its game.
+
+    Parameters:
+    - agent: The agent, providing a play_sample method returning the max tile and the score.
+    - sample_count: Number of games to play.
+    - num_workers: Number of worker processes.
+    - seed: Seed from which every game's own seed is derived.
+    - output: Optional .json or .csv path, written instead of showing the plot.
+
+    Returns:
+    - The TileHistogram of the played games.
+    """
+    seeds = np.random.SeedSequence(seed).generate_state(sample_count)
+    histogram = TileHistogram()
+
+    if num_workers <= 1:
+        results = (play_sample(agent, s) for s in seeds)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        # Results stream back in the order the games finish
+        results = pool.imap_unordered(_play_sample_task, [(agent, s) for s in seeds])
+
+    try:
+        for max_tile, score in results:
+            histogram.add(max_tile, score)
+            if len(histogram) % 20 == 0:
+                print(f"sample count {len(histogram)}")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if output is not None:
+        histogram.save(output)
+    else:
+        histogram.plot()
+    return histogram
@@ -1,15 +1,16 @@
 #Playing the game using automated action inputs
 
-from Game import Game2048
+from GameEmulator.Game import Game2048
+import argparse
 import random
 import time
 
-def play_game():
+def play_game(moves=10, delay=1.0, headless=False, render_every=1, render_fps=None):
     # Create an instance of the Game2048 class
-    game = Game2048()
+    game = Game2048(headless=headless, render_every=render_every, render_fps=render_fps)
     
     # Run the game loop
-    for _ in range(10):
+    for _ in range(moves):
         # Generate a random action (UP, DOWN, LEFT, RIGHT)
         action = random.choice(game.action_space)
         
@@ -22,6 +23,17 @@ def play_game():
         for row in board_values:
             print(row)
 
-        time.sleep(1)
-# Run the function to play the game
-play_game()
\ No newline at end of file
+        if delay > 0:
+            time.sleep(delay)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play 2048 with random automated actions")
+    parser.add_argument("--moves", type=int, default=10, help="number of actions to play")
+    parser.add_argument("--delay", type=float, default=1.0, help="seconds to wait after every action")
+    parser.add_argument("--headless", action="store_true", help="never open a display, run at full speed")
+    parser.add_argument("--render-every", type=int, default=1, help="render only every Nth action")
+    parser.add_argument("--render-fps", type=float, default=None, help="render at most this many frames per second")
+    args = parser.parse_args()
+
+    # Run the function to play the game
+    play_game(args.moves, args.delay, args.headless, args.render_every, args.render_fps)
@@ -0,0 +1,411 @@
+#Named timing spans and counters for the emulators, agents and training loops, off unless enabled
+
+import functools
+import json
+import random
+import threading
+from time import perf_counter
+
+# Durations kept per span for its percentiles, later calls replace kept ones at random (reservoir sampling)
+MAX_SAMPLES = 10000
+
+
+class SpanStats():
+    """
+    Running totals of one span name.
+
+    Attributes:
+        calls (int): The number of times the span was entered.
+        total (float): Seconds spent inside the span, including nested spans.
+        self_time (float): Seconds spent inside the span minus the time of its nested spans.
+        max (float): The longest single duration in seconds.
+        samples (list): Up to MAX_SAMPLES durations drawn uniformly from all calls.
+    """
+
+    __slots__ = ('calls', 'total', 'self_time', 'max', 'samples')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.self_time = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def percentile(self, q):
+        """
+        Estimate a percentile of the durations from the kept samples.
+
+        Args:
+            q (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The duration in seconds.
+        """
+
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+class Span():
+    """
+    Context manager timing one entry into a named span.
+    """
+
+    __slots__ = ('profiler', 'name', 'start', 'children')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack().append(self)
+        self.children = 0.0
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = perf_counter() - self.start
+        stack = self.profiler.stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.profiler.record(self.name, stack, elapsed, elapsed - self.children)
+        return False
+
+
+class NullSpan():
+    """
+    Context manager that does nothing, returned by every span while profiling is disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler():
+    """
+    Collects span timings and counters.
+
+    Spans nest per thread. Besides the totals per name, the self time of every stack of
+    nested spans is kept for flame graphs. Spans entered on threads other than the main
+    thread have the thread name as their root.
+
+    Attributes:
+        enabled (bool): Whether spans and counters are recorded.
+        spans (dict): SpanStats by span name.
+        counters (dict): Counts by counter name.
+        stacks (dict): Self time in seconds by ';'-joined stack of span names.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Separate generator for the reservoir, so profiling leaves seeded games unchanged
+        self.rng = random.Random(0)
+        self.reset()
+
+    def reset(self):
+        """
+        Drop everything recorded so far and restart the wall clock.
+        """
+
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+            self.stacks = {}
+            self.started = perf_counter()
+
+    def stack(self):
+        """
+        Returns:
+            list: The spans currently entered on the calling thread, outermost first.
+        """
+
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+            thread = threading.current_thread()
+            self.local.root = () if thread is threading.main_thread() else (thread.name,)
+        return stack
+
+    def span(self, name):
+        """
+        Time a block of code.
+
+        Args:
+            name (str): The span name, such as 'MCagent.ai_move'.
+
+        Returns:
+            Span: A context manager, which does nothing while profiling is disabled.
+        """
+
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def count(self, name, n=1):
+        """
+        Add n to a counter, does nothing while profiling is disabled.
+
+        Args:
+            name (str): The counter name, such as 'MCagent.rollouts'.
+            n (int): The amount to add.
+        """
+
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, stack, elapsed, self_time):
+        """
+        Add a finished span to the totals.
+
+        Args:
+            name (str): The span name.
+            stack (list): The spans still entered around it.
+            elapsed (float): Seconds spent inside the span.
+            self_time (float): Seconds not spent in nested spans.
+        """
+
+        path = ';'.join(self.local.root + tuple(span.name for span in stack) + (name,))
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.calls += 1
+            stats.total += elapsed
+            stats.self_time += self_time
+            if elapsed > stats.max:
+                stats.max = elapsed
+            if len(stats.samples) < MAX_SAMPLES:
+                stats.samples.append(elapsed)
+            else:
+                slot = self.rng.randrange(stats.calls)
+                if slot < MAX_SAMPLES:
+                    stats.samples[slot] = elapsed
+            self.stacks[path] = self.stacks.get(path, 0.0) + self_time
+
+    def report(self):
+        """
+        Summarize the recorded spans and counters.
+
+        Returns:
+            dict: The wall time in seconds, the counters, and for every span, ordered by total time,
+            its call count, total and self time in seconds, share of the wall time and the mean,
+            50th, 90th, 99th percentile and maximum duration in microseconds.
+        """
+
+        with self.lock:
+            wall_time = perf_counter() - self.started
+            spans = {}
+            for name, stats in sorted(self.spans.items(), key=lambda item: -item[1].total):
+                spans[name] = {
+                    'calls': stats.calls,
+                    'total_s': stats.total,
+                    'self_s': stats.self_time,
+                    'share': stats.total / wall_time if wall_time > 0 else 0.0,
+                    'mean_us': 1e6 * stats.total / stats.calls,
+                    'p50_us': 1e6 * stats.percentile(50),
+                    'p90_us': 1e6 * stats.percentile(90),
+                    'p99_us': 1e6 * stats.percentile(99),
+                    'max_us': 1e6 * stats.max,
+                }
+            return {'wall_time_s': wall_time, 'spans': spans, 'counters': dict(sorted(self.counters.items()))}
+
+    def folded(self):
+        """
+        Format the self time of every stack of spans in the folded format read by flamegraph.pl,
+        inferno and speedscope.
+
+        Returns:
+            str: One 'outer;inner microseconds' line per stack.
+        """
+
+        with self.lock:
+            lines = [f"{path} {round(1e6 * seconds)}" for path, seconds in sorted(self.stacks.items())]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, limit=15):
+        """
+        Format the spans with the most total time and the counters as a table.
+
+        Args:
+            limit (int): The number of spans shown.
+
+        Returns:
+            str: The table.
+        """
+
+        report = self.report()
+        lines = [f"profile over {report['wall_time_s']:.2f}s",
+                 f"{'span':<28} {'calls':>10} {'total s':>9} {'share':>7} {'mean us':>10} {'p99 us':>10}"]
+        for name, stats in list(report['spans'].items())[:limit]:
+            lines.append(f"{name:<28} {stats['calls']:>10} {stats['total_s']:>9.3f} {stats['share']:>6.1%} "
+                         f"{stats['mean_us']:>10.1f} {stats['p99_us']:>10.1f}")
+        for name, value in report['counters'].items():
+            lines.append(f"{name:<28} {value:>10}")
+        return '\n'.join(lines)
+
+    def write(self, path, format='json'):
+        """
+        Write the profile to a file.
+
+        Args:
+            path (str): The output file.
+            format (str): 'json' for the report, 'folded' for the flame graph stacks.
+        """
+
+        with open(path, 'w') as f:
+            if format == 'folded':
+                f.write(self.folded())
+            else:
+                json.dump(self.report(), f, indent=2)
+
+
+# Profiler shared by every module
+PROFILER = Profiler()
+
+
+def span(name):
+    """
+    Time a block of code with the shared profiler, see Profiler.span.
+    """
+
+    if not PROFILER.enabled:
+        return NULL_SPAN
+    return Span(PROFILER, name)
+
+
+def count(name, n=1):
+    """
+    Add n to a counter of the shared profiler, see Profiler.count.
+    """
+
+    if PROFILER.enabled:
+        PROFILER.count(name, n)
+
+
+def timing_wrapper(func, name):
+    """
+    Wrap a function so every call is timed as a span of the shared profiler.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.enabled:
+            return func(*args, **kwargs)
+        with Span(PROFILER, name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# Methods decorated with timed as (class, attribute, function, span name), wrapped by enable and restored by disable
+TIMED_METHODS = []
+
+
+class TimedMethod():
+    """
+    Placeholder left in a class body by timed, it puts the plain function back on the class once the class exists.
+    """
+
+    def __init__(self, func, name):
+        self.func = func
+        self.name = name
+
+    def __set_name__(self, owner, attribute):
+        TIMED_METHODS.append((owner, attribute, self.func, self.name))
+        setattr(owner, attribute, timing_wrapper(self.func, self.name) if PROFILER.enabled else self.func)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function or method as a span of the shared profiler.
+
+    Methods stay plain functions while profiling is disabled, enable swaps in their timing
+    wrappers, so the emulator hot paths cost nothing extra. Module-level functions keep
+    a wrapper whose cost while disabled is one extra call and a flag check.
+
+    Args:
+        name (str): The span name.
+
+    Returns:
+        function: The decorator.
+    """
+
+    def decorator(func):
+        if '.' in func.__qualname__ and '<locals>' not in func.__qualname__:
+            return TimedMethod(func, name)
+        return timing_wrapper(func, name)
+    return decorator
+
+
+def enable():
+    """
+    Start recording with the shared profiler, dropping anything recorded before.
+    """
+
+    PROFILER.reset()
+    PROFILER.enabled = True
+    for owner, attribute, func, name in TIMED_METHODS:
+        setattr(owner, attribute, timing_wrapper(func, name))
+
+
+def disable():
+    """
+    Stop recording with the shared profiler, what was recorded stays available.
+    """
+
+    PROFILER.enabled = False
+    for owner, attribute, func, name in TIMED_METHODS:
+        setattr(owner, attribute, func)
+
+
+def add_arguments(parser):
+    """
+    Add the --profile and --profile-format options to a script's argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser.
+    """
+
+    parser.add_argument("--profile", metavar="PATH", help="record timing spans and counters and write them to PATH")
+    parser.add_argument("--profile-format", choices=("json", "folded"), default="json",
+                        help="json: totals, calls and percentiles per span; folded: flame graph stacks")
+
+
+def start(args):
+    """
+    Enable profiling if the script was run with --profile.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments of a parser given to add_arguments.
+    """
+
+    if args.profile:
+        enable()
+
+
+def finish(args):
+    """
+    Write the profile asked for with --profile and print its summary.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments of a parser given to add_arguments.
+    """
+
+    if args.profile:
+        disable()
+        PROFILER.write(args.profile, args.profile_format)
+        print(PROFILER.summary())
+        print(f"profile written to {args.profile}")
@@ -0,0 +1,360 @@
+#Recording played games as fixed-width binary records in append-only chunk files
+
+import glob
+import os
+import numpy as np
+from GameEmulator import BitGame
+from GameEmulator.VecGame import move_boards
+
+# One record per move: the packed board before the move, the score the move gained, its direction
+# and the tile spawned after it. The last record of a game holds its final board with action NO_ACTION.
+RECORD_DTYPE = np.dtype([('board', '<u8'), ('score', '<u4'), ('action', 'u1'), ('spawn', 'u1')])
+# One index entry per game: its first record in the chunk, its number of records and its final score
+GAME_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4'), ('score', '<u4')])
+
+NO_ACTION = 255
+# The spawn byte is 16 * cell + exponent of the new tile, 0 when no tile was placed
+NO_SPAWN = 0
+
+# Both files of a chunk start with a magic string, the format version and the size of their entries
+RECORD_MAGIC = b'2048TRJ\x00'
+INDEX_MAGIC = b'2048IDX\x00'
+VERSION = 1
+HEADER_SIZE = 16
+
+NIBBLE_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+
+
+def pack_exponents(exponents):
+    """
+    Pack a batch of exponent boards into 64-bit boards laid out as in BitGame.
+
+    Args:
+        exponents (numpy.ndarray): An (N, 4, 4) array of tile exponents.
+
+    Returns:
+        numpy.ndarray: An (N,) uint64 array of packed boards.
+    """
+
+    flat = np.asarray(exponents).reshape(-1, 16).astype(np.uint64)
+    return np.bitwise_or.reduce(flat << NIBBLE_SHIFTS, axis=1)
+
+
+def unpack_boards(boards):
+    """
+    Unpack a batch of 64-bit boards into tile exponents.
+
+    Args:
+        boards (numpy.ndarray): An (N,) array of packed boards.
+
+    Returns:
+        numpy.ndarray: An (N, 4, 4) uint8 array of tile exponents.
+    """
+
+    boards = np.asarray(boards, dtype=np.uint64).reshape(-1, 1)
+    return ((boards >> NIBBLE_SHIFTS) & np.uint64(0xF)).astype(np.uint8).reshape(-1, 4, 4)
+
+
+def spawn_codes(afterstates, next_exponents):
+    """
+    Find the tile spawned on each board of a batch.
+
+    Args:
+        afterstates (numpy.ndarray): The (N, 4, 4) exponent boards after the moves.
+        next_exponents (numpy.ndarray): The (N, 4, 4) exponent boards after the spawns.
+
+    Returns:
+        numpy.ndarray: The (N,) spawn bytes, NO_SPAWN where the boards are equal.
+    """
+
+    n = len(afterstates)
+    changed = (np.asarray(afterstates) != np.asarray(next_exponents)).reshape(n, 16)
+    cells = changed.argmax(axis=1)
+    exponents = np.asarray(next_exponents).reshape(n, 16)[np.arange(n), cells]
+    return np.where(changed.any(axis=1), 16 * cells + exponents, NO_SPAWN).astype(np.uint8)
+
+
+def to_packed(board):
+    """
+    Convert a board to a packed 64-bit board.
+
+    Args:
+        board (int or array-like): A packed board, or a 4x4 board of tile values as the emulators hold them.
+
+    Returns:
+        int: The packed board.
+    """
+
+    if isinstance(board, (int, np.integer)):
+        return int(board)
+    return BitGame.from_array(board)
+
+
+def write_header(f, magic, itemsize):
+    f.write(magic + np.array([VERSION, itemsize], dtype='<u4').tobytes())
+
+
+def read_header(path, magic, itemsize):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:8] != magic:
+        raise ValueError(f"{path} is not a trajectory file")
+    version, size = np.frombuffer(header[8:], dtype='<u4')
+    if version != VERSION or size != itemsize:
+        raise ValueError(f"{path} has format version {version} with {size} byte entries, "
+                         f"expected version {VERSION} with {itemsize} byte entries")
+
+
+class TrajectoryRecorder():
+    """
+    Class to stream played games to disk.
+
+    Every move is a 14-byte record (see RECORD_DTYPE), so a game of a thousand moves takes 14 KB.
+    The boards and actions of a game are kept in memory until the game ends, then its score gains
+    and spawns are worked out with a few array operations and it is written in one piece.
+    So the records of a game are contiguous and a game that never ends is never written.
+    Games go to chunk files <prefix>-NNNNNN.traj, each with a .idx file listing the offset,
+    length and final score of its games. Chunks are only ever appended to, a recorder opened
+    on a directory that already holds chunks starts a new one. Writes go through a buffer
+    of buffer_size bytes, so playing costs a couple of list appends per move.
+
+    Several games can be recorded at once, each under its own game id.
+
+    Attributes:
+        directory (str): The directory the chunks are written to.
+        prefix (str): The start of the chunk file names.
+        chunk_size (int): The size in bytes after which a new chunk is started.
+        games_written (int): The number of games written so far.
+    """
+
+    def __init__(self, directory, prefix='games', chunk_size=1 << 28, buffer_size=1 << 20):
+        """
+        Initialize the recorder.
+
+        Args:
+            directory (str): The directory the chunks are written to, created if needed.
+            prefix (str): The start of the chunk file names.
+            chunk_size (int): The size in bytes after which a new chunk is started.
+            buffer_size (int): The size in bytes of the write buffer of a chunk file.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        existing = chunk_paths(directory, prefix)
+        self.next_chunk = int(os.path.basename(existing[-1])[len(prefix) + 1:-5]) + 1 if existing else 0
+        self.records_file = None
+        self.index_file = None
+        self.chunk_records = 0
+        self.games = {}
+        self.games_written = 0
+
+    def __getstate__(self):
+        raise TypeError("a TrajectoryRecorder records in the process that created it, play with a single worker to record")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def begin(self, board, game=0):
+        """
+        Start recording a game.
+
+        Args:
+            board (int or array-like): The first board, packed or as a 4x4 board of tile values.
+            game (hashable): The id of the game.
+        """
+
+        if game in self.games:
+            raise ValueError(f"game {game} is already being recorded")
+        self.games[game] = ([to_packed(board)], [])
+
+    def move(self, action, board, game=0):
+        """
+        Record a move of a game.
+
+        Args:
+            action (int): The direction of the move (0: left, 1: up, 2: right, 3: down).
+            board (int or array-like): The board after the move and its new tile.
+            game (hashable): The id of the game.
+        """
+
+        boards, actions = self.games[game]
+        boards.append(to_packed(board))
+        actions.append(action)
+
+    def end(self, game=0, score=None):
+        """
+        Finish a game and write it.
+
+        The score gained and the tile spawned by every move are worked out here for the whole game at once.
+
+        Args:
+            game (hashable): The id of the game.
+            score (int, optional): The final score, the sum of the recorded score gains by default.
+        """
+
+        boards, actions = self.games.pop(game)
+        records = np.empty(len(boards), dtype=RECORD_DTYPE)
+        records['board'] = boards
+        records['action'][:-1] = actions
+        records['action'][-1] = NO_ACTION
+        records['score'][-1] = 0
+        records['spawn'][-1] = NO_SPAWN
+        if actions:
+            exponents = unpack_boards(records['board'])
+            afterstates, gains = move_boards(exponents[:-1], records['action'][:-1])
+            changed = (afterstates != exponents[1:]).reshape(-1, 16)
+            # A move changes the board by its merges, then only one empty cell may get a tile
+            spawned_on_empty = (afterstates.reshape(-1, 16)[changed] == 0).all()
+            if changed.sum(axis=1).max() > 1 or not spawned_on_empty:
+                raise ValueError(f"the boards of game {game} do not follow from their moves")
+            records['score'][:-1] = gains
+            records['spawn'][:-1] = spawn_codes(afterstates, exponents[1:])
+        self.write_game(records, int(records['score'].sum()) if score is None else score)
+
+    def record_batch(self, exponents, actions, next_exponents, dones, final_exponents, final_scores=None):
+        """
+        Record one step of a batch of games played in lockstep, such as VecGame2048 or GameBatch.
+
+        Game i of the batch is recorded under game id i. Its recording starts with the first step
+        recorded and ends when it is done, the game the emulator resets it to starts on the next step.
+
+        Args:
+            exponents (numpy.ndarray): The (N, 4, 4) exponent boards before the step.
+            actions (numpy.ndarray): The direction played on each board.
+            next_exponents (numpy.ndarray): The (N, 4, 4) exponent boards after the step.
+            dones (numpy.ndarray): Mask of the games that ended in the step.
+            final_exponents (numpy.ndarray): The (N, 4, 4) final boards of the games that ended.
+            final_scores (numpy.ndarray, optional): The final scores of the games that ended.
+        """
+
+        actions = np.asarray(actions).reshape(-1).tolist()
+        dones = np.asarray(dones)
+        next_boards = pack_exponents(np.where(dones[:, None, None], final_exponents, next_exponents)).tolist()
+        boards = None
+
+        for i, action in enumerate(actions):
+            game = self.games.get(i)
+            if game is None:
+                if boards is None:
+                    boards = pack_exponents(exponents).tolist()
+                game = self.games[i] = ([boards[i]], [])
+            game[0].append(next_boards[i])
+            game[1].append(action)
+            if dones[i]:
+                self.end(i, None if final_scores is None else int(final_scores[i]))
+
+    def write_game(self, records, score):
+        """
+        Append the records of a finished game to the current chunk and its index.
+        """
+
+        if self.records_file is None or (self.chunk_records + len(records)) * RECORD_DTYPE.itemsize > self.chunk_size:
+            self.open_chunk()
+        self.records_file.write(records.tobytes())
+        self.index_file.write(np.array([(self.chunk_records, len(records), score)], dtype=GAME_DTYPE).tobytes())
+        self.chunk_records += len(records)
+        self.games_written += 1
+
+    def open_chunk(self):
+        """
+        Close the current chunk and start the next one.
+        """
+
+        self.close_chunk()
+        path = os.path.join(self.directory, f"{self.prefix}-{self.next_chunk:06d}")
+        self.records_file = open(path + '.traj', 'xb', buffering=self.buffer_size)
+        self.index_file = open(path + '.idx', 'xb')
+        write_header(self.records_file, RECORD_MAGIC, RECORD_DTYPE.itemsize)
+        write_header(self.index_file, INDEX_MAGIC, GAME_DTYPE.itemsize)
+        self.next_chunk += 1
+        self.chunk_records = 0
+
+    def flush(self):
+        """
+        Push the buffered games to the operating system. Records are flushed before the index,
+        so the index never lists a game whose records are not in the file.
+        """
+
+        if self.records_file is not None:
+            self.records_file.flush()
+            self.index_file.flush()
+
+    def close_chunk(self):
+        if self.records_file is not None:
+            self.flush()
+            self.records_file.close()
+            self.index_file.close()
+            self.records_file = self.index_file = None
+
+    def close(self):
+        """
+        Write the buffered games and close the chunk. Games that have not ended are dropped.
+        """
+
+        self.games.clear()
+        self.close_chunk()
+
+
+def chunk_paths(directory, prefix='games'):
+    """
+    List the chunk files of a recording in the order they were written.
+
+    Args:
+        directory (str): The directory the chunks were written to.
+        prefix (str): The start of the chunk file names.
+
+    Returns:
+        list: The paths of the .traj files.
+    """
+
+    return sorted(glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(prefix)}-[0-9]*.traj")))
+
+
+def load_chunk(path):
+    """
+    Memory-map the records of a chunk and read its index.
+
+    Index entries whose records are not complete in the file, as after an interrupted write, are left out.
+
+    Args:
+        path (str): The path of the .traj file.
+
+    Returns:
+        tuple: The records as a read-only RECORD_DTYPE array backed by the file and the GAME_DTYPE index.
+    """
+
+    index_path = path[:-5] + '.idx'
+    read_header(path, RECORD_MAGIC, RECORD_DTYPE.itemsize)
+    read_header(index_path, INDEX_MAGIC, GAME_DTYPE.itemsize)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count > 0:
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+    else:
+        records = np.zeros(0, dtype=RECORD_DTYPE)
+    games = np.fromfile(index_path, dtype=GAME_DTYPE, offset=HEADER_SIZE)
+    games = games[games['offset'] + games['length'] <= count]
+    return records, games
+
+
+def read_games(directory, prefix='games'):
+    """
+    Iterate over every recorded game, chunk by chunk.
+
+    Args:
+        directory (str): The directory the chunks were written to.
+        prefix (str): The start of the chunk file names.
+
+    Yields:
+        numpy.ndarray: The RECORD_DTYPE records of one game, the last holding its final board.
+    """
+
+    for path in chunk_paths(directory, prefix):
+        records, games = load_chunk(path)
+        for offset, length in zip(games['offset'].tolist(), games['length'].tolist()):
+            yield records[offset:offset + length]
@@ -0,0 +1,262 @@
+import numpy as np
+from collections import OrderedDict
+from GameEmulator import BitGame
+from GameEmulator.BitGame import Game2048
+from GameEmulator.evaluation import evaluate
+
+# Weights of the board heuristic, applied to every row and every column
+SCORE_LOST_PENALTY = 200000.0
+SCORE_MONOTONICITY_POWER = 4.0
+SCORE_MONOTONICITY_WEIGHT = 47.0
+SCORE_SUM_POWER = 3.5
+SCORE_SUM_WEIGHT = 11.0
+SCORE_MERGES_WEIGHT = 700.0
+SCORE_EMPTY_WEIGHT = 270.0
+
+
+def row_heuristic(row):
+    """
+    Score a single packed row on empty cells, possible merges, monotonicity and tile sum.
+
+    Parameters:
+    - row: A packed 16-bit row of tile exponents.
+
+    Returns:
+    - The heuristic value of the row.
+    """
+    line = [(row >> (4 * i)) & 0xF for i in range(4)]
+
+    tile_sum = 0.0
+    empty = 0
+    merges = 0
+    previous = 0
+    counter = 0
+    for rank in line:
+        tile_sum += rank ** SCORE_SUM_POWER
+        if rank == 0:
+            empty += 1
+        else:
+            if previous == rank:
+                counter += 1
+            elif counter > 0:
+                merges += 1 + counter
+                counter = 0
+            previous = rank
+    if counter > 0:
+        merges += 1 + counter
+
+    monotonicity_left = 0.0
+    monotonicity_right = 0.0
+    for i in range(1, 4):
+        if line[i - 1] > line[i]:
+            monotonicity_left += line[i - 1] ** SCORE_MONOTONICITY_POWER - line[i] ** SCORE_MONOTONICITY_POWER
+        else:
+            monotonicity_right += line[i] ** SCORE_MONOTONICITY_POWER - line[i - 1] ** SCORE_MONOTONICITY_POWER
+
+    return (SCORE_LOST_PENALTY + SCORE_EMPTY_WEIGHT * empty + SCORE_MERGES_WEIGHT * merges
+            - SCORE_MONOTONICITY_WEIGHT * min(monotonicity_left, monotonicity_right)
+            - SCORE_SUM_WEIGHT * tile_sum)
+
+
+# Heuristic value of every possible row, so scoring a board is eight lookups
+ROW_HEURISTIC = [row_heuristic(row) for row in range(65536)]
+
+
+class Expectimax:
+    def __init__(self, game, search_depth=3, prob_threshold=1e-4, table_size=1000000, sample_count=50):
+        """
+        Initialize the Expectimax AI agent for the 2048 game.
+
+        Parameters:
+        - game: The instance of the BitGame 2048 game.
+        - search_depth: Number of moves searched ahead, including the move being chosen.
+        - prob_threshold: Spawn branches reached with a lower probability are scored by the heuristic.
+        - table_size: Maximum number of positions kept in the transposition table.
+        - sample_count: Number of samples to run for AI plotting.
+        """
+        self.game = game
+        self.SEARCH_DEPTH = search_depth
+        self.PROB_THRESHOLD = prob_threshold
+        self.TABLE_SIZE = table_size
+        self.SAMPLE_COUNT = sample_count
+
+        # Transposition table mapping a board to the depth it was searched to and its value
+        self.table = OrderedDict()
+        self.table_hits = 0
+        self.table_misses = 0
+        self.table_evictions = 0
+
+    def heuristic(self, board):
+        """
+        Score a packed board by summing the heuristic of its rows and columns.
+
+        Parameters:
+        - board: The packed board.
+
+        Returns:
+        - The heuristic value of the board.
+        """
+        transposed = BitGame.transpose(board)
+        value = 0.0
+        for shift in (0, 16, 32, 48):
+            value += ROW_HEURISTIC[(board >> shift) & 0xFFFF] + ROW_HEURISTIC[(transposed >> shift) & 0xFFFF]
+        return value
+
+    def lookup(self, board, depth):
+        """
+        Look a position up in the transposition table.
+
+        Parameters:
+        - board: The packed board.
+        - depth: The depth the position has to have been searched to.
+
+        Returns:
+        - The stored value, or None if the position is missing or was searched too shallowly.
+        """
+        entry = self.table.get(board)
+        if entry is not None and entry[0] >= depth:
+            self.table.move_to_end(board)
+            self.table_hits += 1
+            return entry[1]
+        self.table_misses += 1
+        return None
+
+    def store(self, board, depth, value):
+        """
+        Store a searched position, evicting the least recently used one when the table is full.
+
+        Parameters:
+        - board: The packed board.
+        - depth: The depth the position was searched to.
+        - value: The expected value of the position.
+        """
+        self.table[board] = (depth, value)
+        self.table.move_to_end(board)
+        if len(self.table) > self.TABLE_SIZE:
+            self.table.popitem(last=False)
+            self.table_evictions += 1
+
+    def expected_value(self, board, depth, prob):
+        """
+        Evaluate a chance node, averaging over every possible 2/4 spawn.
+
+        Parameters:
+        - board: The packed board after a move, before the new tile.
+        - depth: Number of moves left to search.
+        - prob: Probability of reaching this node.
+
+        Returns:
+        - The expected value of the board.
+        """
+        if depth <= 0 or prob < self.PROB_THRESHOLD:
+            return self.heuristic(board)
+
+        value = self.lookup(board, depth)
+        if value is not None:
+            return value
+
+        cells = BitGame.empty_cells(board)
+        cell_prob = prob / len(cells)
+        value = 0.0
+        for cell in cells:
+            shift = 4 * cell
+            value += 0.9 * self.best_value(board | (1 << shift), depth, cell_prob * 0.9)
+            value += 0.1 * self.best_value(board | (2 << shift), depth, cell_prob * 0.1)
+        value /= len(cells)
+
+        self.store(board, depth, value)
+        return value
+
+    def best_value(self, board, depth, prob):
+        """
+        Evaluate a max node, taking the best of the four moves.
+
+        Parameters:
+        - board: The packed board with the new tile placed.
+        - depth: Number of moves left to search, including this one.
+        - prob: Probability of reaching this node.
+
+        Returns:
+        - The value of the best move, 0 if no move is possible.
+        """
+        boards, _, legal = BitGame.afterstates(board)
+        if not legal:
+            return 0.0
+        # The heuristic can be negative, so the best move is not compared against 0
+        return max(self.expected_value(boards[direction], depth - 1, prob)
+                   for direction in range(4) if legal >> direction & 1)
+
+    def ai_move(self, game):
+        """
+        Perform an AI move for the 2048 game.
+
+        Parameters:
+        - game: The instance of the BitGame 2048 game.
+
+        Returns:
+        - The updated game board and flag indicating game continuation.
+        """
+        board = game.state
+        boards, _, legal = BitGame.afterstates(board)
+        if not legal:
+            game.game_over = True
+            return game.board, False
+
+        # Illegal moves stay at -inf, so they lose to any legal move however negative its value
+        move_scores = np.full(4, -np.inf)
+        for direction in range(4):
+            if legal >> direction & 1:
+                move_scores[direction] = self.expected_value(boards[direction], self.SEARCH_DEPTH - 1, 1.0)
+
+        game.take_turn(int(np.argmax(move_scores)))
+        return game.board, game.check_valid()
+
+    def ai_play(self):
+        """
+        Play the 2048 game using the AI agent.
+
+        Returns:
+        - The maximum tile value achieved during the game.
+        """
+        valid_game = True
+
+        while valid_game:
+            board, valid_game = self.ai_move(self.game)
+
+        print("Game over! No more valid moves.")
+        return np.amax(self.game.board)
+
+    def play_sample(self):
+        """
+        Reset the game and play it to the end.
+
+        Returns:
+        - The maximum tile value achieved and the final score.
+        """
+        self.game.reset()
+        max_tile = self.ai_play()
+        print(f"transposition table: {self.table_hits} hits, {self.table_misses} misses, "
+              f"{self.table_evictions} evictions")
+        return max_tile, self.game.score
+
+    def ai_plot(self, num_workers=1, output=None, seed=None):
+        """
+        Plot the frequency of achieving different scores over multiple AI plays.
+
+        Parameters:
+        - num_workers: Number of worker processes playing games in parallel.
+        - output: Optional .json or .csv path to write the results to instead of showing the plot.
+        - seed: Seed from which every game's own seed is derived.
+
+        Returns:
+        - The TileHistogram of the played games.
+        """
+        return evaluate(self, self.SAMPLE_COUNT, num_workers=num_workers, seed=seed, output=output)
+
+
+# Testing code
+if __name__ == "__main__":
+
+    game = Game2048()
+    expectimax = Expectimax(game, search_depth=3, prob_threshold=1e-4, table_size=1000000, sample_count=50)
+    expectimax.ai_plot()
@@ -0,0 +1,305 @@
+import math
+import random
+import numpy as np
+from GameEmulator import BitGame
+from GameEmulator.BitGame import Game2048
+from GameEmulator.evaluation import evaluate
+
+DECISION = 0  # Node where the player picks a move, children indexed by direction
+CHANCE = 1  # Afterstate waiting for a new tile, children indexed by 2 * cell + (exponent - 1)
+MAX_CHILDREN = 32
+
+
+def spawn_slot(afterstate, board):
+    """
+    Find the child slot of a chance node that leads to a board.
+
+    Parameters:
+    - afterstate: The packed board before the new tile.
+    - board: The packed board with the new tile placed.
+
+    Returns:
+    - The child slot, or None if the boards do not differ by exactly one new tile.
+    """
+    spawned = board ^ afterstate
+    if spawned == 0 or board & afterstate != afterstate:
+        return None
+    cell = (spawned.bit_length() - 1) // 4
+    exponent = spawned >> (4 * cell)
+    if exponent not in (1, 2) or spawned != exponent << (4 * cell):
+        return None
+    return 2 * cell + exponent - 1
+
+
+class MonteCarloTreeSearch:
+    def __init__(self, game, simulations=1000, rollout_length=20, exploration=1.4, node_budget=200000,
+                 sample_count=50):
+        """
+        Initialize the Monte Carlo Tree Search AI agent for the 2048 game.
+
+        The tree lives in preallocated arrays, nodes are referred to by their index.
+        After every move the subtree under the chosen move and the tile that actually
+        spawned becomes the new root, and every other node goes back to the free list.
+
+        Parameters:
+        - game: The instance of the BitGame 2048 game.
+        - simulations: Number of selection/expansion/simulation/backpropagation passes per move.
+        - rollout_length: Maximum number of random moves played in each simulation.
+        - exploration: UCB1 exploration constant.
+        - node_budget: Number of nodes preallocated for the tree.
+        - sample_count: Number of samples to run for AI plotting.
+        """
+        self.game = game
+        self.SIMULATIONS = simulations
+        self.ROLLOUT_LENGTH = rollout_length
+        self.EXPLORATION = exploration
+        self.NODE_BUDGET = node_budget
+        self.SAMPLE_COUNT = sample_count
+
+        self.boards = np.zeros(node_budget, dtype=np.uint64)
+        self.kinds = np.zeros(node_budget, dtype=np.int8)
+        self.visits = np.zeros(node_budget, dtype=np.int64)
+        self.value_sums = np.zeros(node_budget, dtype=np.float64)
+        self.children = np.full((node_budget, MAX_CHILDREN), -1, dtype=np.int32)
+        self.reset_tree()
+
+    def reset_tree(self):
+        """
+        Drop the whole tree and put every node back on the free list.
+        """
+        self.free = list(range(self.NODE_BUDGET - 1, -1, -1))
+        self.root = -1
+        self.last_afterstate = -1
+
+    def new_node(self, board, kind):
+        """
+        Take a node from the free list.
+
+        Parameters:
+        - board: The packed board of the node.
+        - kind: DECISION or CHANCE.
+
+        Returns:
+        - The index of the node, or -1 if the node budget is used up.
+        """
+        if not self.free:
+            return -1
+        node = self.free.pop()
+        self.boards[node] = board
+        self.kinds[node] = kind
+        self.visits[node] = 0
+        self.value_sums[node] = 0.0
+        self.children[node] = -1
+        return node
+
+    def retain(self, root):
+        """
+        Keep only the subtree under a node and recycle every other node.
+
+        Parameters:
+        - root: The index of the node that becomes the root.
+        """
+        alive = np.zeros(self.NODE_BUDGET, dtype=bool)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            alive[node] = True
+            stack.extend(int(c) for c in self.children[node] if c >= 0)
+        self.free = np.flatnonzero(~alive)[::-1].tolist()
+        self.root = root
+
+    def rollout(self, board):
+        """
+        Play random moves from a board.
+
+        Parameters:
+        - board: The packed board to start from, a new tile already placed.
+
+        Returns:
+        - The score collected during the rollout.
+        """
+        score = 0
+        directions = [0, 1, 2, 3]
+        for _ in range(self.ROLLOUT_LENGTH):
+            random.shuffle(directions)
+            for direction in directions:
+                new_board, gain = BitGame.MOVES[direction](board)
+                if new_board != board:
+                    break
+            else:
+                break
+            score += gain
+            board = BitGame.add_random_tile(new_board)
+        return score
+
+    def select_move(self, node):
+        """
+        Pick the move to follow from a fully expanded decision node using UCB1.
+
+        Parameters:
+        - node: The index of the decision node.
+
+        Returns:
+        - The direction of the chosen move.
+        """
+        children = self.children[node, :4]
+        log_visits = math.log(self.visits[node])
+        means = [self.value_sums[c] / self.visits[c] if c >= 0 else 0.0 for c in children]
+        # Scores grow over the game, so the mean values are scaled into [0, 1] first
+        scale = max(means) or 1.0
+        best, best_direction = -1.0, -1
+        for direction, child in enumerate(children):
+            if child < 0:
+                continue
+            ucb = means[direction] / scale + self.EXPLORATION * math.sqrt(log_visits / self.visits[child])
+            if ucb > best:
+                best, best_direction = ucb, direction
+        return best_direction
+
+    def simulate(self):
+        """
+        Run one selection, expansion, simulation and backpropagation pass from the root.
+        """
+        path = [self.root]
+        rewards = [0]
+        node = self.root
+        leaf_value = 0.0
+
+        while True:
+            board = int(self.boards[node])
+            if self.kinds[node] == DECISION:
+                afterstates, gains, moved = BitGame.afterstates(board)
+                legal = [d for d in range(4) if moved >> d & 1]
+                if not legal:
+                    break  # Terminal position, nothing more to collect
+                untried = [d for d in legal if self.children[node, d] < 0]
+                if untried:
+                    direction = random.choice(untried)
+                else:
+                    direction = self.select_move(node)
+                afterstate, gain = afterstates[direction], gains[direction]
+                child = self.children[node, direction]
+                if child < 0:
+                    child = self.new_node(afterstate, CHANCE)
+                    if child < 0:
+                        # Out of nodes, evaluate from here without growing the tree
+                        leaf_value = gain + self.rollout(BitGame.add_random_tile(afterstate))
+                        break
+                    self.children[node, direction] = child
+                node = int(child)
+                path.append(node)
+                rewards.append(gain)
+            else:
+                new_board = BitGame.add_random_tile(board)
+                slot = spawn_slot(board, new_board)
+                child = self.children[node, slot]
+                if child < 0:
+                    child = self.new_node(new_board, DECISION)
+                    if child >= 0:
+                        self.children[node, slot] = child
+                        path.append(int(child))
+                        rewards.append(0)
+                    leaf_value = self.rollout(new_board)
+                    break
+                node = int(child)
+                path.append(node)
+                rewards.append(0)
+
+        # Each node collects the score gained after it was reached plus the rollout score
+        value = leaf_value
+        for node, reward in zip(reversed(path), reversed(rewards)):
+            self.visits[node] += 1
+            self.value_sums[node] += value
+            value += reward
+
+    def find_root(self, board):
+        """
+        Reuse the subtree for the current board if the last search reached it, else start a new tree.
+
+        Parameters:
+        - board: The packed board to search from.
+        """
+        if self.last_afterstate >= 0:
+            slot = spawn_slot(int(self.boards[self.last_afterstate]), board)
+            if slot is not None and self.children[self.last_afterstate, slot] >= 0:
+                self.retain(int(self.children[self.last_afterstate, slot]))
+                return
+        self.reset_tree()
+        self.root = self.new_node(board, DECISION)
+
+    def ai_move(self, game):
+        """
+        Perform an AI move for the 2048 game.
+
+        Parameters:
+        - game: The instance of the BitGame 2048 game.
+
+        Returns:
+        - The updated game board and flag indicating game continuation.
+        """
+        if not game.check_valid():
+            game.game_over = True
+            return game.board, False
+
+        self.find_root(game.state)
+        for _ in range(self.SIMULATIONS):
+            self.simulate()
+
+        # Play the most visited move
+        children = self.children[self.root, :4]
+        visits = [self.visits[c] if c >= 0 else -1 for c in children]
+        direction = int(np.argmax(visits))
+        self.last_afterstate = int(children[direction])
+
+        game.take_turn(direction)
+        return game.board, game.check_valid()
+
+    def ai_play(self):
+        """
+        Play the 2048 game using the AI agent.
+
+        Returns:
+        - The maximum tile value achieved during the game.
+        """
+        valid_game = True
+        self.reset_tree()
+
+        while valid_game:
+            board, valid_game = self.ai_move(self.game)
+
+        print("Game over! No more valid moves.")
+        return np.amax(self.game.board)
+
+    def play_sample(self):
+        """
+        Reset the game and play it to the end.
+
+        Returns:
+        - The maximum tile value achieved and the final score.
+        """
+        self.game.reset()
+        max_tile = self.ai_play()
+        return max_tile, self.game.score
+
+    def ai_plot(self, num_workers=1, output=None, seed=None):
+        """
+        Plot the frequency of achieving different scores over multiple AI plays.
+
+        Parameters:
+        - num_workers: Number of worker processes playing games in parallel.
+        - output: Optional .json or .csv path to write the results to instead of showing the plot.
+        - seed: Seed from which every game's own seed is derived.
+
+        Returns:
+        - The TileHistogram of the played games.
+        """
+        return evaluate(self, self.SAMPLE_COUNT, num_workers=num_workers, seed=seed, output=output)
+
+
+# Testing code
+if __name__ == "__main__":
+
+    game = Game2048()
+    mcts = MonteCarloTreeSearch(game, simulations=1000, rollout_length=20, exploration=1.4,
+                                node_budget=200000, sample_count=50)
+    mcts.ai_plot()
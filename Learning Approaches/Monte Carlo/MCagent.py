@@ -1,10 +1,17 @@
+import argparse
 import numpy as np
 import random
-import matplotlib.pyplot as plt
 from GameEmulator.RLGame import Game2048
+from GameEmulator.core import BACKENDS, DEFAULT_BACKEND, action_index
+from GameEmulator.recorder import TrajectoryRecorder
+from GameEmulator.evaluation import evaluate
+from afterstate_cache import AfterstateCache
+from GameEmulator import profiling
+from GameEmulator.profiling import timed
 
 class MonteCarlo2048:
-    def __init__(self, game, num_moves=4, sample_count=50, spm_scale_param=10, sl_scale_param=4, search_param=200):
+    def __init__(self, game, num_moves=4, sample_count=50, spm_scale_param=10, sl_scale_param=4, search_param=200,
+                 cache_size=100000, recorder=None):
         """
         Initialize the Monte Carlo AI agent for the 2048 game.
 
@@ -15,6 +22,8 @@ class MonteCarlo2048:
         - spm_scale_param: Scaling parameter for searches per move.
         - sl_scale_param: Scaling parameter for search length.
         - search_param: Parameter for determining when to increase searches per move and search length.
+        - cache_size: Number of afterstates whose rollout results are cached, 0 disables the cache.
+        - recorder: Optional TrajectoryRecorder the played games are written to.
         """
         self.game = game
         self.NUMBER_OF_MOVES = num_moves
@@ -22,6 +31,9 @@ class MonteCarlo2048:
         self.SPM_SCALE_PARAM = spm_scale_param
         self.SL_SCALE_PARAM = sl_scale_param
         self.SEARCH_PARAM = search_param
+        self.cache = AfterstateCache(cache_size) if cache_size else None
+        self.recorder = recorder
+        self.last_action = None
 
     def get_search_params(self, move_number):
         """
@@ -50,10 +62,47 @@ class MonteCarlo2048:
         """
         return 2048 in board
 
+    @timed("MCagent.rollout")
+    def rollout(self, game, afterstate):
+        """
+        Play random moves on the game starting from an afterstate.
+
+        Parameters:
+        - game: The instance of the 2048 game, its board and score are overwritten.
+        - afterstate: The board after the first move, before its new tile.
+
+        Returns:
+        - The score of the rollout, the running game score summed over every move made.
+        """
+        possible_moves = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+        game.board = afterstate
+        game.score = 0
+        game.game_over = game.new_pieces()
+        win = False
+        rollout_score = 0
+        move_number = 1
+
+        while not game.game_over and not win and move_number < self.search_length:
+            game.state_action(random.choice(possible_moves))
+            moved = game.take_turn()
+            move_number += 1
+
+            if moved:
+                rollout_score += game.get_score()
+                game.game_over = game.new_pieces()
+                win = self.check_for_win(game.board)
+
+        profiling.count("MCagent.rollout_moves", move_number - 1)
+        return rollout_score
+
+    @timed("MCagent.ai_move")
     def ai_move(self, game):
         """
         Perform an AI move for the 2048 game.
 
+        The four first moves come from one afterstates call, rollouts run on the game itself
+        and its board and score are restored before the chosen move is played.
+
         Parameters:
         - game: The instance of the 2048 game.
 
@@ -62,45 +111,48 @@ class MonteCarlo2048:
         """
         possible_moves = ['UP', 'DOWN', 'LEFT', 'RIGHT']
         move_scores = np.zeros(self.NUMBER_OF_MOVES)
-        win = False
-
+        start_board = game.environment_state()
+        start_score = game.get_score()
+        afterstates, gains, legal = game.afterstates()
         move_made = False
 
         for i, move in enumerate(possible_moves):
-            board_copy = np.copy(game.environment_state())
-            game.state_action(move)
-            game.take_turn()
-
-            if not np.array_equal(board_copy, game.environment_state()):
-                move_scores[i] += game.get_score()
-                move_made = True
-
-                for _ in range(self.searches_per_move):
-                    move_number = 1
-                    search_board = np.copy(game.environment_state())
-                    game.game_over = False
-                    win = False  # Reset win for each move
-                    
-                    while not game.game_over and not win and move_number < self.search_length:
-                        random_move = random.choice(possible_moves)
-                        board_copy = np.copy(search_board)
-                        game.state_action(random_move)
-                        game.take_turn()
-                        move_number += 1
-                        
-                        if not np.array_equal(board_copy, game.environment_state()):
-                            game.new_pieces()
-                            move_scores[i] += game.get_score()
-                            game.game_over = game.new_pieces()
-                            win = self.check_for_win(game.environment_state())
-               
-        if not move_made:
-            game.game_over = True
+            direction = action_index(move)
+            if not legal >> direction & 1:
+                continue
+
+            move_made = True
+            move_scores[i] += start_score + gains[direction]
+            afterstate = afterstates[direction]
+
+            # Only top the cached estimate up to searches_per_move rollouts
+            if self.cache is not None:
+                key = self.cache.key(afterstate, self.search_length)
+                cached_score, cached_count = self.cache.get(key)
+                searches = max(0, self.searches_per_move - cached_count)
+            else:
+                searches = self.searches_per_move
+
+            rollout_scores = sum(self.rollout(game, afterstate) for _ in range(searches))
+            profiling.count("MCagent.rollouts", searches)
+
+            if self.cache is not None:
+                total_score, count = self.cache.add(key, rollout_scores, searches, self.searches_per_move)
+                if count > 0:
+                    move_scores[i] += self.searches_per_move * total_score / count
+            else:
+                move_scores[i] += rollout_scores
+
+        game.board = start_board
+        game.score = start_score
+        game.game_over = not move_made
 
         best_move_index = np.argmax(move_scores)
         best_move = possible_moves[best_move_index]
+        self.last_action = action_index(best_move)
         game.state_action(best_move)
         game.take_turn()
+        win = self.check_for_win(game.environment_state())
         return game.environment_state(), not game.game_over, win
 
     def ai_play(self):
@@ -115,6 +167,8 @@ class MonteCarlo2048:
         win = False
         self.game.new_pieces()
         self.game.new_pieces()
+        if self.recorder is not None:
+            self.recorder.begin(self.game.board)
 
         while valid_game and not win:
             move_number += 1
@@ -123,49 +177,66 @@ class MonteCarlo2048:
             
             if valid_game:
                 self.game.new_pieces()
+                if self.recorder is not None:
+                    self.recorder.move(self.last_action, self.game.board)
                 
             if win:
                 print("Congratulations! You have reached 2048!")
             elif not valid_game:
                 print("Game over! No more valid moves.")
 
+        if self.cache is not None:
+            print(f"afterstate cache: {self.cache.stats()}")
+        if self.recorder is not None:
+            self.recorder.end(score=self.game.get_score())
+
         return np.amax(self.game.environment_state())
     
-    def ai_plot(self):
+    def play_sample(self):
+        """
+        Reset the game and play it to the end.
+
+        Returns:
+        - The maximum tile value achieved and the final score.
+        """
+        self.game.reset_game()
+        max_tile = self.ai_play()
+        return max_tile, self.game.get_score()
+
+    def ai_plot(self, num_workers=1, output=None, seed=None):
         """
         Plot the frequency of achieving different scores over multiple AI plays.
+
+        Parameters:
+        - num_workers: Number of worker processes playing games in parallel.
+        - output: Optional .json or .csv path to write the results to instead of showing the plot.
+        - seed: Seed from which every game's own seed is derived.
+
+        Returns:
+        - The TileHistogram of the played games.
         """
-        tick_locations = np.arange(1, 12)
-        final_scores = []
-        
-        for i in range(self.SAMPLE_COUNT):
-            if i % 20 == 0:
-                print(f"sample count {i}")
-            game.reset_game() # Reset game for each sample
-            game_finished = self.ai_play()
-            final_scores.append(game_finished)
-        
-        all_counts = np.zeros(11)
-        unique, counts = np.unique(np.array(final_scores), return_counts=True)
-        unique = np.log2(unique).astype(int)
-        index = 0
-        
-        for tick in tick_locations:
-            if tick in unique:
-                all_counts[tick - 1] = counts[index]
-                index += 1
-        
-        plt.bar(tick_locations, all_counts)
-        plt.xticks(tick_locations, np.power(2, tick_locations))
-        plt.xlabel("Score of Game", fontsize=24)
-        plt.ylabel(f"Frequency per {self.SAMPLE_COUNT} runs", fontsize=24)
-        plt.show()
+        return evaluate(self, self.SAMPLE_COUNT, num_workers=num_workers, seed=seed, output=output)
 
 
 # Testing code
 if __name__ == "__main__" :
-
-    game = Game2048()
+    parser = argparse.ArgumentParser(description="Play 2048 with the Monte Carlo agent")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=DEFAULT_BACKEND, help="game core backend")
+    parser.add_argument("--record", metavar="DIR", help="write every played game to trajectory files in DIR")
+    parser.add_argument("--eval-workers", type=int, default=1, help="worker processes playing the sample games")
+    parser.add_argument("--output", help="write the results to a .json or .csv file instead of showing the plot")
+    parser.add_argument("--seed", type=int, default=None, help="seed from which every sample game's seed is derived")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    if args.record and args.eval_workers > 1:
+        parser.error("--record writes from one process, it cannot be combined with --eval-workers")
+    profiling.start(args)
+
+    recorder = TrajectoryRecorder(args.record) if args.record else None
+    game = Game2048(backend=args.backend)
     monte_carlo = MonteCarlo2048(game, num_moves=4, sample_count=50, 
-                                 spm_scale_param=10, sl_scale_param=4, search_param=200)
-    monte_carlo.ai_plot()
\ No newline at end of file
+                                 spm_scale_param=10, sl_scale_param=4, search_param=200, recorder=recorder)
+    monte_carlo.ai_plot(num_workers=args.eval_workers, output=args.output, seed=args.seed)
+    if recorder is not None:
+        recorder.close()
+    profiling.finish(args)
\ No newline at end of file
@@ -1,59 +1,177 @@
 from GameEmulator.MCGame import Game2048
+from GameEmulator.core import BACKENDS, DEFAULT_BACKEND
+from GameEmulator.recorder import TrajectoryRecorder
+import argparse
 import random
-import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
+from GameEmulator.evaluation import evaluate
+from afterstate_cache import AfterstateCache
+from GameEmulator import profiling
+from GameEmulator.profiling import span, timed
+
+
+# Direction code (0: left, 1: up, 2: right, 3: down) of each first move tried by ai_move
+FIRST_MOVE_DIRECTIONS = (0, 1, 3, 2)
+
+
+@timed("MCagent2.run_simulations")
+def run_simulations(game, board, number_of_simulations, search_length_per_move, seed=None):
+    # Plays random games from the board and returns the total score they collected.
+    # Lives at module level so that pool workers can run it as well.
+    # The rollouts draw from the game's own generator, which every task gets an identical copy of,
+    # so each chunk reseeds its game to play different rollouts.
+    if seed is not None:
+        game.seed(seed)
+
+    total_score = 0
+    total_moves = 0
+    for _ in range(number_of_simulations):
+        move_number = 1
+        search_board = np.copy(board)
+        game_valid = True
+
+        while game_valid and move_number < search_length_per_move:
+            search_board, game_valid, score = game.random_move(search_board)
+
+            if game_valid:
+                search_board = game.add_new_tile(search_board)
+                total_score += score
+                move_number += 1
+        total_moves += move_number - 1
+
+    profiling.count("MCagent2.rollouts", number_of_simulations)
+    profiling.count("MCagent2.rollout_moves", total_moves)
+    return total_score
+
 
 class MonteCarlo:
-    def __init__(self, game ,searches_per_move, search_length, search_param, sample_count):
+    def __init__(self, game ,searches_per_move, search_length, search_param, sample_count, num_workers=1, cache_size=100000,
+                 recorder=None):
         self.searches_per_move_scale = searches_per_move
         self.search_length_scale = search_length
         self.search_param = search_param
         self.num_moves = 4
         self.sample_count = sample_count
         self.game = game
+        # Rollouts are spread over a pool of worker processes when num_workers > 1.
+        # The pool is created on first use and kept for every following move and game.
+        self.num_workers = num_workers
+        self.pool = None
+        self.score = 0
+        # Rollout results are kept per canonical afterstate so later moves build on them, cache_size=0 disables it
+        self.cache = AfterstateCache(cache_size) if cache_size else None
+        # Played games are written to the recorder if one is given, last_action is the direction of the last move
+        self.recorder = recorder
+        self.last_action = None
 
     def get_search_param(self, move_number):
         self.searches_per_move = self.searches_per_move_scale * (1+(move_number // self.search_param))
         self.search_length = self.search_length_scale * (1+(move_number // self.search_param))
 
+    def __getstate__(self):
+        # Pools cannot be shared between processes, a copy sent to a worker runs its rollouts serially
+        state = self.__dict__.copy()
+        state["pool"] = None
+        state["num_workers"] = 1
+        return state
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.num_workers)
+        return self.pool
+
+    def close(self):
+        # Shuts the worker pool down, a new one is started if the agent is used again
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def simulate_moves(self, game, first_boards, simulations, search_length_per_move):
+        # Returns the rollout score collected from each first move's board (None for moves not made),
+        # running simulations[i] rollouts for the i-th first move
+        rollout_scores = np.zeros(self.num_moves)
+
+        if self.num_workers <= 1:
+            for first_move_index, board in enumerate(first_boards):
+                if board is not None:
+                    rollout_scores[first_move_index] = run_simulations(game, board, simulations[first_move_index],
+                                                                       search_length_per_move)
+            return rollout_scores
+
+        # Split each move's simulations into one chunk per worker, every chunk with its own seed
+        tasks = []
+        task_moves = []
+        for first_move_index, board in enumerate(first_boards):
+            if board is None:
+                continue
+            number_of_simulations = simulations[first_move_index]
+            chunks = [number_of_simulations // self.num_workers + (worker < number_of_simulations % self.num_workers)
+                      for worker in range(self.num_workers)]
+            for chunk in chunks:
+                if chunk > 0:
+                    tasks.append((game, board, chunk, search_length_per_move, random.getrandbits(32)))
+                    task_moves.append(first_move_index)
+
+        # Spans and counters of the workers stay in their processes, the wait shows as MCagent2.pool
+        with span("MCagent2.pool"):
+            results = self.get_pool().starmap(run_simulations, tasks)
+        profiling.count("MCagent2.rollouts", sum(task[2] for task in tasks))
+        for first_move_index, score in zip(task_moves, results):
+            rollout_scores[first_move_index] += score
+        return rollout_scores
+
+    @timed("MCagent2.ai_move")
     def ai_move(self,game, number_of_simulations, search_length_per_move):
 
-        possible_first_moves = [game.move_left, game.move_up, game.move_down, game.move_right]
         first_move_scores = np.zeros(self.num_moves)
+        first_boards = [None] * self.num_moves
+        afterstate_keys = [None] * self.num_moves
+        simulations = [number_of_simulations] * self.num_moves
 
+        # All four first moves in one call, the spawns go on copies so the afterstates stay as they are
+        afterstates, gains, legal = game.afterstates(game.get_environment())
         for first_move_index in range(self.num_moves):
-            first_move_function =  possible_first_moves[first_move_index]
-            board_copy = np.copy(game.get_environment())
-            board_with_first_move, first_move_made, first_move_score = first_move_function(board_copy)
-
-            if first_move_made:
-                board_with_first_move = game.add_new_tile(board_with_first_move)
-                first_move_scores[first_move_index] += first_move_score
-
-            else:
+            direction = FIRST_MOVE_DIRECTIONS[first_move_index]
+
+            if legal >> direction & 1:
+                board_with_first_move = afterstates[direction]
+                if self.cache is not None:
+                    # Only top the cached estimate up to number_of_simulations rollouts
+                    key = self.cache.key(board_with_first_move, search_length_per_move)
+                    cached_score, cached_count = self.cache.get(key)
+                    afterstate_keys[first_move_index] = key
+                    simulations[first_move_index] = max(0, number_of_simulations - cached_count)
+                with span("MCagent2.copy"):
+                    board_copy = np.copy(board_with_first_move)
+                first_boards[first_move_index] = game.add_new_tile(board_copy)
+                first_move_scores[first_move_index] += gains[direction]
+
+        rollout_scores = self.simulate_moves(game, first_boards, simulations, search_length_per_move)
+
+        for first_move_index, key in enumerate(afterstate_keys):
+            if key is None:
+                first_move_scores[first_move_index] += rollout_scores[first_move_index]
                 continue
-
-            for _ in range(number_of_simulations):
-                move_number = 1
-                search_board = np.copy(board_with_first_move)
-                game_valid = True
-
-                while game_valid and move_number < search_length_per_move:
-                    search_board, game_valid, score = game.random_move(search_board)
-
-                    if game_valid:
-                        search_board = game.add_new_tile(search_board)
-                        first_move_scores[first_move_index] += score
-                        move_number += 1
+            total_score, count = self.cache.add(key, rollout_scores[first_move_index],
+                                                simulations[first_move_index], number_of_simulations)
+            if count > 0:
+                # Scale the mean so moves are compared on number_of_simulations rollouts as before
+                first_move_scores[first_move_index] += number_of_simulations * total_score / count
 
         best_move_index = np.argmax(first_move_scores)
-        best_move = possible_first_moves[best_move_index]
-        search_board, game_valid, score = best_move(board_copy)
-        return search_board, game_valid
+        direction = FIRST_MOVE_DIRECTIONS[best_move_index]
+        self.last_action = direction
+        self.score += gains[direction]
+        return afterstates[direction], bool(legal >> direction & 1)
 
     def ai_play(self, game):
         move_number = 0
+        self.score = 0
         valid_game = True
+        if self.recorder is not None:
+            self.recorder.begin(game.board)
 
         while valid_game:
             move_number += 1
@@ -62,6 +180,9 @@ class MonteCarlo:
 
             if valid_game:
                 board = game.add_new_tile(board)
+                if self.recorder is not None:
+                    self.recorder.move(self.last_action, board)
+            game.board = board
 
             if game.check_for_win(board):
                 valid_game = False
@@ -70,32 +191,44 @@ class MonteCarlo:
             print(move_number)
 
         print(board)
+        if self.cache is not None:
+            print(f"afterstate cache: {self.cache.stats()}")
+        if self.recorder is not None:
+            self.recorder.end(score=self.score)
         return np.amax(board)
-    
-    def ai_plot(self, game, move_func):
-
-        tick_locations = np.arange(1, 12)
-        final_scores = []
-
-        for i in range(self.sample_count):
-
-            print(i,"th game -> \n")
-            board = game.reset_game()
-            game_end_score = self.ai_play(board)
-            final_scores.append(game_end_score)
-
-        all_counts = np.zeros(11)
-        unique, counts = np.unique(np.array(final_scores), return_counts=True)
-        unique = np.log2(unique).astype(int)
-        index = 0
-
-        for tick in tick_locations:
-            if tick in unique:
-                all_counts[tick-1] = counts[index]
-                index += 1
-
-        plt.bar(tick_locations, all_counts)
-        plt.xticks(tick_locations, np.power(2, tick_locations))
-        plt.xlabel("Score of Game", fontsize = 24)
-        plt.ylabel(f"Frequency per {self.sample_count} runs", fontsize = 24)
-        plt.show()
+
+    def play_sample(self):
+        # Resets the agent's game and plays it to the end, returning the max tile and the score
+        self.game.reset_game()
+        max_tile = self.ai_play(self.game)
+        return max_tile, self.score
+
+    def ai_plot(self, game, move_func, num_workers=1, output=None, seed=None):
+        # Plays sample_count games, in parallel when num_workers > 1, and plots the max tile
+        # frequencies, or writes them to a .json/.csv output file instead of showing the plot
+        self.game = game
+        return evaluate(self, self.sample_count, num_workers=num_workers, seed=seed, output=output)
+
+
+# Testing code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play 2048 with the Monte Carlo agent")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=DEFAULT_BACKEND, help="game core backend")
+    parser.add_argument("--num-workers", type=int, default=1, help="worker processes for the rollouts")
+    parser.add_argument("--record", metavar="DIR", help="write every played game to trajectory files in DIR")
+    parser.add_argument("--eval-workers", type=int, default=1, help="worker processes playing the sample games")
+    parser.add_argument("--output", help="write the results to a .json or .csv file instead of showing the plot")
+    parser.add_argument("--seed", type=int, default=None, help="seed from which every sample game's seed is derived")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    if args.record and args.eval_workers > 1:
+        parser.error("--record writes from one process, it cannot be combined with --eval-workers")
+    profiling.start(args)
+
+    recorder = TrajectoryRecorder(args.record) if args.record else None
+    game = Game2048(backend=args.backend)
+    monte_carlo = MonteCarlo(game, 10, 4, 200, 50, num_workers=args.num_workers, recorder=recorder)
+    monte_carlo.ai_plot(game, monte_carlo.ai_move, num_workers=args.eval_workers, output=args.output, seed=args.seed)
+    if recorder is not None:
+        recorder.close()
+    profiling.finish(args)
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from GameEmulator import BitGame
+
+
+class AfterstateCache:
+    def __init__(self, max_size=100000):
+        """
+        Least recently used cache of rollout results, keyed on canonical afterstates.
+
+        Afterstates that are equal up to one of the 8 rotations/reflections of the
+        board share an entry. Every entry holds the accumulated rollout score and the
+        number of rollouts behind it, so new rollouts add to the earlier estimate.
+
+        Parameters:
+        - max_size: Maximum number of afterstates kept before the least recently used one is evicted.
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_rollouts = 0
+
+    def key(self, board, search_length):
+        """
+        Build the cache key of an afterstate.
+
+        Parameters:
+        - board: The afterstate as a 4x4 array of tile values.
+        - search_length: Length of the rollouts, estimates for different lengths are kept apart.
+
+        Returns:
+        - The cache key.
+        """
+        return BitGame.canonical(BitGame.from_array(board)), search_length
+
+    def get(self, key):
+        """
+        Look up the accumulated rollout score and rollout count of an afterstate.
+
+        Parameters:
+        - key: The cache key.
+
+        Returns:
+        - The accumulated score and the number of rollouts, (0, 0) if the afterstate is not cached.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return 0, 0
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def add(self, key, total_score, count, requested):
+        """
+        Add new rollouts to the estimate of an afterstate.
+
+        Parameters:
+        - key: The cache key.
+        - total_score: The score collected by the new rollouts.
+        - count: The number of new rollouts.
+        - requested: The number of rollouts the caller asked for, to count the ones the cache saved.
+
+        Returns:
+        - The accumulated score and the number of rollouts after the update.
+        """
+        previous_score, previous_count = self.entries.get(key, (0, 0))
+        entry = (previous_score + total_score, previous_count + count)
+        self.saved_rollouts += requested - count
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        Report how much the cache has been used.
+
+        Returns:
+        - A dictionary with hits, misses, evictions, saved rollouts and the current size.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "saved_rollouts": self.saved_rollouts,
+            "size": len(self.entries),
+        }
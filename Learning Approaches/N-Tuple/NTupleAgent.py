@@ -0,0 +1,268 @@
+import argparse
+import time
+import numpy as np
+from GameEmulator import BitGame
+from GameEmulator.BitGame import Game2048
+from GameEmulator.VecGame import VecGame2048
+from GameEmulator.recorder import unpack_boards
+from GameEmulator.evaluation import evaluate
+
+# Cells (4 * row + column) covered by each tuple: two straight and two rectangular 6-tuples
+DEFAULT_PATTERNS = (
+    (0, 1, 2, 3, 4, 5),
+    (4, 5, 6, 7, 8, 9),
+    (0, 1, 2, 4, 5, 6),
+    (4, 5, 6, 8, 9, 10),
+)
+
+# Where every cell lands under each of the 8 rotations/reflections of the board
+GRID = np.arange(16).reshape(4, 4)
+SYMMETRIES = np.array([np.rot90(grid, k).flatten() for grid in (GRID, GRID.T) for k in range(4)])
+
+
+class NTupleNetwork:
+    def __init__(self, patterns=DEFAULT_PATTERNS, learning_rate=0.1):
+        """
+        Initialize an n-tuple network estimating the expected future score of an afterstate.
+
+        Every pattern owns a lookup table with one weight per combination of tile exponents on its cells,
+        and all tables live in one flat float32 array. A pattern is read at all 8 symmetric placements
+        on the board, so the symmetric positions share their weights.
+
+        Parameters:
+        - patterns: The tuples of cells (4 * row + column) covered by each pattern.
+        - learning_rate: Step size of the TD update, shared out over the lookups of a board.
+        """
+        self.patterns = tuple(tuple(pattern) for pattern in patterns)
+        self.learning_rate = learning_rate
+        width = max(len(pattern) for pattern in self.patterns)
+
+        # Missing cells of shorter patterns read the always-empty cell 16
+        cells = np.full((len(self.patterns), len(SYMMETRIES), width), 16, dtype=np.int64)
+        offsets = np.zeros(len(self.patterns), dtype=np.int64)
+        size = 0
+        for i, pattern in enumerate(self.patterns):
+            cells[i, :, :len(pattern)] = SYMMETRIES[:, pattern]
+            offsets[i] = size
+            size += 16 ** len(pattern)
+        self.cells = cells.reshape(-1, width)
+        self.offsets = np.repeat(offsets, len(SYMMETRIES))
+        self.shifts = 4 * np.arange(width, dtype=np.int64)
+        self.weights = np.zeros(size, dtype=np.float32)
+
+    def indices(self, exponents):
+        """
+        Find the weights read for a batch of boards.
+
+        Parameters:
+        - exponents: An (N, 4, 4) array of tile exponents.
+
+        Returns:
+        - An (N, lookups) array of positions in the flat weight array.
+        """
+        flat = np.zeros((len(exponents), 17), dtype=np.int64)
+        flat[:, :16] = exponents.reshape(-1, 16)
+        return (flat[:, self.cells] << self.shifts).sum(axis=2) + self.offsets
+
+    def value(self, exponents, indices=None):
+        """
+        Evaluate a batch of boards as the sum of their weights.
+
+        Parameters:
+        - exponents: An (N, 4, 4) array of tile exponents.
+        - indices: The indices of the boards, if already computed.
+
+        Returns:
+        - The (N,) values of the boards.
+        """
+        if indices is None:
+            indices = self.indices(exponents)
+        return self.weights[indices].sum(axis=1)
+
+    def update(self, indices, errors):
+        """
+        Move the values of a batch of boards towards their TD targets.
+
+        Parameters:
+        - indices: The (N, lookups) indices of the boards.
+        - errors: The (N,) TD errors of the boards.
+        """
+        step = (self.learning_rate / indices.shape[1]) * np.asarray(errors, dtype=np.float32)
+        np.add.at(self.weights, indices.ravel(), np.repeat(step, indices.shape[1]))
+
+    def save(self, path):
+        """
+        Save the flat weight array as a .npy file.
+        """
+        np.save(path, self.weights)
+
+    def load(self, path):
+        """
+        Load weights saved by save, which must come from a network with the same patterns.
+        """
+        weights = np.load(path)
+        if weights.shape != self.weights.shape:
+            raise ValueError(f"{path} holds {weights.size} weights, the patterns need {self.weights.size}")
+        self.weights = weights.astype(np.float32)
+
+
+def train(network, games, num_envs=64, seed=None, report_interval=10000, output=None):
+    """
+    Train the network with TD(0) on afterstates, playing a batch of games greedily in lockstep.
+
+    After every move the value of the previous afterstate of a game moves towards the reward
+    of the move plus the value of the new afterstate. The last afterstate of a game moves towards 0.
+
+    Parameters:
+    - network: The NTupleNetwork to train.
+    - games: Number of games to play.
+    - num_envs: Number of games played at once.
+    - seed: Seed of the games.
+    - report_interval: Games between progress reports and saves of the weights.
+    - output: Path the weights are saved to, if set.
+    """
+    env = VecGame2048(num_envs, seed=seed)
+    rows = np.arange(num_envs)
+    has_previous = np.zeros(num_envs, dtype=bool)
+    previous_indices = np.zeros((num_envs, len(network.offsets)), dtype=np.int64)
+    finished = 0
+    next_report = report_interval
+    recent_scores = []
+    start = time.time()
+
+    while finished < games:
+        # Pick the move with the best reward plus afterstate value
+        after, gains, legal = env.afterstates()
+        indices = network.indices(after.reshape(-1, 4, 4))
+        values = network.value(None, indices).reshape(num_envs, 4)
+        actions = np.where(legal, gains + values, -np.inf).argmax(axis=1)
+        indices = indices.reshape(num_envs, 4, -1)[rows, actions]
+        rewards = gains[rows, actions]
+        chosen_values = values[rows, actions]
+
+        # TD(0) update of the previous afterstates
+        if has_previous.any():
+            errors = rewards + chosen_values - network.value(None, previous_indices)
+            network.update(previous_indices[has_previous], errors[has_previous])
+
+        _, _, dones, _ = env.step(actions)
+
+        # The last afterstate of a finished game is worth nothing
+        if dones.any():
+            network.update(indices[dones], -chosen_values[dones])
+            recent_scores.extend(env.final_scores[dones].tolist())
+            finished += int(dones.sum())
+        has_previous = ~dones
+        previous_indices = indices
+
+        if finished >= next_report:
+            elapsed = time.time() - start
+            print(f"games {finished}, mean score {np.mean(recent_scores):.0f}, "
+                  f"max score {np.max(recent_scores)}, {finished / elapsed:.1f} games/sec")
+            recent_scores = []
+            next_report += report_interval
+            if output is not None:
+                network.save(output)
+
+    if output is not None:
+        network.save(output)
+
+
+class NTupleAgent:
+    def __init__(self, game, network, sample_count=50):
+        """
+        Initialize an agent playing greedily with respect to an n-tuple network.
+
+        Parameters:
+        - game: The instance of the BitGame 2048 game.
+        - network: The trained NTupleNetwork.
+        - sample_count: Number of samples to run for AI plotting.
+        """
+        self.game = game
+        self.network = network
+        self.SAMPLE_COUNT = sample_count
+
+    def ai_move(self, game):
+        """
+        Perform an AI move for the 2048 game.
+
+        Parameters:
+        - game: The instance of the BitGame 2048 game.
+
+        Returns:
+        - The updated game board and flag indicating game continuation.
+        """
+        boards, gains, legal = BitGame.afterstates(game.state)
+        if not legal:
+            game.game_over = True
+            return game.board, False
+
+        values = self.network.value(unpack_boards(boards))
+        moved = [legal >> direction & 1 for direction in range(4)]
+        game.take_turn(int(np.where(moved, np.array(gains) + values, -np.inf).argmax()))
+        return game.board, game.check_valid()
+
+    def ai_play(self):
+        """
+        Play the 2048 game using the AI agent.
+
+        Returns:
+        - The maximum tile value achieved during the game.
+        """
+        valid_game = True
+
+        while valid_game:
+            board, valid_game = self.ai_move(self.game)
+
+        print("Game over! No more valid moves.")
+        return np.amax(self.game.board)
+
+    def play_sample(self):
+        """
+        Reset the game and play it to the end.
+
+        Returns:
+        - The maximum tile value achieved and the final score.
+        """
+        self.game.reset()
+        max_tile = self.ai_play()
+        return max_tile, self.game.score
+
+    def ai_plot(self, num_workers=1, output=None, seed=None):
+        """
+        Plot the frequency of achieving different scores over multiple AI plays.
+
+        Parameters:
+        - num_workers: Number of worker processes playing games in parallel.
+        - output: Optional .json or .csv path to write the results to instead of showing the plot.
+        - seed: Seed from which every game's own seed is derived.
+
+        Returns:
+        - The TileHistogram of the played games.
+        """
+        return evaluate(self, self.SAMPLE_COUNT, num_workers=num_workers, seed=seed, output=output)
+
+
+# Training code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train an n-tuple network with TD(0) on afterstates")
+    parser.add_argument("--games", type=int, default=100000, help="number of training games")
+    parser.add_argument("--num-envs", type=int, default=64, help="games played at once")
+    parser.add_argument("--learning-rate", type=float, default=0.1, help="step size of the TD update")
+    parser.add_argument("--weights", help=".npy weights to continue training from")
+    parser.add_argument("--output", default="ntuple_weights.npy", help=".npy file the weights are saved to")
+    parser.add_argument("--report-interval", type=int, default=10000, help="games between reports and saves")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the training games")
+    parser.add_argument("--plot", action="store_true", help="plot the tiles reached by the trained agent")
+    parser.add_argument("--eval-workers", type=int, default=1, help="worker processes playing the --plot games")
+    parser.add_argument("--eval-output", help=".json or .csv file the --plot results are written to instead")
+    args = parser.parse_args()
+
+    network = NTupleNetwork(learning_rate=args.learning_rate)
+    if args.weights:
+        network.load(args.weights)
+    train(network, args.games, args.num_envs, args.seed, args.report_interval, args.output)
+
+    if args.plot:
+        NTupleAgent(Game2048(), network).ai_plot(num_workers=args.eval_workers, output=args.eval_output,
+                                                 seed=args.seed)
@@ -1,40 +1,364 @@
-import random
+import os
+import threading
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from collections import deque
-from utils import transition, get_processor
+from utils import get_processor, OneHotEncoder, legal_mask
+from GameEmulator.VecGame import legal_moves
+from GameEmulator.profiling import timed
 
 device = get_processor()  # Initialize device to store data
-Transition = transition()  # Define a transition object, used for storing experiences in ReplayBuffer
+
+def mapped_array(path, name, shape, dtype):
+    """
+    Return a zeroed array, or when path is set an array memory-mapped from the .npy file name in path.
+    An existing file is opened in place without reading it, so a buffer saved by an earlier run loads in O(1).
+    """
+    if path is None:
+        return np.zeros(shape, dtype=dtype)
+    file = os.path.join(path, name + '.npy')
+    if not os.path.exists(file):
+        os.makedirs(path, exist_ok=True)
+        return np.lib.format.open_memmap(file, mode='w+', dtype=dtype, shape=shape)
+    array = np.load(file, mmap_mode='r+')
+    if array.shape != tuple(shape) or array.dtype != np.dtype(dtype):
+        raise ValueError(f"{file} holds a {array.dtype} array of shape {array.shape}, expected {np.dtype(dtype)} {tuple(shape)}")
+    return array
+
+def next_move_mask(next_state, next_legal=None):
+    """
+    Return the legal-move bitmask stored with an experience: next_legal if given, 0 when the game ended
+    and otherwise the moves that change next_state.
+    """
+    if next_state is None:
+        return 0
+    if next_legal is None:
+        return int(legal_moves(np.asarray(next_state, dtype=np.uint8).reshape(1, 4, 4))[0])
+    return int(next_legal)
 
 class ReplayBuffer(object):
-    def __init__(self, max_size):
+    def __init__(self, max_size, path=None):
         """
         Initialize the replay buffer with a given maximum size.
-        The buffer stores past experiences (states, actions, rewards, next_states, and dones) in a deque.
+        The buffer is a ring of preallocated arrays: states and next_states are stored as uint8
+        tile exponents, along with int8 actions, float32 rewards, a done flag and the uint8 legal-move
+        bitmask of next_state per experience.
+        When path is set the arrays, write position and size are memory-mapped files in that directory,
+        so the buffer survives restarts and reopening it picks up the stored experiences.
+        """
+        self.max_size = max_size
+        self.path = path
+        # Buffers saved before legal moves were stored get them from their next states
+        missing_legal = path is not None and not os.path.exists(os.path.join(path, 'next_legal.npy'))
+        self.states = mapped_array(path, 'states', (max_size, 4, 4), np.uint8)
+        self.next_states = mapped_array(path, 'next_states', (max_size, 4, 4), np.uint8)
+        self.actions = mapped_array(path, 'actions', (max_size,), np.int8)
+        self.rewards = mapped_array(path, 'rewards', (max_size,), np.float32)
+        self.dones = mapped_array(path, 'dones', (max_size,), np.bool_)
+        self.next_legal = mapped_array(path, 'next_legal', (max_size,), np.uint8)
+        self.counters = mapped_array(path, 'counters', (2,), np.int64)  # Write position and number of stored experiences
+        if missing_legal and self.size > 0:
+            stored = slice(0, self.size)
+            self.next_legal[stored] = np.where(self.dones[stored], 0, legal_moves(self.next_states[stored]))
+        # Sampled batches are encoded into reusable output tensors
+        self.state_encoder = OneHotEncoder()
+        self.next_state_encoder = OneHotEncoder()
+        self.augmenter = None  # Optional DihedralAugmenter applied to every sampled batch
+        # Serializes push, sample and update_priorities, which the background learner calls from its own thread
+        self.lock = threading.Lock()
+
+    @property
+    def position(self):
+        # Slot the next experience is written to
+        return int(self.counters[0])
+
+    @position.setter
+    def position(self, value):
+        self.counters[0] = value
+
+    @property
+    def size(self):
+        return int(self.counters[1])
+
+    @size.setter
+    def size(self, value):
+        self.counters[1] = value
+
+    def push(self, state, action, next_state, reward, next_legal=None):
         """
-        self.memory = deque([], maxlen=max_size)
+        Add a new experience to the replay buffer, overwriting the oldest one when it is full.
+        States are 4x4 arrays of tile exponents, next_state is None when the game ended.
+        next_legal is the legal-move bitmask of next_state, found from next_state if not given.
+        """
+        next_legal = next_move_mask(next_state, next_legal)
+        with self.lock:
+            self.store(state, action, next_state, reward, next_legal)
 
-    def push(self, *args):
+    def store(self, state, action, next_state, reward, next_legal):
         """
-        Add a new experience to the replay buffer.
+        Write an experience to the next slot, called by push with the lock held.
         """
-        self.memory.append(Transition(*args))
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = int(action)
+        self.rewards[i] = float(reward)
+        self.dones[i] = next_state is None
+        self.next_legal[i] = next_legal
+        # Finished games store an empty board, so their slot holds no stale board
+        self.next_states[i] = 0 if next_state is None else next_state
+        self.position = (i + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
 
+    @timed("ReplayBuffer.sample")
     def sample(self, batch_size):
         """
         Randomly sample a batch of experiences from the replay buffer.
+        Returns one-hot encoded states and next_states, actions, rewards, done flags and the (N, 4) bool
+        legal-move masks of next_states as tensors. Finished games store an empty board as next_state,
+        so it is encoded as an empty board and has no legal moves. The importance-sampling weights
+        (all ones here) and the sampled slots are returned as well, for prioritized replay.
+        """
+        with self.lock:
+            idx = np.random.randint(0, self.size, size=batch_size)
+            return self.batch(idx) + (torch.ones(batch_size, device=device), idx)
+
+    def batch(self, idx):
+        """
+        Gather and encode the experiences stored at the given slots,
+        transformed by the augmenter if one is set.
+        """
+        states, actions, next_states = self.states[idx], self.actions[idx], self.next_states[idx]
+        next_legal = self.next_legal[idx]
+        if self.augmenter is not None:
+            states, next_states, actions, next_legal = self.augmenter(states, next_states, actions, next_legal)
+        return (self.state_encoder(states),
+                torch.from_numpy(actions.astype(np.int64)).view(-1, 1).to(device),
+                self.next_state_encoder(next_states),
+                torch.from_numpy(self.rewards[idx]).to(device),
+                torch.from_numpy(self.dones[idx]).to(device),
+                legal_mask(next_legal, device))
+
+    def update_priorities(self, idx, td_errors):
+        """
+        Uniform replay keeps no priorities, see PrioritizedReplayBuffer.
+        """
+        pass
+
+    def flush(self):
         """
-        return random.sample(self.memory, batch_size)
+        Write the memory-mapped arrays back to their files, a no-op for a buffer kept in memory.
+        """
+        for array in (self.states, self.next_states, self.actions, self.rewards, self.dones, self.next_legal,
+                      self.counters):
+            if isinstance(array, np.memmap):
+                array.flush()
 
     def __len__(self):
         """
         Return the number of experiences currently in the replay buffer.
         """
-        return len(self.memory)
+        return self.size
     
 
+class SharedReplayBuffer(ReplayBuffer):
+    # Arrays of the buffer, each kept in its own shared memory block
+    FIELDS = (('states', (4, 4), np.uint8), ('next_states', (4, 4), np.uint8), ('actions', (), np.int8),
+              ('rewards', (), np.float32), ('dones', (), np.bool_), ('next_legal', (), np.uint8))
+
+    def __init__(self, max_size):
+        """
+        Initialize a replay buffer whose arrays live in multiprocessing.shared_memory,
+        so actor processes can push experiences that the learner process samples.
+        The write position and size are shared counters, pushes are serialized by their lock.
+        """
+        self.max_size = max_size
+        self.blocks = {}
+        for name, shape, dtype in self.FIELDS:
+            nbytes = max(1, max_size * int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            self.blocks[name] = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.counters = multiprocessing.Array('q', 2)  # Write position and number of stored experiences
+        self.attach()
+        for name, _, _ in self.FIELDS:
+            getattr(self, name)[:] = 0
+
+    def attach(self):
+        """
+        Create the array views on the shared memory blocks and the batch encoders.
+        """
+        for name, shape, dtype in self.FIELDS:
+            view = np.ndarray((self.max_size,) + shape, dtype=dtype, buffer=self.blocks[name].buf)
+            setattr(self, name, view)
+        self.state_encoder = OneHotEncoder()
+        self.next_state_encoder = OneHotEncoder()
+        self.augmenter = None
+        # Samples wait for pushes in progress in the actor processes
+        self.lock = self.counters.get_lock()
+
+    def __getstate__(self):
+        # Processes receive the names of the shared blocks, not copies of the arrays
+        return {'max_size': self.max_size, 'counters': self.counters,
+                'names': {name: block.name for name, block in self.blocks.items()}}
+
+    def __setstate__(self, state):
+        self.max_size = state['max_size']
+        self.counters = state['counters']
+        self.blocks = {name: shared_memory.SharedMemory(name=block) for name, block in state['names'].items()}
+        self.attach()
+
+    @property
+    def size(self):
+        return self.counters[1]
+
+    def push(self, state, action, next_state, reward, next_legal=None):
+        """
+        Add a new experience to the shared replay buffer, overwriting the oldest one when it is full.
+        """
+        next_legal = next_move_mask(next_state, next_legal)
+        with self.lock:
+            i = self.counters[0]
+            self.states[i] = state
+            self.actions[i] = int(action)
+            self.rewards[i] = float(reward)
+            self.dones[i] = next_state is None
+            self.next_legal[i] = next_legal
+            self.next_states[i] = 0 if next_state is None else next_state
+            self.counters[0] = (i + 1) % self.max_size
+            self.counters[1] = min(self.counters[1] + 1, self.max_size)
+
+    def close(self, unlink=False):
+        """
+        Detach from the shared memory blocks, and free them when unlink is set (by the creating process).
+        """
+        for name, _, _ in self.FIELDS:
+            setattr(self, name, None)
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+
+class SumTree(object):
+    def __init__(self, capacity, path=None):
+        """
+        Initialize a sum tree over capacity leaves.
+        The tree is a flat array laid out as a binary heap: node i has children 2i and 2i + 1,
+        the leaves start at index `leaves` and every inner node holds the sum of its children.
+        When path is set the array is memory-mapped like the replay buffer arrays.
+        """
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = mapped_array(path, 'priorities', (2 * self.leaves,), np.float64)
+
+    def total(self):
+        """
+        Return the sum of all priorities.
+        """
+        return self.tree[1]
+
+    def get(self, idx):
+        """
+        Return the priorities stored at the given leaves.
+        """
+        return self.tree[idx + self.leaves]
+
+    def update(self, idx, priorities):
+        """
+        Set the priorities of a batch of leaves and recompute their ancestors, one tree level at a time.
+        """
+        nodes = np.asarray(idx) + self.leaves
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """
+        Find, for a batch of values in [0, total), the leaves whose cumulative priority range holds them.
+        All values walk down the tree together, one level at a time.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = values >= left_sums
+            values -= np.where(go_right, left_sums, 0.0)
+            nodes = left + go_right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    def __init__(self, max_size, alpha=0.6, beta=0.4, beta_increment=1e-4, epsilon=1e-3, path=None):
+        """
+        Initialize a replay buffer that samples experiences in proportion to their TD error.
+        alpha sets how strongly priorities skew sampling, beta the strength of the importance-sampling
+        correction, which is annealed towards 1 by beta_increment on every sample.
+        With path set the priorities are memory-mapped along with the experiences.
+        """
+        super(PrioritizedReplayBuffer, self).__init__(max_size, path)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.tree = SumTree(max_size, path)
+        self.max_priority = 1.0
+        if self.size > 0:
+            # Reopened buffer, continue from the highest stored priority
+            self.max_priority = max(1.0, float(self.tree.get(np.arange(self.size)).max()) ** (1 / alpha))
+
+    def store(self, state, action, next_state, reward, next_legal):
+        """
+        Write an experience with the highest priority seen so far, so it is sampled at least once.
+        """
+        position = self.position
+        super(PrioritizedReplayBuffer, self).store(state, action, next_state, reward, next_legal)
+        self.tree.update(np.array([position]), self.max_priority ** self.alpha)
+
+    @timed("ReplayBuffer.sample")
+    def sample(self, batch_size):
+        """
+        Sample a batch of experiences with probability proportional to their priority.
+        The total priority is split into batch_size equal segments and one value is drawn in each.
+        Returns the same tensors as ReplayBuffer.sample with the importance-sampling weights and slots.
+        """
+        with self.lock:
+            total = self.tree.total()
+            segment = total / batch_size
+            values = (np.arange(batch_size) + np.random.random(batch_size)) * segment
+            # Rounding can push a value past the last filled slot
+            idx = np.minimum(self.tree.find(np.minimum(values, total * (1 - 1e-12))), self.size - 1)
+
+            self.beta = min(1.0, self.beta + self.beta_increment)
+            probabilities = self.tree.get(idx) / total
+            weights = (self.size * probabilities) ** (-self.beta)
+            weights /= weights.max()
+            return self.batch(idx) + (torch.from_numpy(weights.astype(np.float32)).to(device), idx)
+
+    def update_priorities(self, idx, td_errors):
+        """
+        Refresh the priorities of sampled experiences from their absolute TD errors.
+        """
+        priorities = np.abs(td_errors) + self.epsilon
+        with self.lock:
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+            # With repeated slots in a batch the last TD error wins
+            self.tree.update(idx, priorities ** self.alpha)
+
+    def flush(self):
+        """
+        Write the memory-mapped experiences and priorities back to their files.
+        """
+        super(PrioritizedReplayBuffer, self).flush()
+        if isinstance(self.tree.tree, np.memmap):
+            self.tree.tree.flush()
+
+
 class ConvBlock(nn.Module):
     def __init__(self, input_dim, output_dim):
         """
@@ -54,7 +378,6 @@ class ConvBlock(nn.Module):
         Perform the forward pass through the convolutional block, applying the four convolutions to the input.
         """
 
-        x = x.to(device)
         output1 = self.conv1(x)
         output2 = self.conv2(x)
         output3 = self.conv3(x)
@@ -85,5 +408,5 @@ class DQN(nn.Module):
         x = F.relu(self.conv2(x))
         x = F.relu(self.conv3(x))
         x = nn.Flatten()(x)
-        x = F.dropout(self.dense1(x))
+        x = F.dropout(self.dense1(x), training=self.training)
         return self.dense6(x)
\ No newline at end of file
@@ -0,0 +1,149 @@
+import argparse
+import random
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import backprop
+from backprop import policy_net, target_net
+from init_param import *
+from Model import DQN, SharedReplayBuffer
+from utils import DihedralAugmenter, OneHotEncoder, legal_mask, packed_exponents, same_move, transition
+from GameEmulator import BitGame
+from GameEmulator.BitGame import Game2048
+
+Transition = transition()
+
+def run_actor(actor_id, memory, shared_net, weights_version, actor_steps, stop, weight_sync_interval, seed):
+    # Plays games with a local copy of the policy and pushes every transition into the shared buffer
+    torch.set_num_threads(1)
+    random.seed(seed)
+    torch.manual_seed(seed)
+
+    policy = DQN()
+    with weights_version.get_lock():
+        policy.load_state_dict(shared_net.state_dict())
+        version = weights_version.value
+    policy.eval()
+
+    game = Game2048(seed=seed)
+    cpu = torch.device("cpu")
+    encode = OneHotEncoder(1, cpu)
+    steps = 0
+
+    while not stop.is_set():
+        game.reset()
+        state = packed_exponents([game.state])[0]
+        legal = BitGame.afterstates(game.state)[2]
+        last_memory = None
+
+        while not stop.is_set():
+            # Epsilon-greedy action selection with the schedule of backprop.select_action,
+            # only among the moves that change the board
+            eps_threshold = max(EPS_END, EPS_START * (EPS_DECAY ** steps))
+            if random.random() > eps_threshold:
+                with torch.no_grad():
+                    q_values = backprop.masked_q_values(policy(encode(state[None])), legal_mask(legal, cpu))
+                    action = q_values.max(1)[1].item()
+            else:
+                action = random.choice([a for a in range(n_actions) if legal >> a & 1])
+
+            old_score = game.score
+            moved = game.take_turn(action)
+            legal = BitGame.afterstates(game.state)[2]
+            game_over = not legal
+
+            # Calculate reward, penalizing moves that do not change the board
+            reward = game.score - old_score
+            next_state = None if game_over else packed_exponents([game.state])[0]
+            if next_state is not None and not moved:
+                reward -= 10
+
+            # Store the transition in the shared memory if not duplicate
+            if next_state is None or last_memory is None or not same_move(state, next_state, last_memory):
+                last_memory = Transition(state, action, next_state, reward, legal)
+                memory.push(*last_memory)
+
+            steps += 1
+            actor_steps[actor_id] = steps
+
+            # Refresh the local policy when the learner has published newer weights
+            if steps % weight_sync_interval == 0 and weights_version.value != version:
+                with weights_version.get_lock():
+                    policy.load_state_dict(shared_net.state_dict())
+                    version = weights_version.value
+
+            if game_over:
+                break
+            state = next_state
+
+    memory.close()
+
+def publish(shared_net, weights_version):
+    # Copies the learner's policy weights into the shared network the actors read from
+    with weights_version.get_lock():
+        shared_net.load_state_dict(policy_net.state_dict())
+        weights_version.value += 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the DQN with actor processes feeding a shared replay buffer")
+    parser.add_argument("--actors", type=int, default=NUM_ACTORS, help="number of actor processes")
+    parser.add_argument("--weight-sync-interval", type=int, default=WEIGHT_SYNC_INTERVAL,
+                        help="actor steps between checks for newer policy weights")
+    parser.add_argument("--publish-interval", type=int, default=PUBLISH_INTERVAL,
+                        help="learner gradient steps between publishing policy weights")
+    parser.add_argument("--buffer-size", type=int, default=REPLAY_SIZE, help="shared replay buffer capacity")
+    parser.add_argument("--learner-steps", type=int, default=10000, help="gradient steps before stopping")
+    parser.add_argument("--report-interval", type=float, default=30.0, help="seconds between throughput reports")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first actor, the others follow")
+    args = parser.parse_args()
+
+    # The learner trains through backprop() on the shared buffer instead of its own
+    memory = SharedReplayBuffer(args.buffer_size)
+    if AUGMENT_SYMMETRIES:
+        memory.augmenter = DihedralAugmenter()
+    backprop.memory = memory
+
+    shared_net = DQN()
+    shared_net.load_state_dict(policy_net.state_dict())
+    shared_net.share_memory()
+    weights_version = mp.Value('q', 0)
+    actor_steps = mp.Array('q', args.actors)
+    stop = mp.Event()
+
+    actors = [mp.Process(target=run_actor, args=(i, memory, shared_net, weights_version, actor_steps, stop,
+                                                 args.weight_sync_interval, args.seed + i))
+              for i in range(args.actors)]
+    for actor in actors:
+        actor.start()
+
+    learner_steps = 0
+    last_report = time.time()
+    last_steps = np.zeros(args.actors)
+    try:
+        while learner_steps < args.learner_steps:
+            if len(memory) < BATCH_SIZE:
+                time.sleep(0.1)
+                continue
+
+            backprop.backprop()
+            learner_steps += 1
+
+            # Update the target network and publish the weights periodically
+            if learner_steps % TARGET_UPDATE == 0:
+                target_net.load_state_dict(policy_net.state_dict())
+            if learner_steps % args.publish_interval == 0:
+                publish(shared_net, weights_version)
+
+            now = time.time()
+            if now - last_report >= args.report_interval:
+                steps = np.array(actor_steps[:])
+                rates = (steps - last_steps) / (now - last_report)
+                print(f"learner step {learner_steps}, buffer {len(memory)}, actor steps/sec "
+                      + ", ".join(f"{rate:.1f}" for rate in rates) + f" (total {rates.sum():.1f})")
+                last_steps, last_report = steps, now
+    finally:
+        stop.set()
+        for actor in actors:
+            actor.join()
+        memory.close(unlink=True)
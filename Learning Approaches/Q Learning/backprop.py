@@ -2,14 +2,15 @@ import random
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from Model import DQN, ReplayBuffer
-from utils import get_processor, transition
+from Model import DQN, ReplayBuffer, PrioritizedReplayBuffer
+from utils import DihedralAugmenter, get_processor, transition
 from init_param import *
+from GameEmulator.profiling import span, timed
 
 # Initialize the Transition class
-Transition = transition
+Transition = transition()
 # Initialize the device to be used for processing
-device = get_processor
+device = get_processor()
 
 # Initialize the policy network and target network
 policy_net = DQN().to(device)
@@ -20,14 +21,30 @@ policy_net.train()  # Set the policy network in training mode
 # Initialize the optimizer
 optimizer = optim.Adam(policy_net.parameters(), lr=5e-5)
 
-# Initialize the replay buffer
-memory = ReplayBuffer(50000)
+# The replay buffer backprop() samples from. It is set by the script that trains, with init_memory() or
+# a buffer of its own, so importing this module (as every actor process does) allocates no buffer
+memory = None
+
+def init_memory():
+    # This function builds the replay buffer chosen in init_param.py, with symmetry augmentation if enabled,
+    # and makes it the one backprop() samples from
+    global memory
+    if PRIORITIZED_REPLAY:
+        memory = PrioritizedReplayBuffer(50000, alpha=PER_ALPHA, beta=PER_BETA, beta_increment=PER_BETA_INCREMENT,
+                                         path=REPLAY_PATH)
+    else:
+        memory = ReplayBuffer(50000, path=REPLAY_PATH)
+    if AUGMENT_SYMMETRIES:
+        memory.augmenter = DihedralAugmenter()
+    return memory
 
 # Initialize the number of steps done
 steps_done = 0
 
-def select_action(state):
-    # This function selects an action based on the current state
+@timed("select_action")
+def select_action(state, legal=None):
+    # This function selects an action based on the current state,
+    # only among the actions set in the (1, 4) bool legal-move mask if one is given
     global steps_done
     
     sample = random.random()
@@ -38,12 +55,48 @@ def select_action(state):
     if sample > eps_threshold:
         # If the sampled value is greater than the epsilon threshold, select the action with the highest Q-value
         with torch.no_grad():
-            return policy_net(state).max(1)[1].view(1, 1)
+            return masked_q_values(policy_net(state), legal).max(1)[1].view(1, 1)
         
-    else:
+    elif legal is None:
         # If the sampled value is less than the epsilon threshold, select a random action
         return torch.tensor([[random.randrange(n_actions)]], device=device, dtype=torch.long)
 
+    else:
+        # Select a random action among the ones that change the board
+        action = random.choice([a for a in range(n_actions) if legal[0, a]])
+        return torch.tensor([[action]], device=device, dtype=torch.long)
+
+@timed("select_actions")
+def select_actions(states, net=None, legal=None):
+    # This function selects one action per state for a batch of states with a single forward pass,
+    # using the given network (such as a published policy snapshot) instead of the policy network if set.
+    # With an (N, 4) bool legal-move mask, greedy and random actions are both picked among the legal ones.
+    global steps_done
+
+    n = states.shape[0]
+    # Calculate the epsilon value, every state in the batch counts as a step
+    eps_threshold = max(EPS_END, EPS_START * (EPS_DECAY ** steps_done))
+    steps_done += n
+
+    with torch.no_grad():
+        actions = masked_q_values((net if net is not None else policy_net)(states), legal).max(1)[1]
+
+    # Replace the greedy action by a random one for the states that explore
+    explore = torch.rand(n, device=device) < eps_threshold
+    if legal is None:
+        actions[explore] = torch.randint(n_actions, (int(explore.sum()),), device=device)
+    elif explore.any():
+        actions[explore] = torch.multinomial(legal[explore].float(), 1).view(-1)
+    return actions.view(n, 1)
+
+def masked_q_values(q_values, legal):
+    # This function sets the Q-values of the actions outside the bool legal-move mask to -inf,
+    # so max() only picks actions that change the board. No mask leaves the Q-values as they are.
+    if legal is None:
+        return q_values
+    return q_values.masked_fill(~legal, float("-inf"))
+
+@timed("backprop")
 def backprop():
     # This function optimizes the policy network by minimizing the loss
 
@@ -51,43 +104,48 @@ def backprop():
         # If the number of transitions in the replay buffer is less than the batch size, return without doing anything
         return
 
-    # Sample transitions from the replay buffer
-    transitions = memory.sample(BATCH_SIZE)
-    batch = Transition(*zip(*transitions))
+    # Sample a batch of transitions from the replay buffer, already encoded as tensors, and learn from it
+    learn(*memory.sample(BATCH_SIZE))
 
-    # Create a mask for the non-final next states
-    non_final_mask = torch.tensor(tuple(map(lambda s: s is not None, 
-                                            batch.next_state)), 
-                                            device=device, dtype=torch.bool)
-    
-    # Extract the non-final next states
-    non_final_next_states = torch.cat([s for s in batch.next_state 
-                                       if s is not None])
+def learn(state_batch, action_batch, next_state_batch, reward_batch, done_batch, next_legal_batch, weights,
+          indices=None):
+    # This function takes one optimizer step on a batch of encoded transitions, as returned by memory.sample.
+    # The priorities of the sampled slots are refreshed if indices are given. Returns the loss as a tensor.
+
+    # Create a mask for the non-final next states and extract them with their legal moves
+    non_final_mask = ~done_batch
+    non_final_next_states = next_state_batch[non_final_mask]
+    non_final_next_legal = next_legal_batch[non_final_mask]
+
+    with span("backprop.forward"):
+        # Calculate the state-action values for the current state
+        state_action_values = policy_net(state_batch).gather(1, action_batch)
 
-    # Extract the state, action, and reward from the batch
-    state_batch = torch.cat(batch.state)
-    action_batch = torch.cat(batch.action)
-    reward_batch = torch.cat(batch.reward)
+        # Calculate the expected state-action values for the next state, over the moves that change its board
+        next_state_values = torch.zeros(state_batch.shape[0], device=device)
+        next_q_values = masked_q_values(target_net(non_final_next_states), non_final_next_legal)
+        next_state_values[non_final_mask] = next_q_values.max(1)[0].detach()
 
-    # Calculate the state-action values for the current state
-    state_action_values = policy_net(state_batch).gather(1, action_batch)
+        # Calculate the actual expected state-action values
+        expected_state_action_values = (next_state_values * GAMMA) + reward_batch
 
-    # Calculate the expected state-action values for the next state
-    next_state_values = torch.zeros(BATCH_SIZE, device=device)
-    next_state_values[non_final_mask] = target_net(non_final_next_states).max(1)[0].detach()
+        # Calculate the loss, weighting each sample by its importance-sampling weight
+        criterion = nn.MSELoss(reduction='none')
+        td_errors = state_action_values.squeeze(1) - expected_state_action_values
+        loss = (weights * criterion(state_action_values.squeeze(1), expected_state_action_values)).mean()
 
-    # Calculate the actual expected state-action values
-    expected_state_action_values = (next_state_values * GAMMA) + reward_batch
+    # Refresh the priorities of the sampled transitions from their TD errors
+    if indices is not None:
+        memory.update_priorities(indices, td_errors.detach().cpu().numpy())
 
-    # Calculate the loss
-    criterion = nn.MSELoss()
-    loss = criterion(state_action_values, expected_state_action_values.unsqueeze(1))
+    with span("backprop.optimize"):
+        # Zero the gradients
+        optimizer.zero_grad()
 
-    # Zero the gradients
-    optimizer.zero_grad()
+        # Backpropagate the gradients
+        loss.backward()
 
-    # Backpropagate the gradients
-    loss.backward()
+        # Update the weights
+        optimizer.step()
 
-    # Update the weights
-    optimizer.step()
\ No newline at end of file
+    return loss.detach()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+import queue
+import random
+import threading
+import numpy as np
+import torch
+import backprop
+
+def cpu_copy(obj):
+    # Copies every tensor of a (nested) state dict to the CPU, so training can keep updating the originals
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: cpu_copy(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(value) for value in obj)
+    return obj
+
+class CheckpointWriter(threading.Thread):
+    def __init__(self, path, memory=None):
+        """
+        Write training checkpoints to path on a background thread, so training does not wait on the disk.
+        Each checkpoint is written to a temporary file and renamed over path, so an interrupted write
+        leaves the previous checkpoint intact. A memory-mapped replay buffer given as memory is flushed too.
+        """
+        super(CheckpointWriter, self).__init__(daemon=True)
+        self.path = path
+        self.memory = memory
+        self.pending = queue.Queue(maxsize=1)
+        self.saved = 0
+        self.start()
+
+    def save(self, state):
+        """
+        Queue a copy of state for writing. A queued checkpoint that has not been written yet is replaced.
+        """
+        state = cpu_copy(state)
+        try:
+            self.pending.get_nowait()
+        except queue.Empty:
+            pass
+        self.pending.put(state)
+
+    def run(self):
+        while True:
+            state = self.pending.get()
+            if state is None:
+                break
+            temp_path = self.path + ".tmp"
+            torch.save(state, temp_path)
+            os.replace(temp_path, self.path)
+            if self.memory is not None:
+                self.memory.flush()
+            self.saved += 1
+
+    def close(self):
+        """
+        Write the queued checkpoint, if any, and stop the thread.
+        """
+        self.pending.put(None)
+        self.join()
+
+def training_state(epoch, games, learner=None):
+    """
+    Collect everything needed to continue training: the networks, the optimizer, the epsilon schedule,
+    the importance-sampling strength of prioritized replay, the games in progress and the random generators.
+    With a BackgroundLearner, the caller must hold learner.lock so the weights are not read mid-step,
+    and the learner's step counters are saved too.
+    """
+    return {
+        "epoch": epoch,
+        "policy_net": backprop.policy_net.state_dict(),
+        "target_net": backprop.target_net.state_dict(),
+        "optimizer": backprop.optimizer.state_dict(),
+        "steps_done": backprop.steps_done,
+        "beta": getattr(backprop.memory, "beta", None),
+        "games": games.state_dict(),
+        "learner": None if learner is None else learner.state_dict(),
+        "random": random.getstate(),
+        "numpy_random": np.random.get_state(),
+        "torch_random": torch.get_rng_state(),
+    }
+
+def restore_training_state(path, games, learner=None):
+    """
+    Load a checkpoint written by CheckpointWriter into the networks, optimizer, games and
+    the BackgroundLearner, if given, which must not be started yet.
+    Returns the number of episodes played before the checkpoint.
+    """
+    state = torch.load(path, map_location=backprop.device, weights_only=False)
+    backprop.policy_net.load_state_dict(state["policy_net"])
+    backprop.target_net.load_state_dict(state["target_net"])
+    backprop.optimizer.load_state_dict(state["optimizer"])
+    backprop.steps_done = state["steps_done"]
+    if state["beta"] is not None and hasattr(backprop.memory, "beta"):
+        backprop.memory.beta = state["beta"]
+    games.load_state_dict(state["games"])
+    if learner is not None and state.get("learner") is not None:
+        learner.load_state_dict(state["learner"])
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy_random"])
+    torch.set_rng_state(state["torch_random"])
+    return state["epoch"]
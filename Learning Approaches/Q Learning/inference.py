@@ -0,0 +1,128 @@
+import argparse
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import numpy as np
+from Model import DQN
+from utils import OneHotEncoder
+from GameEmulator.VecGame import VecGame2048
+
+class InferenceDQN(nn.Module):
+    def __init__(self, model, channels_last=True):
+        """
+        Wrap a trained DQN for CPU inference.
+        Runs the same layers as DQN.forward without dropout and without moving the input
+        to another device, optionally with the convolutions in channels-last memory layout.
+        """
+        super(InferenceDQN, self).__init__()
+        self.model = model
+        self.channels_last = channels_last
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        x = F.relu(self.model.conv1(x))
+        x = F.relu(self.model.conv2(x))
+        x = F.relu(self.model.conv3(x))
+        x = torch.flatten(x.contiguous(), 1)
+        x = self.model.dense1(x)
+        return self.model.dense6(x)
+
+def freeze_policy(model, quantize=True, channels_last=True):
+    """
+    Turn a trained DQN into a frozen TorchScript module for CPU inference.
+    The dense layers are dynamically quantized to int8 when quantize is set.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    wrapper = InferenceDQN(model, channels_last).eval()
+    with torch.no_grad():
+        scripted = torch.jit.trace(wrapper, torch.zeros(1, 16, 4, 4))
+    return torch.jit.freeze(scripted)
+
+def export_policy(model, path, quantize=True, channels_last=True):
+    """
+    Freeze a trained DQN and save the artifact to path.
+    """
+    policy = freeze_policy(model, quantize, channels_last)
+    policy.save(path)
+    return policy
+
+def load_policy(path):
+    """
+    Load a frozen policy artifact saved by export_policy.
+    """
+    return torch.jit.load(path, map_location="cpu").eval()
+
+class PolicyServer(object):
+    def __init__(self, path):
+        """
+        Serve greedy actions from a frozen policy artifact.
+        """
+        self.policy = load_policy(path)
+
+    def select_action(self, state, legal=None):
+        """
+        Select the action with the highest Q-value for one encoded state, shaped like backprop.select_action.
+        With a (1, 4) bool legal-move mask only the actions that change the board are considered.
+        """
+        return self.select_actions(state, legal).view(1, 1)
+
+    def select_actions(self, states, legal=None):
+        """
+        Select the action with the highest Q-value for a batch of encoded states,
+        among the actions set in the (N, 4) bool legal-move mask if one is given.
+        """
+        with torch.no_grad():
+            q_values = self.policy(states.cpu())
+            if legal is not None:
+                q_values = q_values.masked_fill(~legal.cpu(), float("-inf"))
+            return q_values.max(1)[1].view(-1, 1)
+
+def sample_boards(n, seed=0):
+    """
+    Collect n encoded boards from random play, used as a held-out set for checking a frozen policy.
+    """
+    games = VecGame2048(min(n, 256), seed=seed)
+    rng = np.random.default_rng(seed)
+    exponents = []
+    while sum(len(e) for e in exponents) < n:
+        games.step(rng.integers(0, 4, games.num_envs))
+        exponents.append(games.exponents.copy())
+    return OneHotEncoder(n, torch.device("cpu"))(np.concatenate(exponents)[:n]).clone()
+
+def check_decisions(model, policy, states, batch_size=256):
+    """
+    Compare the argmax actions of the eager model and a frozen policy on the same states.
+    Returns the fraction of states on which both pick the same action.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    agree = 0
+    with torch.no_grad():
+        for start in range(0, len(states), batch_size):
+            batch = states[start:start + batch_size]
+            agree += (model(batch).argmax(1) == policy(batch).argmax(1)).sum().item()
+    return agree / len(states)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Freeze a trained DQN into a TorchScript artifact for CPU inference")
+    parser.add_argument("weights", help="state_dict of the trained policy network")
+    parser.add_argument("output", help="path of the frozen policy artifact")
+    parser.add_argument("--no-quantize", action="store_true", help="keep the dense layers in float32")
+    parser.add_argument("--no-channels-last", action="store_true", help="keep the default conv memory layout")
+    parser.add_argument("--check-boards", type=int, default=1000, help="held-out boards to compare decisions on")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="fail below this argmax agreement")
+    args = parser.parse_args()
+
+    model = DQN()
+    model.load_state_dict(torch.load(args.weights, map_location="cpu"))
+    policy = export_policy(model, args.output, not args.no_quantize, not args.no_channels_last)
+
+    agreement = check_decisions(model, load_policy(args.output), sample_boards(args.check_boards))
+    print(f"argmax agreement with the eager model: {agreement:.4f}")
+    if agreement < args.min_agreement:
+        raise SystemExit(f"agreement below {args.min_agreement}")
@@ -5,6 +5,23 @@ EPS_START = 0.9  # Starting value of epsilon for epsilon-greedy action selection
 EPS_END = 0.01  # Minimum value of epsilon for epsilon-greedy action selection
 EPS_DECAY = 0.9999  # Decay factor for epsilon
 TARGET_UPDATE = 20  # Number of timesteps between updates of the target network
+NUM_ENVS = 16  # Number of games played in lockstep during self-play
+GAME_BACKEND = "vector"  # Game backend of self-play: "vector" (NumPy batch) or a GameCore backend ("python", "numpy", "packed")
+PRIORITIZED_REPLAY = False  # Sample transitions in proportion to their TD error instead of uniformly
+PER_ALPHA = 0.6  # How strongly priorities skew sampling (0 is uniform)
+PER_BETA = 0.4  # Starting strength of the importance-sampling correction, annealed to 1
+PER_BETA_INCREMENT = 1e-4  # Increase of beta per sampled batch
+NUM_ACTORS = 4  # Number of actor processes generating experience in actor/learner mode
+WEIGHT_SYNC_INTERVAL = 500  # Actor steps between checks for newer policy weights
+PUBLISH_INTERVAL = 50  # Learner gradient steps between publishing policy weights to the actors
+REPLAY_SIZE = 50000  # Number of transitions kept in the shared replay buffer
+BACKGROUND_LEARNER = False  # Run gradient steps on a background thread while the games are stepped
+UPDATES_PER_STEP = 0.25  # Gradient steps per environment step in background learner mode
+TARGET_UPDATE_STEPS = 1000  # Gradient steps between target network updates in background learner mode
+REPLAY_PATH = None  # Directory of a memory-mapped replay buffer that survives restarts (None keeps it in memory)
+CHECKPOINT_PATH = "checkpoint.pt"  # File the training state is checkpointed to
+CHECKPOINT_INTERVAL = 50  # Episodes between checkpoints
+AUGMENT_SYMMETRIES = False  # Train on a random rotation/reflection of every sampled transition
 
 # Define the number of possible actions
 n_actions = 4
\ No newline at end of file
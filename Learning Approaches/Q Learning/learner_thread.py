@@ -0,0 +1,103 @@
+import copy
+import threading
+import time
+import backprop
+from backprop import policy_net, target_net
+
+class BackgroundLearner(threading.Thread):
+    def __init__(self, updates_per_step, publish_interval, target_update_steps):
+        """
+        Run backprop() on a background thread while the main thread keeps stepping the games.
+        PyTorch releases the GIL inside its kernels, so gradient steps and environment steps overlap.
+
+        The thread runs updates_per_step gradient steps per environment step recorded with add_steps.
+        Acting uses two copies of the policy weights: the main thread reads the front copy
+        while the learner writes the back copy every publish_interval gradient steps, then swaps them.
+        The target network is refreshed every target_update_steps gradient steps.
+        Each gradient step runs under lock, so holding it pauses the learner between steps.
+        """
+        super(BackgroundLearner, self).__init__(daemon=True)
+        self.updates_per_step = updates_per_step
+        self.publish_interval = publish_interval
+        self.target_update_steps = target_update_steps
+
+        self.acting_nets = [copy.deepcopy(policy_net).eval(), copy.deepcopy(policy_net).eval()]
+        self.front = 0  # Index of the acting copy holding the latest published weights
+        self.reading = 0  # Index of the acting copy the main thread is using
+
+        self.env_steps = 0
+        self.updates = 0
+        self.running = True
+        self.lock = threading.Lock()
+
+    def acting_net(self):
+        """
+        Return the latest published policy snapshot for action selection.
+        The snapshot is marked as in use before it is returned, so the learner never writes into it.
+        """
+        while True:
+            front = self.front
+            self.reading = front
+            if self.front == front:
+                return self.acting_nets[front]
+
+    def add_steps(self, steps):
+        """
+        Record environment steps, allowing the learner to run more gradient steps.
+        """
+        self.env_steps += steps
+
+    def publish(self):
+        """
+        Copy the policy weights into the back acting copy and make it the front one,
+        unless the main thread is still reading the back copy.
+        """
+        back = 1 - self.front
+        if self.reading == back:
+            return False
+        self.acting_nets[back].load_state_dict(policy_net.state_dict())
+        self.front = back
+        return True
+
+    def run(self):
+        pending_publish = False
+        while self.running:
+            # Keep the ratio of gradient steps to environment steps
+            if self.updates >= self.updates_per_step * self.env_steps or len(backprop.memory) < backprop.BATCH_SIZE:
+                time.sleep(0.001)
+                continue
+
+            with self.lock:
+                backprop.backprop()
+                self.updates += 1
+
+                if self.updates % self.target_update_steps == 0:
+                    target_net.load_state_dict(policy_net.state_dict())
+                if self.updates % self.publish_interval == 0:
+                    pending_publish = True
+                if pending_publish:
+                    pending_publish = not self.publish()
+
+    def state_dict(self):
+        """
+        Return the step counters, so a resumed run keeps the same ratio of gradient steps to environment steps.
+        Call it while holding lock.
+        """
+        return {"env_steps": self.env_steps, "updates": self.updates}
+
+    def load_state_dict(self, state):
+        """
+        Restore the step counters saved by state_dict and publish the restored policy weights to both acting copies.
+        Call it before the thread is started.
+        """
+        self.env_steps = state["env_steps"]
+        self.updates = state["updates"]
+        for net in self.acting_nets:
+            net.load_state_dict(policy_net.state_dict())
+
+    def stop(self):
+        """
+        Stop the thread after its current gradient step.
+        """
+        self.running = False
+        self.join()
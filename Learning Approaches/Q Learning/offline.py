@@ -0,0 +1,199 @@
+import argparse
+import time
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
+from GameEmulator.recorder import chunk_paths, load_chunk, unpack_boards, NO_ACTION
+from GameEmulator import profiling
+from GameEmulator.profiling import span, count
+from GameEmulator.VecGame import legal_moves
+from utils import OneHotEncoder, DihedralAugmenter, legal_mask
+from init_param import *
+import backprop
+
+# One transition decoded from two consecutive records of a recorded game, boards stay packed until a batch is encoded
+TRANSITION_DTYPE = np.dtype([('state', '<u8'), ('next_state', '<u8'), ('reward', '<f4'), ('action', 'u1'),
+                             ('done', '?'), ('next_legal', 'u1')])
+
+# Penalty for a move that does not change the board, as in training.py
+INVALID_MOVE_PENALTY = 10
+
+def chunk_transitions(records, start, stop, penalty=INVALID_MOVE_PENALTY):
+    # Decodes the transitions starting at records[start:stop] of a chunk. The last record of every game holds its
+    # final board and starts no transition, the move into it is done. Reads one record past stop for the next board.
+    block = np.asarray(records[start:stop + 1])
+    current, following = block[:-1], block[1:]
+    valid = current['action'] != NO_ACTION
+    current, following = current[valid], following[valid]
+
+    transitions = np.empty(len(current), dtype=TRANSITION_DTYPE)
+    transitions['state'] = current['board']
+    transitions['next_state'] = following['board']
+    transitions['action'] = current['action']
+    transitions['done'] = following['action'] == NO_ACTION
+    not_moved = (current['board'] == following['board']) & ~transitions['done']
+    transitions['reward'] = current['score'] - penalty * not_moved
+    # Legal-move bitmask of every next board, final boards have no legal moves
+    transitions['next_legal'] = np.where(transitions['done'], 0, legal_moves(unpack_boards(following['board'])))
+    return transitions
+
+class TrajectoryDataset(IterableDataset):
+    def __init__(self, directories, batch_size=BATCH_SIZE, shuffle_buffer=100000, block_size=4096,
+                 augment=AUGMENT_SYMMETRIES, prefix="games"):
+        """
+        Stream shuffled minibatches of transitions from games written by GameEmulator.recorder.TrajectoryRecorder.
+
+        The chunk files are memory-mapped and cut into blocks of block_size records, which are read in a random
+        order. Transitions go through a shuffle buffer holding shuffle_buffer of them, each batch is drawn at
+        random from the buffer and its places are refilled from the stream, so memory stays bounded however
+        large the recording is. With several DataLoader workers, each worker reads its own share of the blocks
+        and keeps its own shuffle buffer.
+
+        Boards are unpacked to tile exponents, optionally given a random symmetry, and one-hot encoded per batch.
+        Every batch has the layout of ReplayBuffer.sample, so it can be passed to backprop.learn.
+        """
+        super(TrajectoryDataset, self).__init__()
+        self.paths = [path for directory in directories for path in chunk_paths(directory, prefix)]
+        if not self.paths:
+            raise ValueError(f"no recorded games in {', '.join(directories)}")
+        self.batch_size = batch_size
+        self.shuffle_buffer = max(shuffle_buffer, batch_size)
+        self.block_size = block_size
+        self.augment = augment
+
+        # Blocks of every chunk, up to the last game in its index, so partly written games are skipped
+        self.blocks = []
+        self.transitions = 0
+        for chunk, path in enumerate(self.paths):
+            records, games = load_chunk(path)
+            if len(games) == 0:
+                continue
+            end = int((games['offset'] + games['length']).max())
+            self.blocks.extend((chunk, start, min(start + block_size, end)) for start in range(0, end, block_size))
+            self.transitions += end - len(games)
+
+    def encode(self, transitions, augmenter):
+        # Unpacks, augments and one-hot encodes a batch, with new tensors so DataLoader workers can hand them over
+        states = unpack_boards(transitions['state'])
+        next_states = unpack_boards(transitions['next_state'])
+        actions = transitions['action']
+        next_legal = transitions['next_legal']
+        if augmenter is not None:
+            states, next_states, actions, next_legal = augmenter(states, next_states, actions, next_legal)
+        n = len(transitions)
+        cpu = torch.device("cpu")
+        return (OneHotEncoder(n, cpu)(states),
+                torch.from_numpy(actions.astype(np.int64)).view(-1, 1),
+                OneHotEncoder(n, cpu)(next_states),
+                torch.from_numpy(transitions['reward'].copy()),
+                torch.from_numpy(transitions['done'].copy()),
+                legal_mask(next_legal, cpu),
+                torch.ones(n))
+
+    def __iter__(self):
+        info = get_worker_info()
+        if info is None:
+            worker, num_workers, seed = 0, 1, int(torch.randint(2 ** 62, ()))
+        else:
+            worker, num_workers, seed = info.id, info.num_workers, info.seed
+        rng = np.random.default_rng(seed)
+        augmenter = DihedralAugmenter(rng.integers(2 ** 62)) if self.augment else None
+
+        blocks = self.blocks[worker::num_workers]
+        order = rng.permutation(len(blocks))
+        chunks = {}
+        buffer = np.empty(self.shuffle_buffer, dtype=TRANSITION_DTYPE)
+        size = 0
+
+        for block in order:
+            chunk, start, stop = blocks[block]
+            if chunk not in chunks:
+                chunks[chunk] = load_chunk(self.paths[chunk])[0]
+            transitions = chunk_transitions(chunks[chunk], start, stop)
+
+            while len(transitions):
+                # Fill the free places of the buffer from the stream
+                taken = min(self.shuffle_buffer - size, len(transitions))
+                buffer[size:size + taken] = transitions[:taken]
+                size += taken
+                transitions = transitions[taken:]
+                if size < self.shuffle_buffer:
+                    break
+
+                # Draw a batch and move transitions from the end of the buffer into its places
+                picked = rng.choice(size, self.batch_size, replace=False)
+                batch = buffer[picked]
+                tail = np.ones(self.batch_size, dtype=bool)
+                tail[picked[picked >= size - self.batch_size] - (size - self.batch_size)] = False
+                holes = picked[picked < size - self.batch_size]
+                buffer[holes] = buffer[size - self.batch_size:size][tail]
+                size -= self.batch_size
+                yield self.encode(batch, augmenter)
+
+        # Empty the buffer at the end of the pass
+        remaining = buffer[:size][rng.permutation(size)]
+        for start in range(0, size, self.batch_size):
+            yield self.encode(remaining[start:start + self.batch_size], augmenter)
+
+def train_offline(dataset, epochs=1, num_workers=2, report_interval=1000, output=None):
+    """
+    Train the policy network on recorded games with the loss of backprop(), without playing any game.
+    The target network is refreshed every TARGET_UPDATE_STEPS gradient steps and the policy weights are
+    saved to output after every epoch. Returns the number of gradient steps taken.
+    """
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers,
+                        pin_memory=backprop.device.type == "cuda")
+    backprop.policy_net.train()
+    steps = 0
+    for epoch in range(epochs):
+        start = time.time()
+        losses = []
+        samples = 0
+        for batch in loader:
+            batch = [tensor.to(backprop.device, non_blocking=True) for tensor in batch]
+            losses.append(backprop.learn(*batch))
+            samples += batch[0].shape[0]
+            count("offline.samples", batch[0].shape[0])
+            steps += 1
+
+            # Update the target network periodically
+            if steps % TARGET_UPDATE_STEPS == 0:
+                backprop.target_net.load_state_dict(backprop.policy_net.state_dict())
+
+            if steps % report_interval == 0:
+                print(f"epoch {epoch} step {steps} loss {torch.stack(losses).mean().item():.3f} "
+                      f"{samples / (time.time() - start):.0f} samples/sec")
+                losses = []
+
+        if output is not None:
+            with span("offline.save"):
+                torch.save(backprop.policy_net.state_dict(), output)
+        print(f"epoch {epoch} done, {samples} samples in {time.time() - start:.1f}s")
+    return steps
+
+# Offline training code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the DQN on recorded games instead of self-play")
+    parser.add_argument("directories", nargs="+", help="directories of trajectory files written with --record")
+    parser.add_argument("--epochs", type=int, default=1, help="passes over the recorded games")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="transitions per gradient step")
+    parser.add_argument("--shuffle-buffer", type=int, default=100000, help="transitions in each shuffle buffer")
+    parser.add_argument("--num-workers", type=int, default=2, help="DataLoader worker processes")
+    parser.add_argument("--weights", help="policy state_dict to continue from")
+    parser.add_argument("--output", default="policy_weights.pt", help="file the policy state_dict is saved to")
+    parser.add_argument("--report-interval", type=int, default=1000, help="gradient steps between reports")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the shuffling and augmentation")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start(args)
+
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+    if args.weights:
+        backprop.policy_net.load_state_dict(torch.load(args.weights, map_location=backprop.device))
+    backprop.target_net.load_state_dict(backprop.policy_net.state_dict())
+
+    dataset = TrajectoryDataset(args.directories, args.batch_size, args.shuffle_buffer)
+    print(f"{dataset.transitions} transitions in {len(dataset.paths)} chunks")
+    train_offline(dataset, args.epochs, args.num_workers, args.report_interval, args.output)
+    profiling.finish(args)
@@ -1,70 +1,142 @@
-from utils import hot_encoding, get_processor, same_move
+import argparse
+import contextlib
+from utils import OneHotEncoder, get_processor, legal_mask, same_move
+import backprop
 from backprop import *
 import torch
-from GameEmulator.QGame import Game2048
-from itertools import count
+from GameEmulator.core import make_batch
+from GameEmulator.VecGame import legal_moves
+from GameEmulator.recorder import TrajectoryRecorder
+from GameEmulator import profiling
+from GameEmulator.profiling import span, count
+from learner_thread import BackgroundLearner
+from checkpoint import CheckpointWriter, training_state, restore_training_state
+
+parser = argparse.ArgumentParser(description="Train the DQN agent by self-play")
+parser.add_argument("--resume", action="store_true", help="continue from the checkpoint instead of starting over")
+parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="file the training state is checkpointed to")
+parser.add_argument("--checkpoint-interval", type=int, default=CHECKPOINT_INTERVAL, help="episodes between checkpoints")
+parser.add_argument("--record", metavar="DIR", help="write every self-play game to trajectory files in DIR")
+profiling.add_arguments(parser)
+args = parser.parse_args()
+profiling.start(args)
 
 # Get the device (CPU or GPU) for computation
 device = get_processor()
 
-# Initialize the 2048 game emulator
-game = Game2048()
+# Initialize the replay buffer backprop() samples from
+memory = init_memory()
+
+# Initialize a batch of 2048 game emulators played in lockstep
+games = make_batch(NUM_ENVS, GAME_BACKEND)
 
 # Set the number of epochs for training
 epochs = 500
 
-# Loop over episodes
-for epoch in range(epochs):
+# Optionally learn on a background thread instead of at the end of every episode
+learner = None
+if BACKGROUND_LEARNER:
+    learner = BackgroundLearner(UPDATES_PER_STEP, PUBLISH_INTERVAL, TARGET_UPDATE_STEPS)
+
+# Continue from the last checkpoint, the replay buffer is reopened from REPLAY_PATH if set
+epoch = 0
+if args.resume:
+    epoch = restore_training_state(args.checkpoint, games, learner)
+    print(f"Resumed from {args.checkpoint} at episode {epoch} with {len(memory)} stored transitions")
+writer = CheckpointWriter(args.checkpoint, memory)
+last_checkpoint = epoch
+
+def save_checkpoint():
+    # The background learner is paused while the state is copied, so the weights and optimizer match
+    with contextlib.nullcontext() if learner is None else learner.lock:
+        writer.save(training_state(epoch, games, learner))
+
+# Encode the boards of all games at once into a reused tensor
+encode = OneHotEncoder(NUM_ENVS, device)
+states = encode(games.exponents)
+# Legal-move bitmasks of the boards, actions are only picked among the moves that change the board
+legal = legal_moves(games.exponents)
 
-    print(f"Episode {epoch}")
-  
-    game.reset()  
-    state = hot_encoding(game.board).float()
+# Optionally keep every game played, the games in progress when training stops are not written
+recorder = TrajectoryRecorder(args.record) if args.record else None
 
-    # Flag for the same move
-    duplicate = False
+# Last transition stored by each game, used to skip duplicate moves
+last_memory = [None] * NUM_ENVS
 
-    # Iterate over game steps within the epoch
-    for _ in count():
-        
-        # Select and perform an action
-        action = select_action(state)
-        old_score = game.score
-        old_max = game.board.max()
-        game.take_turn(action.item())
+if learner is not None:
+    learner.start()
 
-        # Check if the game is over
-        game_over = not game.check_valid()
+# Loop until enough episodes have finished across all games
+while epoch < epochs:
 
-        # Calculate reward 
-        reward = (game.score - old_score)
-        reward = torch.tensor([reward], device=device)
+    # Select actions for every game with one forward pass and perform them
+    with span("training.act"):
+        mask = legal_mask(legal, device)
+        actions = select_actions(states, None if learner is None else learner.acting_net(), mask)
+    with span("training.step"):
+        exponents = games.exponents.copy()
+        played = actions.view(-1).cpu().numpy()
+        boards, rewards, dones, moved = games.step(played)
+    if recorder is not None:
+        with span("training.record"):
+            recorder.record_batch(exponents, played, games.exponents, dones, games.final_exponents, games.final_scores)
 
-        # Observe new state
-        if not game_over:
-            next_state = hot_encoding(game.board).float()
+    # Observe new states, finished games are already reset by the emulator
+    with span("training.encode"):
+        next_states = encode(games.exponents)
+        next_legal = legal_moves(games.exponents)
+    count("training.env_steps", NUM_ENVS)
+    if learner is not None:
+        learner.add_steps(NUM_ENVS)
 
-        else:
-            next_state = None
+    for i in range(NUM_ENVS):
+        # The replay buffer stores boards as tile exponents
+        state = exponents[i]
+        next_state = None if dones[i] else games.exponents[i].copy()
+        reward = float(rewards[i])
 
         # Check for invalid moves and penalize
-        if next_state != None and torch.eq(state, next_state).all():
-            
+        if next_state is not None and not moved[i]:
             reward -= 10
-        
-        # Store the transition in memory if not duplicate
-        if next_state == None or len(memory) == 0 or not same_move(state, next_state, memory.memory[-1]):
-            memory.push(state, action, next_state, reward)
 
-        # Move to the next state
-        state = next_state
+        # Store the transition in memory if not duplicate
+        with span("training.store"):
+            if next_state is None or last_memory[i] is None or not same_move(state, next_state, last_memory[i]):
+                last_memory[i] = Transition(state, actions[i].item(), next_state, reward,
+                                            0 if next_state is None else next_legal[i])
+                memory.push(*last_memory[i])
 
-        # If the game is over, break the loop
-        if game_over:
+        # If the game is over, learn from the stored experience
+        if dones[i]:
+            print(f"Episode {epoch} score {games.final_scores[i]}")
+            if memory.augmenter is not None:
+                print(f"Augmentation cost {memory.augmenter.cost():.1f} us per batch")
+            last_memory[i] = None
+            epoch += 1
+            count("training.episodes")
+            if learner is not None:
+                continue
             backprop()
-            break
 
-    # Update the target network periodically
-    if epoch % TARGET_UPDATE == 0:
-        target_net.load_state_dict(policy_net.state_dict())
-        policy_net.train()
+            # Update the target network periodically
+            if epoch % TARGET_UPDATE == 0:
+                target_net.load_state_dict(policy_net.state_dict())
+                policy_net.train()
+
+    # Move to the next states
+    states = next_states
+    legal = next_legal
+
+    # Checkpoint periodically, the writer thread does the disk I/O
+    if epoch - last_checkpoint >= args.checkpoint_interval:
+        with span("training.checkpoint"):
+            save_checkpoint()
+        last_checkpoint = epoch
+
+if learner is not None:
+    learner.stop()
+if recorder is not None:
+    recorder.close()
+save_checkpoint()
+writer.close()
+profiling.finish(args)
@@ -1,7 +1,9 @@
-import math
+import time
+import numpy as np
 import torch
 import torch.nn.functional as F
 from collections import namedtuple
+from GameEmulator.profiling import timed
 
 def get_processor():
    """
@@ -10,36 +12,157 @@ def get_processor():
     """
    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Exponent of every tile value up to 32768, indexed by the value itself
+TILE_EXPONENTS = np.zeros(1 << 16, dtype=np.int64)
+TILE_EXPONENTS[1 << np.arange(1, 16)] = np.arange(1, 16)
+NIBBLE_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+
+def board_exponents(boards):
+  """
+    Converts boards of tile values, a (4, 4) or (N, 4, 4) array, into tile exponents
+    with a single lookup in TILE_EXPONENTS.
+    """
+  return TILE_EXPONENTS[np.asarray(boards)]
+
+def packed_exponents(boards):
+  """
+    Converts packed 64-bit boards (see GameEmulator.BitGame), an (N,) array or list,
+    into an (N, 4, 4) array of tile exponents.
+    """
+  boards = np.asarray(boards, dtype=np.uint64).reshape(-1, 1)
+  return ((boards >> NIBBLE_SHIFTS) & np.uint64(0xF)).astype(np.int64).reshape(-1, 4, 4)
+
+class OneHotEncoder(object):
+  """
+    Encodes batches of boards into (N, 16, 4, 4) one-hot float tensors, writing into
+    a preallocated output tensor that is reused by every call. The returned tensor is
+    a view of that output, so it is overwritten by the next call on the same encoder.
+    """
+  def __init__(self, batch_size=1, device=None):
+    self.device = device if device is not None else get_processor()
+    self.out = torch.zeros((batch_size, 16, 4, 4), device=self.device)
+
+  @timed("OneHotEncoder")
+  def __call__(self, exponents):
+    """
+      Encodes an (N, 4, 4) array of tile exponents, growing the output tensor if N is
+      larger than any batch seen before.
+      """
+    n = len(exponents)
+    if n > self.out.shape[0]:
+      self.out = torch.zeros((n, 16, 4, 4), device=self.device)
+    index = torch.from_numpy(np.ascontiguousarray(exponents, dtype=np.int64)).to(self.device)
+    out = self.out[:n]
+    out.zero_()
+    out.scatter_(1, index.view(n, 1, 4, 4), 1.0)
+    return out
+
+  def encode_boards(self, boards):
+    """
+      Encodes an (N, 4, 4) array of tile values.
+      """
+    return self(board_exponents(boards))
+
+  def encode_packed(self, boards):
+    """
+      Encodes an (N,) array of packed 64-bit boards.
+      """
+    return self(packed_exponents(boards))
+
+@timed("hot_encoding")
 def hot_encoding(board):
   """
-    Encodes the game board using one-hot encoding. The board is flattened, and each
-    non-zero element is replaced with its base-2 logarithm (rounded down). The
-    resulting sequence is converted to a LongTensor and then one-hot encoded using
-    the F.one_hot function from PyTorch. The encoded tensor is then reshaped and
-    permuted to match the desired output format.
+    Encodes a single game board of tile values into a new (1, 16, 4, 4) one-hot
+    tensor, with channel i set where the cell holds 2**i (channel 0 for empty cells).
+    """
+  return OneHotEncoder(1, torch.device("cpu"))(board_exponents(board).reshape(1, 4, 4))
+
+# Action after each of the 8 board symmetries, indexed by symmetry and action
+# (0: left, 1: up, 2: right, 3: down). Symmetry 4 * t + k transposes the board if t
+# and then rotates it k quarter turns with np.rot90, which turns action a into a - k.
+TRANSPOSED_ACTIONS = np.array([1, 0, 3, 2])
+SYMMETRY_ACTIONS = np.array([(actions - k) % 4 for actions in (np.arange(4), TRANSPOSED_ACTIONS)
+                             for k in range(4)], dtype=np.int8)
+
+# Legal-move bitmask after each of the 8 board symmetries, indexed by symmetry and bitmask,
+# bit d of a bitmask is set when action d changes the board
+SYMMETRY_LEGAL = np.array([[sum(1 << int(SYMMETRY_ACTIONS[symmetry, action])
+                                 for action in range(4) if legal >> action & 1)
+                            for legal in range(16)] for symmetry in range(8)], dtype=np.uint8)
+LEGAL_BITS = np.array([1, 2, 4, 8], dtype=np.uint8)
+
+def legal_mask(legal, device=None):
+  """
+    Expands an (N,) array of legal-move bitmasks into an (N, 4) bool tensor, True for the
+    actions that change the board.
+    """
+  mask = (np.asarray(legal, dtype=np.uint8).reshape(-1, 1) & LEGAL_BITS) != 0
+  return torch.from_numpy(mask).to(device if device is not None else get_processor())
+
+def symmetry_view(exponents, symmetry):
+  """
+    Returns an (N, 4, 4) batch of boards under one of the 8 symmetries as a strided view,
+    without copying the boards.
+    """
+  if symmetry >= 4:
+    exponents = exponents.transpose(0, 2, 1)
+  return np.rot90(exponents, symmetry % 4, axes=(1, 2))
+
+class DihedralAugmenter(object):
+  """
+    Applies a random rotation/reflection to every sampled transition. The state and
+    next_state of a transition get the same symmetry, the action and the legal moves of
+    next_state are remapped to match, rewards and done flags are unchanged. Keeps the time
+    it spends per batch.
+    """
+  def __init__(self, seed=None):
+    self.rng = np.random.default_rng(seed)
+    self.batches = 0
+    self.seconds = 0.0
+
+  def __call__(self, states, next_states, actions, next_legal):
+    """
+      Transforms (N, 4, 4) arrays of state and next_state exponents, the (N,) actions and
+      the (N,) legal-move bitmasks of next_state.
+      """
+    start = time.perf_counter()
+    symmetries = self.rng.integers(0, 8, len(states))
+    augmented_states = np.empty_like(states)
+    augmented_next_states = np.empty_like(next_states)
+    for symmetry in range(8):
+      mask = symmetries == symmetry
+      if mask.any():
+        augmented_states[mask] = symmetry_view(states[mask], symmetry)
+        augmented_next_states[mask] = symmetry_view(next_states[mask], symmetry)
+    actions = SYMMETRY_ACTIONS[symmetries, actions]
+    next_legal = SYMMETRY_LEGAL[symmetries, next_legal]
+    self.seconds += time.perf_counter() - start
+    self.batches += 1
+    return augmented_states, augmented_next_states, actions, next_legal
+
+  def cost(self):
     """
-  board_flat = [0 if e == 0 else int(math.log(e,2)) for e in board.flatten()]
-  board_flat = torch.LongTensor(board_flat)
-  board_flat = F.one_hot(board_flat, num_classes=16).float().flatten()
-  board_flat = board_flat.reshape(1, 4, 4, 16).permute(0, 3, 1, 2)
-  return board_flat
+      Returns the mean time spent per batch in microseconds.
+      """
+    return 1e6 * self.seconds / max(self.batches, 1)
 
 def transition():
   """
-    Returns a namedtuple `Transition` with elements state, action, next_state, and reward.
+    Returns a namedtuple `Transition` with elements state, action, next_state, reward and next_legal.
     This namedtuple is used to represent a single transition in the reinforcement learning
     environment, where state represents the current state of the environment, action is
     the action taken by the agent in the current state, next_state represents the
     resulting state of the environment after the action has been taken, and reward is
-    the reward obtained by the agent for taking the action in the current state.
+    the reward obtained by the agent for taking the action in the current state. next_legal
+    is the legal-move bitmask of next_state (bit d set when action d changes the board).
     """
   return namedtuple('Transition',
-                        ('state', 'action', 'next_state', 'reward'))
+                        ('state', 'action', 'next_state', 'reward', 'next_legal'))
 
 def same_move(state, next_state, last_memory):
   """
     Checks if the state and next_state are the same as the state and next_state
     contained in the last_memory object.
     """
-  return torch.eq(state, last_memory.state).all() and torch.eq(next_state, last_memory.next_state).all()
+  return (state == last_memory.state).all() and (next_state == last_memory.next_state).all()
 
@@ -1,12 +1,19 @@
+import argparse
 import random
 from GameEmulator.RLGame import Game2048
+from GameEmulator.core import BACKENDS, DEFAULT_BACKEND
 
 # List of all possible actions
 action_space = ['UP', 'DOWN', 'LEFT', 'RIGHT']
 
 if __name__ == "__main__":
-    game = Game2048()
-    for _ in range(10):
+    parser = argparse.ArgumentParser(description="Play 2048 with random actions")
+    parser.add_argument("--moves", type=int, default=10, help="number of actions to play")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=DEFAULT_BACKEND, help="game core backend")
+    args = parser.parse_args()
+
+    game = Game2048(backend=args.backend)
+    for _ in range(args.moves):
         # Randomly choose an action from the action space
         action = random.choice(action_space)
         game.state_action(action)
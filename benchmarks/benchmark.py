@@ -0,0 +1,413 @@
+#Measuring the speed of the emulators, agents and training hot paths with fixed seeds
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The agents import their neighbouring modules by name, as when they are run from their own directory
+for directory in (ROOT, os.path.join(ROOT, "Learning Approaches", "Monte Carlo"),
+                  os.path.join(ROOT, "Learning Approaches", "Q Learning")):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+# Metrics ending in one of these suffixes are better when higher, all others (times) when lower
+HIGHER_IS_BETTER = ("_per_sec",)
+
+
+def seed_all(seed):
+    """
+    Seed every random generator the benchmarked code draws from.
+
+    Args:
+        seed (int): The seed.
+    """
+
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        import torch
+        torch.manual_seed(seed)
+    except ImportError:
+        pass
+
+
+def best_time(function, repeat):
+    """
+    Time a function several times and keep the fastest run, the one least disturbed by other work.
+
+    Args:
+        function (callable): The function to time, called without arguments.
+        repeat (int): The number of runs.
+
+    Returns:
+        float: The fastest run in seconds.
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_qgame(seed, scale, repeat):
+    from GameEmulator.QGame import Game2048
+    moves = int(5000 * scale)
+
+    def play():
+        seed_all(seed)
+        game = Game2048()
+        for _ in range(moves):
+            game.take_turn(random.randrange(4))
+            if not game.check_valid():
+                game.reset()
+
+    return {"moves_per_sec": moves / best_time(play, repeat)}
+
+
+def bench_mcgame(seed, scale, repeat):
+    from GameEmulator.MCGame import Game2048
+    moves = int(5000 * scale)
+
+    def play():
+        seed_all(seed)
+        game = Game2048()
+        board = game.add_new_tile(game.add_new_tile(np.zeros((4, 4), dtype=int)))
+        for _ in range(moves):
+            board, valid, _ = game.random_move(board)
+            if valid:
+                board = game.add_new_tile(board)
+            else:
+                board = game.add_new_tile(game.add_new_tile(np.zeros((4, 4), dtype=int)))
+
+    return {"moves_per_sec": moves / best_time(play, repeat)}
+
+
+def bench_rlgame(seed, scale, repeat):
+    from GameEmulator.RLGame import Game2048
+    moves = int(5000 * scale)
+    actions = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+
+    def play():
+        seed_all(seed)
+        game = Game2048()
+        game.new_pieces()
+        for _ in range(moves):
+            game.state_action(random.choice(actions))
+            game.take_turn()
+            if game.new_pieces():
+                game.reset_game()
+                game.new_pieces()
+
+    return {"moves_per_sec": moves / best_time(play, repeat)}
+
+
+def bench_game_logic(seed, scale, repeat):
+    from GameEmulator.Game import Game2048
+    moves = int(5000 * scale)
+
+    def play():
+        seed_all(seed)
+        game = Game2048(headless=True)
+        for _ in range(moves):
+            game.param_run_game(random.choice(game.action_space))
+
+    return {"moves_per_sec": moves / best_time(play, repeat)}
+
+
+def bench_mcagent(seed, scale, repeat):
+    from GameEmulator.RLGame import Game2048
+    from MCagent import MonteCarlo2048
+    moves = max(1, int(20 * scale))
+    rollouts = [0]
+
+    def play():
+        seed_all(seed)
+        game = Game2048()
+        agent = MonteCarlo2048(game, cache_size=0)
+        rollout = agent.rollout
+
+        def counted_rollout(game, afterstate):
+            rollouts[0] += 1
+            return rollout(game, afterstate)
+        agent.rollout = counted_rollout
+
+        rollouts[0] = 0
+        game.new_pieces()
+        game.new_pieces()
+        for move_number in range(1, moves + 1):
+            agent.searches_per_move, agent.search_length = agent.get_search_params(move_number)
+            game.board, valid, _ = agent.ai_move(game)
+            if not valid:
+                game.reset_game()
+                game.new_pieces()
+            game.new_pieces()
+
+    seconds = best_time(play, repeat)
+    return {"rollouts_per_sec": rollouts[0] / seconds, "move_latency_ms": 1000 * seconds / moves}
+
+
+def bench_mcagent2(seed, scale, repeat):
+    from GameEmulator.MCGame import Game2048
+    from MCagent2 import MonteCarlo
+    moves = max(1, int(20 * scale))
+    rollouts = [0]
+
+    def play():
+        seed_all(seed)
+        game = Game2048()
+        agent = MonteCarlo(game, 10, 4, 200, 1, cache_size=0)
+        simulate_moves = agent.simulate_moves
+
+        def counted_simulate_moves(game, first_boards, simulations, search_length_per_move):
+            rollouts[0] += sum(count for board, count in zip(first_boards, simulations) if board is not None)
+            return simulate_moves(game, first_boards, simulations, search_length_per_move)
+        agent.simulate_moves = counted_simulate_moves
+
+        rollouts[0] = 0
+        game.board = game.add_new_tile(game.add_new_tile(np.zeros((4, 4), dtype=int)))
+        for move_number in range(1, moves + 1):
+            agent.get_search_param(move_number)
+            board, valid = agent.ai_move(game, agent.searches_per_move, agent.search_length)
+            if not valid:
+                board = game.add_new_tile(np.zeros((4, 4), dtype=int))
+            game.board = game.add_new_tile(board)
+
+    seconds = best_time(play, repeat)
+    return {"rollouts_per_sec": rollouts[0] / seconds, "move_latency_ms": 1000 * seconds / moves}
+
+
+def random_boards(count, seed):
+    """
+    Build boards of tile values with a few tiles of mixed sizes, the same for every run with a seed.
+    """
+
+    rng = np.random.default_rng(seed)
+    exponents = rng.integers(0, 12, (count, 4, 4))
+    return np.where(exponents > 0, 2 ** exponents, 0)
+
+
+def bench_hot_encoding(seed, scale, repeat):
+    from utils import hot_encoding
+    boards = random_boards(int(2000 * scale), seed)
+
+    def encode():
+        for board in boards:
+            hot_encoding(board)
+
+    return {"boards_per_sec": len(boards) / best_time(encode, repeat)}
+
+
+def bench_replay_buffer(seed, scale, repeat):
+    from Model import ReplayBuffer
+    from utils import board_exponents
+    pushes = int(20000 * scale)
+    samples = max(1, int(200 * scale))
+    from GameEmulator.VecGame import legal_moves
+    exponents = board_exponents(random_boards(1000, seed)).astype(np.uint8)
+    # The legal moves of the next states come with the transitions, as in training.py
+    legal = legal_moves(exponents)
+    memory = ReplayBuffer(50000)
+
+    def push():
+        for i in range(pushes):
+            memory.push(exponents[i % 1000], i % 4, None if i % 50 == 0 else exponents[(i + 1) % 1000], 1.0,
+                        legal[(i + 1) % 1000])
+
+    def sample():
+        seed_all(seed)
+        for _ in range(samples):
+            memory.sample(64)
+
+    return {"push_us": 1e6 * best_time(push, repeat) / pushes,
+            "sample_64_ms": 1000 * best_time(sample, repeat) / samples}
+
+
+def bench_dqn(seed, scale, repeat):
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    import Model
+    from utils import OneHotEncoder, board_exponents
+
+    # Time the network on the CPU whatever device training would use
+    Model.device = torch.device("cpu")
+    seed_all(seed)
+    steps = max(1, int(3 * scale))
+    net = Model.DQN()
+    optimizer = optim.Adam(net.parameters(), lr=5e-5)
+    states = OneHotEncoder(64, torch.device("cpu"))(board_exponents(random_boards(64, seed))).clone()
+    targets = torch.zeros(64, 4)
+
+    def forward():
+        with torch.no_grad():
+            for _ in range(steps):
+                net(states)
+
+    def train_step():
+        for _ in range(steps):
+            loss = nn.MSELoss()(net(states), targets)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+    net.eval()
+    forward_seconds = best_time(forward, repeat)
+    net.train()
+    step_seconds = best_time(train_step, repeat)
+    return {"forward_64_ms": 1000 * forward_seconds / steps, "train_step_64_ms": 1000 * step_seconds / steps}
+
+
+BENCHMARKS = {
+    "qgame": bench_qgame,
+    "mcgame": bench_mcgame,
+    "rlgame": bench_rlgame,
+    "game_logic": bench_game_logic,
+    "mcagent": bench_mcagent,
+    "mcagent2": bench_mcagent2,
+    "hot_encoding": bench_hot_encoding,
+    "replay_buffer": bench_replay_buffer,
+    "dqn": bench_dqn,
+}
+
+
+def machine_metadata():
+    """
+    Describe the machine and code the benchmarks ran on, so results can be compared like for like.
+
+    Returns:
+        dict: The metadata.
+    """
+
+    metadata = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+    try:
+        import torch
+        metadata["torch"] = torch.__version__
+        metadata["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    try:
+        metadata["commit"] = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return metadata
+
+
+def run(names, seed=0, scale=1.0, repeat=3):
+    """
+    Run benchmarks and collect their results.
+
+    Benchmarks whose dependencies are missing are recorded as skipped.
+
+    Args:
+        names (list): The names of the benchmarks to run.
+        seed (int): The seed every benchmark starts from.
+        scale (float): Multiplier of the amount of work each benchmark does.
+        repeat (int): Number of timed runs, the fastest is kept.
+
+    Returns:
+        dict: The machine metadata, the settings and the metrics of every benchmark.
+    """
+
+    results = {"metadata": machine_metadata(), "seed": seed, "scale": scale, "repeat": repeat, "benchmarks": {}}
+    for name in names:
+        print(f"{name} ...", flush=True)
+        try:
+            metrics = BENCHMARKS[name](seed, scale, repeat)
+        except ImportError as error:
+            results["benchmarks"][name] = {"skipped": str(error)}
+            print(f"  skipped: {error}")
+            continue
+        results["benchmarks"][name] = metrics
+        for metric, value in metrics.items():
+            print(f"  {metric}: {value:.4g}")
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compare results against a baseline and find the metrics that got worse.
+
+    Args:
+        baseline (dict): Results saved by an earlier run.
+        current (dict): The results to check.
+        threshold (float): Relative change beyond which a metric counts as a regression.
+
+    Returns:
+        list: A (benchmark, metric, baseline value, current value, relative change) tuple per regression,
+        with the change positive when the metric got worse.
+    """
+
+    regressions = []
+    for name, metrics in current["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name, {})
+        for metric, value in metrics.items():
+            if metric == "skipped" or not isinstance(previous.get(metric), (int, float)) or previous[metric] == 0:
+                continue
+            change = (value - previous[metric]) / previous[metric]
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = -change
+            print(f"{name}.{metric}: {previous[metric]:.4g} -> {value:.4g} "
+                  f"({100 * abs(change):.1f}% {'worse' if change > 0 else 'better'})")
+            if change > threshold:
+                regressions.append((name, metric, previous[metric], value, change))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the 2048 emulators, agents and training hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run benchmarks and write their results as JSON")
+    run_parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                            help="benchmarks to run, all by default")
+    run_parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed every benchmark starts from")
+    run_parser.add_argument("--scale", type=float, default=1.0, help="multiplier of the work per benchmark")
+    run_parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the fastest is kept")
+    run_parser.add_argument("--baseline", help="results to compare against after running")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown counted as a regression")
+
+    compare_parser = subparsers.add_parser("compare", help="flag regressions of saved results against a baseline")
+    compare_parser.add_argument("baseline", help="JSON results of the baseline run")
+    compare_parser.add_argument("current", help="JSON results to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run(args.only, args.seed, args.scale, args.repeat)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+        baseline_path = args.baseline
+    else:
+        with open(args.current) as f:
+            results = json.load(f)
+        baseline_path = args.baseline
+
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        for name, metric, previous, value, change in regressions:
+            print(f"REGRESSION {name}.{metric}: {previous:.4g} -> {value:.4g} ({100 * change:.1f}% worse)")
+        if regressions:
+            sys.exit(1)
+        print("no regressions")